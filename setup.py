@@ -9,7 +9,7 @@ setup(
     author_email='hyu@redhat.com',
     license='GPLv2+',
     url='https://github.com/hao-yu/virt-who-tui.git',
-    packages=find_packages(),
+    packages=find_packages(exclude=["tests"]),
     entry_points={
         'console_scripts': [
             'virt-who-tui = virt_who_tui.__main__:main',
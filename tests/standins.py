@@ -0,0 +1,123 @@
+"""
+Local stand-ins for the servers probed by virt-who-tui, listening on
+ephemeral ports of the loopback interface.
+"""
+import os
+import ssl
+import time
+import socket
+import threading
+import SocketServer
+import BaseHTTPServer
+
+HOST = "127.0.0.1"
+CERT = os.path.join(os.path.dirname(__file__), "data", "localhost.pem")
+
+
+def closed_port():
+    """
+    Return a port nothing listens on
+    """
+    sock = socket.socket()
+    sock.bind((HOST, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # The probes often close the connections without making a request
+        pass
+
+
+class StandIn(object):
+    """
+    A server answering in threads, started and stopped as a context
+    manager
+    """
+    def __init__(self, handler, tls=False):
+        self.server = _Server((HOST, 0), handler)
+        # The host names sent by the TLS clients
+        self.server_names = []
+        if tls:
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.load_cert_chain(CERT)
+            context.set_servername_callback(lambda sock, name, context: self.server_names.append(name))
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+def http(routes, server="Apache", tls=False, delay=0):
+    """
+    A web server answering the paths of 'routes' with (status, headers,
+    body), and any other path with 404
+    """
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        server_version = server
+        sys_version = ""
+
+        def respond(self):
+            time.sleep(delay)
+            status, headers, body = routes.get(self.path, (404, {}, "Not found"))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = respond
+
+        def log_message(self, *args):
+            pass
+
+    return StandIn(Handler, tls)
+
+
+def libvirtd(program):
+    """
+    A libvirtd answering the RPC calls with the given program number
+    """
+    from virt_who_tui.discovery import LIBVIRT_HEADER
+
+    class Handler(SocketServer.BaseRequestHandler):
+        def handle(self):
+            call = self.request.recv(LIBVIRT_HEADER.size)
+            if len(call) == LIBVIRT_HEADER.size:
+                fields = list(LIBVIRT_HEADER.unpack(call))
+                fields[1] = program
+                self.request.sendall(LIBVIRT_HEADER.pack(*fields))
+
+    return StandIn(Handler)
+
+
+def silent():
+    """
+    A server accepting the connections and never answering
+    """
+    class Handler(SocketServer.BaseRequestHandler):
+        def handle(self):
+            self.request.settimeout(10)
+            try:
+                while self.request.recv(1024):
+                    pass
+            except socket.error:
+                pass
+
+    return StandIn(Handler)
@@ -0,0 +1,53 @@
+import unittest
+
+from virt_who_tui.catalog import Catalog
+
+ACME = {"key": "ACME", "displayName": "ACME Corporation"}
+
+
+class Connection(object):
+    """
+    Stand-in of the RHSM connection, counting the requests
+    """
+    def __init__(self):
+        self.requests = []
+
+    def getOwner(self, uuid):
+        self.requests.append(("getOwner", uuid))
+        return ACME
+
+    def getOwnerList(self, username):
+        self.requests.append(("getOwnerList", username))
+        return [ACME, {"key": "Initech"}]
+
+    def getEnvironmentList(self, owner):
+        self.requests.append(("getEnvironmentList", owner))
+        if owner != "ACME":
+            raise Exception("Environments aren't supported")
+        return [{"name": "Library"}]
+
+
+class CatalogFetchTest(unittest.TestCase):
+    def test_registered_host(self):
+        connection = Connection()
+        catalog = Catalog.fetch(connection, uuid="1234")
+        self.assertEqual(catalog.orgs, [("ACME", "ACME Corporation")])
+        self.assertEqual(catalog.environments, {"ACME": ["Library"]})
+        self.assertEqual(connection.requests, [("getOwner", "1234"), ("getEnvironmentList", "ACME")])
+
+    def test_owner_given(self):
+        connection = Connection()
+        catalog = Catalog.fetch(connection, uuid="1234", owner=ACME)
+        self.assertEqual(catalog.orgs, [("ACME", "ACME Corporation")])
+        self.assertEqual(connection.requests, [("getEnvironmentList", "ACME")])
+
+    def test_user(self):
+        connection = Connection()
+        catalog = Catalog.fetch(connection, "admin", owner=ACME)
+        self.assertEqual(catalog.orgs, [("ACME", "ACME Corporation"), ("Initech", "Initech")])
+        self.assertEqual(catalog.environments, {"ACME": ["Library"], "Initech": []})
+        self.assertEqual(connection.requests[0], ("getOwnerList", "admin"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from virt_who_tui import certs
+from tests import standins
+from tests.standins import HOST, CERT
+
+
+class CertificateFileTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "cert.pem")
+        shutil.copy(CERT, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_cached_until_modified(self):
+        cert = certs.load_certificate_file(self.path)
+        self.assertEqual(certs.common_name(cert.subject), "localhost")
+        self.assertTrue(certs.load_certificate_file(self.path) is cert)
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertFalse(certs.load_certificate_file(self.path) is cert)
+
+    def test_subject_common_name(self):
+        self.assertEqual(certs.subject_common_name(self.path), "localhost")
+        self.assertEqual(certs.subject_common_name(os.path.join(self.dir, "missing.pem")), None)
+
+
+class ServerCertificateTest(unittest.TestCase):
+    def test_server_name(self):
+        with standins.http({}, tls=True) as server:
+            der = certs.fetch_server_certificate("localhost", server.port, 5)
+        self.assertEqual(server.server_names, ["localhost"])
+        cert = certs.parse_certificate(der)
+        self.assertEqual(certs.certificate_warnings(cert, "localhost", cert.not_before + 1),
+                         ["The certificate of localhost is self-signed."])
+
+    def test_address_not_named(self):
+        with standins.http({}, tls=True) as server:
+            der = certs.fetch_server_certificate(HOST, server.port, 5)
+        self.assertEqual(server.server_names, [None])
+        cert = certs.parse_certificate(der)
+        self.assertEqual(certs.certificate_warnings(cert, HOST, cert.not_before + 1),
+                         ["The certificate of %s is self-signed." % HOST])
+
+    def test_fetch_errors(self):
+        closed = standins.closed_port()
+        with standins.http({}) as plain:
+            fetched, errors = certs.fetch_certificates([(HOST, closed), (HOST, plain.port)], 5)
+        self.assertEqual(fetched, {})
+        self.assertEqual(sorted(errors), sorted([(HOST, closed), (HOST, plain.port)]))
+
+
+class ServerCertificatesTest(unittest.TestCase):
+    def setUp(self):
+        with open(CERT) as fh:
+            self.der = certs.pem_to_der(fh.read())
+        self.parsed = []
+        self.parse = certs.parse_certificate
+        certs.parse_certificate = self.count_parse
+
+    def tearDown(self):
+        certs.parse_certificate = self.parse
+
+    def count_parse(self, der):
+        self.parsed.append(der)
+        return self.parse(der)
+
+    def test_parsed_once(self):
+        cache = certs.ServerCertificates()
+        self.assertEqual(cache.warnings("localhost", 443), [])
+        cache.put("localhost", 443, self.der)
+        now = self.parse(self.der).not_before + 1
+        warnings = cache.warnings("localhost", 443, now)
+        self.assertEqual(warnings, ["The certificate of localhost is self-signed."])
+        self.assertEqual(cache.warnings("localhost", 443, now), warnings)
+        self.assertEqual(len(self.parsed), 1)
+        # Parsed again once fetched again
+        cache.put("localhost", 443, self.der)
+        cache.warnings("localhost", 443, now)
+        self.assertEqual(len(self.parsed), 2)
+
+    def test_expired(self):
+        cache = certs.ServerCertificates(ttl=0)
+        cache.put("localhost", 443, self.der)
+        self.assertEqual(cache.get("localhost", 443), None)
+        self.assertEqual(cache.warnings("localhost", 443), [])
+        self.assertEqual(cache.missing([("localhost", 443)]), [("localhost", 443)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import sys
+import json
+import unittest
+import argparse
+import StringIO
+
+from virt_who_tui import discovery
+from virt_who_tui.discovery import Endpoint, DEFAULT_PORTS, LIBVIRT_PROGRAM
+from tests import standins
+from tests.standins import HOST
+
+VIM_VERSIONS = '<namespaces version="1.0"><namespace><name>urn:vim25</name><version>6.7</version></namespace></namespaces>'
+
+
+class DiscoveryTest(unittest.TestCase):
+    def ports(self, **services):
+        """
+        Nothing listens on the services which aren't given, so that the
+        services of the test machine aren't probed
+        """
+        ports = dict((service, standins.closed_port()) for service in DEFAULT_PORTS)
+        ports.update(services)
+        return ports
+
+    def test_parse_network(self):
+        self.assertEqual(discovery.parse_network("10.0.0.0/30"), ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(discovery.parse_network("10.0.0.7/31"), ["10.0.0.6", "10.0.0.7"])
+        self.assertEqual(discovery.parse_network("esx.example.com"), ["esx.example.com"])
+        self.assertRaises(discovery.DiscoveryError, discovery.parse_network, "10.0.0.0/33")
+        self.assertRaises(discovery.DiscoveryError, discovery.parse_network, "10.0.0.0/8")
+
+    def test_esx(self):
+        routes = {"/sdk/vimServiceVersions.xml": (200, {"Content-Type": "text/xml"}, VIM_VERSIONS)}
+        with standins.http(routes, tls=True) as esx:
+            found = discovery.discover(HOST, 2.0, ports=self.ports(https=esx.port))
+        self.assertEqual(found, [Endpoint("esx", HOST, esx.port, "https://%s:%d" % (HOST, esx.port), "vSphere SDK")])
+
+    def test_rhevm(self):
+        routes = {"/ovirt-engine/api": (401, {"WWW-Authenticate": 'Basic realm="RESTAPI"'}, "")}
+        with standins.http(routes, tls=True) as rhevm:
+            found = discovery.discover(HOST, 2.0, ports=self.ports(rhevm3=rhevm.port))
+        self.assertEqual(found, [Endpoint("rhevm", HOST, rhevm.port, "https://%s:%d/ovirt-engine" % (HOST, rhevm.port),
+                                          "oVirt API (/ovirt-engine/api)")])
+
+    def test_hyperv(self):
+        routes = {"/wsman": (405, {}, "")}
+        with standins.http(routes, server="Microsoft-HTTPAPI/2.0") as winrm:
+            found = discovery.discover(HOST, 2.0, ports=self.ports(winrm=winrm.port))
+        self.assertEqual(found, [Endpoint("hyperv", HOST, winrm.port, "%s:%d" % (HOST, winrm.port), "WinRM")])
+
+    def test_libvirt(self):
+        with standins.libvirtd(LIBVIRT_PROGRAM) as libvirt:
+            found = discovery.discover(HOST, 2.0, ports=self.ports(libvirt=libvirt.port))
+        self.assertEqual(found, [Endpoint("libvirt", HOST, libvirt.port, "qemu+tcp://%s:%d/system" % (HOST, libvirt.port),
+                                          "libvirtd (tcp)")])
+
+    def test_unknown_services(self):
+        with standins.http({"/": (200, {}, "<html>It works!</html>")}, tls=True) as web:
+            with standins.libvirtd(0x1234) as other:
+                with standins.silent() as silent:
+                    ports = self.ports(https=web.port, libvirt=other.port, winrm=silent.port)
+                    found = discovery.Discoverer(ports, timeout=0.5).discover(HOST)
+        self.assertEqual(found, [])
+
+    def test_types(self):
+        routes = {"/sdk/vimServiceVersions.xml": (200, {}, VIM_VERSIONS)}
+        with standins.http(routes, tls=True) as esx:
+            found = discovery.discover(HOST, 2.0, ports=self.ports(https=esx.port), types=["hyperv"])
+        self.assertEqual(found, [])
+
+    def test_port_option(self):
+        self.assertEqual(discovery.port_option("winrm=15985"), ("winrm", 15985))
+        for value in ["winrm", "winrm=", "ssh=22", "https=70000"]:
+            self.assertRaises(argparse.ArgumentTypeError, discovery.port_option, value)
+
+    def test_main_ports(self):
+        with standins.libvirtd(LIBVIRT_PROGRAM) as libvirt:
+            argv = [HOST, "--json", "--type", "libvirt", "--port", "libvirt=%d" % libvirt.port,
+                    "--port", "libvirt_tls=%d" % standins.closed_port()]
+            stdout, stderr = sys.stdout, sys.stderr
+            sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+            try:
+                code = discovery.main(argv)
+                output = sys.stdout.getvalue()
+            finally:
+                sys.stdout, sys.stderr = stdout, stderr
+        self.assertEqual(code, 0)
+        self.assertEqual([json.loads(line) for line in output.splitlines()], [{
+            "config_name": "libvirt-127-0-0-1",
+            "type": "libvirt",
+            "server": "qemu+tcp://%s:%d/system" % (HOST, libvirt.port),
+        }])
+
+
+if __name__ == "__main__":
+    unittest.main()
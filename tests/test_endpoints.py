@@ -0,0 +1,95 @@
+import ssl
+import time
+import httplib
+import unittest
+
+from virt_who_tui.endpoints import EndpointProber, ProbeError, parse_candidates
+from tests import standins
+from tests.standins import HOST
+
+
+def api_check(host, port):
+    """
+    Stand-in of the authenticated request made to RHSM
+    """
+    if hasattr(ssl, "_create_unverified_context"):
+        connection = httplib.HTTPSConnection(host, port, timeout=5, context=ssl._create_unverified_context())
+    else:
+        connection = httplib.HTTPSConnection(host, port, timeout=5)
+    try:
+        connection.request("GET", "/subscription/status")
+        response = connection.getresponse()
+        response.read()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise ProbeError("HTTP %d" % response.status)
+
+
+STATUS = {"/subscription/status": (200, {"Content-Type": "application/json"}, '{"result": true}')}
+
+
+class ParseCandidatesTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_candidates("a.example.com, b.example.com:8443  c.example.com"),
+                         [("a.example.com", 443), ("b.example.com", 8443), ("c.example.com", 443)])
+        self.assertEqual(parse_candidates("a.example.com:https", 8443), [("a.example.com:https", 8443)])
+        self.assertEqual(parse_candidates(""), [])
+        self.assertEqual(parse_candidates(None), [])
+
+
+class EndpointProberTest(unittest.TestCase):
+    def test_rank(self):
+        with standins.http(STATUS, tls=True, delay=0.3) as slow:
+            with standins.http(STATUS, tls=True) as fast:
+                candidates = parse_candidates("%s:%d, %s:%d" % (HOST, slow.port, HOST, fast.port))
+                ranked = EndpointProber(api_check, timeout=5).rank(candidates)
+        self.assertEqual([m.port for m in ranked], [fast.port, slow.port])
+        for measurement in ranked:
+            self.assertTrue(measurement.ok, measurement.error)
+            self.assertTrue(measurement.tcp is not None and measurement.tls is not None)
+        self.assertTrue(ranked[1].api >= 0.3)
+        self.assertTrue(ranked[0].total < ranked[1].total)
+
+    def test_failed_last(self):
+        with standins.http({}, tls=True) as unauthorized:
+            with standins.http(STATUS, tls=True) as good:
+                closed = standins.closed_port()
+                candidates = [(HOST, closed), (HOST, unauthorized.port), (HOST, good.port)]
+                ranked = EndpointProber(api_check, timeout=5).rank(candidates)
+        self.assertEqual(ranked[0].port, good.port)
+        self.assertTrue(ranked[0].ok)
+        failed = dict((m.port, m) for m in ranked[1:])
+        self.assertEqual(failed[unauthorized.port].error, "HTTP 404")
+        self.assertTrue(failed[unauthorized.port].tls is not None)
+        self.assertEqual(failed[closed].tcp, None)
+        self.assertFalse(failed[closed].ok)
+
+    def test_plain_http(self):
+        # The TLS handshake fails with a server which doesn't speak TLS
+        with standins.http(STATUS) as web:
+            measurement = EndpointProber(api_check, timeout=5).probe(HOST, web.port)
+        self.assertFalse(measurement.ok)
+        self.assertTrue(measurement.tcp is not None)
+        self.assertEqual(measurement.tls, None)
+        self.assertEqual(measurement.api, None)
+
+    def test_timeout(self):
+        with standins.silent() as silent:
+            started = time.time()
+            measurement = EndpointProber(api_check, timeout=0.5).probe(HOST, silent.port)
+            elapsed = time.time() - started
+        self.assertFalse(measurement.ok)
+        self.assertTrue("timed out" in measurement.error, measurement.error)
+        self.assertEqual(measurement.tls, None)
+        self.assertTrue(elapsed < 3, elapsed)
+
+    def test_without_api_check(self):
+        with standins.http(STATUS, tls=True) as server:
+            measurement = EndpointProber(timeout=5).probe(HOST, server.port)
+        self.assertTrue(measurement.ok, measurement.error)
+        self.assertEqual(measurement.api, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
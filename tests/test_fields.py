@@ -0,0 +1,110 @@
+import shutil
+import tempfile
+import unittest
+
+from virt_who_tui.fields import FieldModel, Snapshot
+
+try:
+    from virt_who_tui.replay import ReplayConfig
+except ImportError as e:
+    # VirtConfig needs the virt-who backends
+    ReplayConfig = None
+    missing = str(e)
+else:
+    missing = None
+
+
+class FieldModelTest(unittest.TestCase):
+    def setUp(self):
+        self.model = FieldModel(["server", "username", "password"])
+
+    def test_changes(self):
+        self.assertEqual(self.model.version, 0)
+        self.assertTrue(self.model.set("server", "esx.example.com"))
+        version = self.model.version
+        # Setting the same value isn't a change
+        self.assertFalse(self.model.set("server", "esx.example.com"))
+        self.assertEqual(self.model.version, version)
+        self.assertFalse(self.model.changed_since(version))
+        self.model.set("username", "admin")
+        self.assertTrue(self.model.changed_since(version))
+        self.assertTrue(self.model.changed_since(version, ["username", "password"]))
+        self.assertFalse(self.model.changed_since(version, ["server", "password"]))
+
+    def test_unicode_replaced_by_str(self):
+        self.model.set("server", u"esx.example.com")
+        # RHSM only works with str, so the same text as str is a change
+        self.assertTrue(self.model.set("server", "esx.example.com"))
+        self.assertTrue(type(self.model.get("server")) is str)
+
+    def test_snapshot(self):
+        self.model.set("server", "esx.example.com")
+        snapshot = self.model.snapshot()
+        self.assertEqual(snapshot.as_dict(), {"server": "esx.example.com", "username": None, "password": None})
+        self.assertEqual(snapshot.get("server"), "esx.example.com")
+        self.model.set("password", "secret")
+        self.assertEqual(snapshot.get("password"), None)
+        self.assertNotEqual(self.model.snapshot(), snapshot)
+        self.model.set("password", None)
+        # The values are compared, not the versions
+        again = self.model.snapshot()
+        self.assertEqual(again, snapshot)
+        self.assertEqual(hash(again), hash(snapshot))
+        self.assertNotEqual(again.version, snapshot.version)
+        self.assertNotEqual(snapshot, Snapshot(("other",), snapshot.values, snapshot.version))
+
+    def test_copy(self):
+        self.model.set("server", "esx.example.com")
+        other = self.model.copy()
+        version = other.version
+        other.set("server", "esx2.example.com")
+        self.assertEqual(self.model.get("server"), "esx.example.com")
+        self.assertFalse(self.model.changed_since(version))
+        self.assertTrue(other.changed_since(version, ["server"]))
+
+
+@unittest.skipIf(ReplayConfig is None, "virt-who isn't available: %s" % missing)
+class DerivedConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.virt_config = ReplayConfig(self.dir)
+        self.virt_config.load_values({
+            "config_name": "esx1", "type": "esx", "server": "https://esx.example.com",
+            "username": "admin", "password": "secret", "owner": "ACME", "env": "Library",
+            "hypervisor_id": "uuid",
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_rebuilt_on_change(self):
+        config = self.virt_config.get_config()
+        parser = self.virt_config.get_config(True)
+        self.assertTrue(self.virt_config.get_config() is config)
+        self.virt_config.hypervisor_id = "uuid"
+        self.assertTrue(self.virt_config.get_config() is config)
+        # The flags are only written in the file
+        self.virt_config.encrypt_pass = False
+        self.assertTrue(self.virt_config.get_config() is config)
+        self.assertFalse(self.virt_config.get_config(True) is parser)
+        self.virt_config.server = "https://esx2.example.com"
+        self.assertFalse(self.virt_config.get_config() is config)
+        self.assertEqual(self.virt_config.get_config(True).get("esx1", "server"), "https://esx2.example.com")
+
+    def test_clone(self):
+        config = self.virt_config.get_config()
+        other = self.virt_config.clone()
+        self.assertTrue(other.get_config() is config)
+        other.server = "https://esx2.example.com"
+        self.assertEqual(other.get_config(True).get("esx1", "server"), "https://esx2.example.com")
+        # Neither memo is stale after the other has changed
+        self.assertTrue(self.virt_config.get_config() is config)
+        self.assertEqual(self.virt_config.get_config(True).get("esx1", "server"), "https://esx.example.com")
+        self.virt_config.username = "root"
+        self.assertEqual(self.virt_config.get_config(True).get("esx1", "username"), "root")
+        self.assertEqual(other.get_config(True).get("esx1", "username"), "admin")
+        self.assertEqual(other.values()["server"], "https://esx2.example.com")
+
+
+if __name__ == "__main__":
+    unittest.main()
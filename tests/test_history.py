@@ -0,0 +1,114 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from virt_who_tui.history import CompletionTrie, Completer, HistoryStore, HALF_LIFE
+
+
+class CompletionTrieTest(unittest.TestCase):
+    def setUp(self):
+        self.trie = CompletionTrie({
+            "esx.example.com": 3.0,
+            "esx-lab.example.com": 1.0,
+            "ESX-prod.example.com": 5.0,
+            "rhevm.example.com": 2.0,
+        })
+
+    def test_best(self):
+        self.assertEqual(self.trie.node("esx.").best, "esx.example.com")
+        self.assertEqual(self.trie.node("esx-l").best, "esx-lab.example.com")
+        self.assertEqual(self.trie.node("").best, "ESX-prod.example.com")
+        self.assertEqual(self.trie.node("xen"), None)
+
+    def test_case_insensitive(self):
+        # The best value is picked whatever the case of the prefix or of the values
+        self.assertEqual(self.trie.node("esx").best, "ESX-prod.example.com")
+        self.assertEqual(self.trie.node("ESX").best, "ESX-prod.example.com")
+        self.assertEqual(self.trie.node("Rhev").best, "rhevm.example.com")
+
+    def test_insert(self):
+        self.trie.insert("esx-lab.example.com", 10.0)
+        self.assertEqual(self.trie.node("e").best, "esx-lab.example.com")
+        # A lower score doesn't replace the best value
+        self.trie.insert("esx-old.example.com", 0.5)
+        self.assertEqual(self.trie.node("esx-").best, "esx-lab.example.com")
+        self.assertEqual(self.trie.node("esx-o").best, "esx-old.example.com")
+
+
+class CompleterTest(unittest.TestCase):
+    def setUp(self):
+        self.completer = Completer(CompletionTrie({"esx.example.com": 3.0, "esx-lab.example.com": 1.0}))
+
+    def type(self, text):
+        return [self.completer.complete(text[:idx]) for idx in xrange(1, len(text) + 1)]
+
+    def test_typing(self):
+        self.assertEqual(self.type("esx-"), ["esx.example.com", "esx.example.com", "esx.example.com",
+                                             "esx-lab.example.com"])
+
+    def test_edited(self):
+        self.type("esx-")
+        # Backspace, then a jump to another text
+        self.assertEqual(self.completer.complete("esx"), "esx.example.com")
+        self.assertEqual(self.completer.complete("esx-la"), "esx-lab.example.com")
+        self.assertEqual(self.completer.complete("esx-lab"), "esx-lab.example.com")
+        self.assertEqual(self.completer.complete("rhevm"), None)
+        # Typing on after a text without completion
+        self.assertEqual(self.completer.complete("rhevm."), None)
+        self.assertEqual(self.completer.complete("e"), "esx.example.com")
+
+    def test_nothing_to_add(self):
+        self.assertEqual(self.completer.complete(""), None)
+        self.assertEqual(self.type("esx.example.com")[-1], None)
+        self.assertEqual(self.completer.complete("ESX"), "esx.example.com")
+
+
+class HistoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config_dir = os.path.join(self.dir, "virt-who.d")
+        os.mkdir(self.config_dir)
+        self.path = os.path.join(self.dir, "history", "history.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_config_files(self):
+        with open(os.path.join(self.config_dir, "esx.conf"), "w") as fh:
+            fh.write("[esx1]\ntype=esx\nserver=esx.example.com\nusername=admin\n")
+        with open(os.path.join(self.config_dir, "broken.conf"), "w") as fh:
+            fh.write("server=nowhere\n")
+        store = HistoryStore(self.path, self.config_dir)
+        self.assertEqual(store.completer("server").complete("e"), "esx.example.com")
+        self.assertEqual(store.completer("username").complete("a"), "admin")
+        self.assertEqual(store.completer("sat_server").complete("e"), None)
+
+    def test_record(self):
+        store = HistoryStore(self.path, self.config_dir)
+        store.record({"server": "esx-lab.example.com", "password": "secret"})
+        completer = store.completer("server")
+        store.record({"server": "esx.example.com"})
+        store.record({"server": "esx.example.com"})
+        # The completer is built again with the new scores
+        self.assertFalse(store.completer("server") is completer)
+        self.assertEqual(store.completer("server").complete("esx"), "esx.example.com")
+
+        again = HistoryStore(self.path, self.config_dir)
+        self.assertEqual(sorted(again.entries["server"]), ["esx-lab.example.com", "esx.example.com"])
+        with open(self.path) as fh:
+            self.assertFalse("secret" in fh.read())
+
+    def test_scores_decay(self):
+        store = HistoryStore(self.path, self.config_dir)
+        now = time.time()
+        store.entries["server"] = {"old.example.com": [4, now - 2 * HALF_LIFE], "new.example.com": [2, now]}
+        scores = store.scores("server", now)
+        self.assertAlmostEqual(scores["old.example.com"], 1.0)
+        self.assertAlmostEqual(scores["new.example.com"], 2.0)
+        self.assertEqual(store.completer("server").complete("n"), "new.example.com")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from virt_who_tui.logstats import LogStats, LogStatsCache, analyze
+
+LOG = """\
+2026-10-19 10:00:00,100 [virtwho.main DEBUG] MainProcess(1):MainThread @executor.py:1 - Report for config "esx" gathered, placing in datastore
+2026-10-19 10:00:00,200 [virtwho.destination INFO] MainProcess(1):Thread-1 @subscriptionmanager.py:1 - Sending updated Host-to-guest mapping to "ACME" including 3 hypervisors and 12 guests
+2026-10-19 10:00:01,300 [virtwho.destination DEBUG] MainProcess(1):Thread-1 @subscriptionmanager.py:1 - Mapping for config "esx" updated
+2026-10-19 10:01:00,100 [virtwho.main DEBUG] MainProcess(1):MainThread @executor.py:1 - Report for config "esx" gathered, placing in datastore
+2026-10-19 10:01:00,200 [virtwho.destination ERROR] MainProcess(1):Thread-1 @subscriptionmanager.py:1 - Communication with subscription manager failed
+2026-10-19 10:01:00,300 [virtwho.destination ERROR] MainProcess(1):Thread-1 @subscriptionmanager.py:1 - Unable to send the report
+2026-10-19 10:01:00,400 [virtwho.destination ERROR] MainProcess(1):Thread-1 @subscriptionmanager.py:1 - Traceback of the failure
+"""
+
+
+class LogStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = os.path.join(self.dir, "rhsm.log")
+        with open(self.log, "w") as fh:
+            fh.write(LOG)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_failed_reports(self):
+        row, = LogStats(self.log).update().summary()
+        self.assertEqual((row["reports"], row["failed"], row["errors"]), (2, 1, 3))
+        self.assertEqual(row["error_rate"], 0.5)
+        self.assertEqual(row["last_error"], "Traceback of the failure")
+        self.assertEqual((row["hypervisors"], row["guests"]), (3, 12))
+        self.assertAlmostEqual(row["duration_max"], 1.2, 1)
+
+    def test_cached(self):
+        cache = LogStatsCache(os.path.join(self.dir, "cache"))
+        rows, read, lines = analyze(self.log, cache)
+        self.assertEqual(read, len(LOG))
+        with open(self.log, "a") as fh:
+            fh.write('2026-10-19 10:02:00,100 [virtwho.main DEBUG] MainProcess(1):MainThread @executor.py:1 - '
+                     'Report for config "esx" gathered, placing in datastore\n')
+        rows, read, lines = analyze(self.log, cache)
+        self.assertEqual((rows[0]["reports"], rows[0]["failed"], lines), (3, 1, 8))
+        self.assertTrue(read < len(LOG))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from virt_who_tui import logtail
+from virt_who_tui.logtail import LogTail
+
+
+class LogTailTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "rhsm.log")
+        self.write("".join("line %d\n" % idx for idx in xrange(10)))
+        self.tail = LogTail(self.path, size=5)
+
+    def tearDown(self):
+        self.tail.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, text, mode="w"):
+        with open(self.path, mode) as fh:
+            fh.write(text)
+
+    def test_last_lines(self):
+        self.assertTrue(self.tail.poll())
+        self.assertEqual(self.tail.window(10), ["line %d" % idx for idx in xrange(5, 10)])
+        self.assertEqual(self.tail.window(2), ["line 8", "line 9"])
+        self.assertEqual(self.tail.window(0), [])
+        self.assertFalse(self.tail.poll())
+
+    def test_big_file(self):
+        # The end is found across blocks, without reading the whole file
+        self.write("".join("line %d\n" % idx for idx in xrange(50000)))
+        self.tail.poll()
+        self.assertEqual(self.tail.window(5), ["line %d" % idx for idx in xrange(49995, 50000)])
+
+    def test_catch_up(self):
+        self.tail.poll()
+        self.write("x" * (logtail.MAX_CATCH_UP + 10) + "\nlast\n", "a")
+        self.assertTrue(self.tail.poll())
+        self.assertEqual(self.tail.window(1), ["last"])
+
+    def test_partial_line(self):
+        self.tail.poll()
+        self.write("incompl", "a")
+        self.assertTrue(self.tail.poll())
+        self.assertEqual(self.tail.window(2), ["line 9", "incompl"])
+        self.write("ete\r\nnext\n", "a")
+        self.assertTrue(self.tail.poll())
+        self.assertEqual(self.tail.window(3), ["line 9", "incomplete", "next"])
+
+    def test_truncated(self):
+        self.tail.poll()
+        self.write("after\n")
+        self.assertTrue(self.tail.poll())
+        self.assertEqual(self.tail.window(2), ["line 9", "after"])
+
+    def test_rotated(self):
+        self.tail.poll()
+        self.write("before rotation\n", "a")
+        os.rename(self.path, self.path + ".1")
+        self.assertFalse(self.tail.poll())
+        self.write("new file\n")
+        self.assertTrue(self.tail.poll())
+        self.assertEqual(self.tail.window(3), ["line 9", "before rotation", "new file"])
+
+    def test_missing(self):
+        os.remove(self.path)
+        self.assertFalse(self.tail.poll())
+        self.write("created\n")
+        self.assertTrue(self.tail.poll())
+        self.assertEqual(self.tail.window(5), ["created"])
+
+    def test_invalid_utf8(self):
+        self.write("caf\xe9\n")
+        self.tail.poll()
+        self.assertEqual(self.tail.window(1), [u"caf\ufffd"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import logging
+import unittest
+import StringIO
+
+try:
+    from virt_who_tui import replay
+    from virt_who_tui.display import TuiContainerDisplay, FormTuiDisplay
+    import urwid
+except ImportError as e:
+    # The replay needs the virt-who backends
+    replay = None
+    missing = str(e)
+else:
+    missing = None
+
+BASELINE = os.path.join(os.path.dirname(__file__), "data", "replay-baseline.json")
+
+
+@unittest.skipIf(replay is None, "virt-who isn't available: %s" % missing)
+class KeyRecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.container = TuiContainerDisplay(logging.getLogger("test"), 80, 80)
+        self.container.loop = urwid.MainLoop(self.container.main, screen=replay.FakeScreen())
+        self.form = FormTuiDisplay(self.container)
+        self.form.add_field("username", "text", label="Username")
+        self.form.add_field("password", "password", label="Password")
+        self.form.render()
+        self.container.recorder = replay.KeyRecorder(None)
+
+    def focus(self, position):
+        self.form.contents.set_focus(position)
+
+    def test_passwords_masked(self):
+        self.focus(0)
+        self.container.filter_input(list("admin"), [])
+        self.focus(1)
+        self.container.filter_input(list("hunter2"), [])
+        self.container.filter_input(["backspace"], [])
+        self.container.filter_input(["x"], [])
+        self.container.filter_input(["x", "enter"], [])
+        steps = self.container.recorder.steps
+        self.assertEqual(steps, [["NoneType", list("admin") + [replay.PASSWORD_KEY, "backspace", replay.PASSWORD_KEY, "enter"]]])
+        self.assertFalse("hunter2" in json.dumps(steps))
+
+    def test_mouse_events_kept(self):
+        self.focus(1)
+        self.container.filter_input([("mouse press", 1, 10, 5)], [])
+        self.assertEqual(self.container.recorder.steps, [["NoneType", [("mouse press", 1, 10, 5)]]])
+
+
+@unittest.skipIf(replay is None, "virt-who isn't available: %s" % missing)
+class ReplayTest(unittest.TestCase):
+    def test_password_placeholder(self):
+        name, rhsm, script = replay.scenario("rhsm-custom", "ESX")
+        # Type the RHSM password as a recorded session would
+        idx = script.index(("type", "rhsm_password", "secret"))
+        script[idx:idx + 1] = [("keys", "SMConfigPage", ["down", "down", "down", replay.PASSWORD_KEY])]
+        player = replay.Replay(script, rhsm)
+        teardown, player.teardown = player.teardown, lambda: None
+        try:
+            player.run()
+            self.assertEqual(player.virt_config.rhsm_password, replay.ReplayConfig.PASSWORD)
+        finally:
+            teardown()
+
+    def test_regressions(self):
+        baseline = {"a": {"total": 1.0, "transitions": [["x -> y", 0.5]]}}
+        self.assertEqual(replay.regressions({"a": {"total": 1.4, "transitions": [["x -> y", 0.7]]}}, baseline, 0.5, 0.05), [])
+        slower = replay.regressions({"a": {"total": 1.6, "transitions": [["x -> y", 0.9]]}}, baseline, 0.5, 0.05)
+        self.assertEqual(slower, ["a: 1600 ms, baseline 1000 ms", "a: x -> y: 900 ms, baseline 500 ms"])
+
+    def test_baseline(self):
+        """
+        Every scenario completes, and isn't much slower than the checked-in
+        baseline. The tolerance leaves room for slower machines.
+        """
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+        try:
+            code = replay.main(["--repeat", "1", "--json", "--baseline", BASELINE, "--tolerance", "1.0", "--slack", "0.25"])
+            output, errors = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        self.assertEqual(code, 0, errors)
+        with open(BASELINE) as fh:
+            self.assertEqual(sorted(json.loads(output)), sorted(json.load(fh)))
+
+
+if __name__ == "__main__":
+    unittest.main()
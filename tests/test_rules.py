@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from virt_who_tui.rules import RULES, safe_name
+from virt_who_tui.lint import ConfigLinter
+
+ESX = {
+    "config_name": "esx1",
+    "type": "esx",
+    "server": "https://esx.example.com",
+    "username": "administrator",
+    "password": "secret",
+    "owner": "ACME",
+    "env": "Library",
+    "hypervisor_id": "uuid",
+    "smType": "rhsm",
+}
+
+
+def values(**changes):
+    result = dict(ESX)
+    result.update(changes)
+    return result
+
+
+# The RHSM settings are only checked when reporting to a custom RHSM
+REGISTERED = [group for group in RULES.groups() if group != "rhsm"]
+
+
+def messages(errors):
+    return [error.message for error in errors]
+
+
+class RulesTest(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(RULES.check(values(), REGISTERED), [])
+        self.assertEqual(RULES.first_error(values(), REGISTERED), None)
+        self.assertEqual(RULES.check(values(rhsm_hostname="rhsm.example.com", rhsm_username="admin",
+                                            rhsm_password="secret", rhsm_port="8443")), [])
+
+    def test_safe_name(self):
+        self.assertTrue(safe_name("esx-1.example.com"))
+        for name in ["../etc/passwd", "a/b", "a..b", "a\0b"]:
+            self.assertFalse(safe_name(name), name)
+        error = RULES.first_error(values(config_name="../esx"), ["name"])
+        self.assertEqual(error.field, "config_name")
+        self.assertEqual(error.message, "A configuration name can't contain '/', '..' or NUL characters.")
+
+    def test_encrypted_password(self):
+        rhsm = values(rhsm_hostname="rhsm.example.com", rhsm_username="admin")
+        self.assertEqual(messages(RULES.check(rhsm, ["rhsm"])), ["Password is required."])
+        rhsm["rhsm_encrypted_password"] = "0123abcd"
+        self.assertEqual(RULES.check(rhsm, ["rhsm"]), [])
+
+        sat = values(smType="sat", sat_server="sat.example.com", sat_username="admin")
+        self.assertEqual([e.field for e in RULES.check(sat, ["sat"])], ["sat_password"])
+        sat["sat_encrypted_password"] = "0123abcd"
+        self.assertEqual(RULES.check(sat, ["sat"]), [])
+
+    def test_all_errors(self):
+        errors = RULES.check(values(config_name="default", type="vmware", rhsm_port="https", owner=None,
+                                    hypervisor_id="mac"))
+        # The organization isn't required by an unknown backend
+        self.assertEqual([(e.group, e.field) for e in errors], [
+            ("name", "config_name"),
+            ("virt_type", "type"),
+            ("rhsm", "rhsm_hostname"),
+            ("rhsm", "rhsm_username"),
+            ("rhsm", "rhsm_password"),
+            ("rhsm", "rhsm_port"),
+            ("virt", "hypervisor_id"),
+        ])
+        self.assertEqual(errors[1].message, "'vmware' is not a supported hypervisor backend.")
+        self.assertEqual(RULES.first_error(values(config_name="default", type="vmware")), errors[0])
+        # Only the groups asked for are checked
+        self.assertEqual(RULES.first_error(values(config_name="default", type="vmware"), ["virt_type"]), errors[1])
+
+    def test_field_error(self):
+        self.assertEqual(RULES.field_error(values(owner=""), "owner").message, "Organization is required.")
+        self.assertEqual(RULES.field_error(values(owner=""), "env"), None)
+        # The organization isn't used by a local libvirt
+        self.assertEqual(RULES.field_error(values(type="libvirt", server="", owner=""), "owner"), None)
+        password = RULES.field_error(values(type="libvirt", server="qemu+ssh://host/system"), "password")
+        self.assertEqual(password.field, "password")
+        self.assertEqual(RULES.field_error(values(type="libvirt", server="qemu+tcp://host/system"), "password"), None)
+
+    def test_affected(self):
+        self.assertEqual(RULES.affected(["rhsm_encrypted_password"]), set(["rhsm_password"]))
+        self.assertEqual(RULES.affected(["server"]), set(["server", "env", "owner", "password"]))
+        self.assertTrue(set(["owner", "env", "rhsm_hostname", "sat_server"]) <= RULES.affected(["smType"]))
+        self.assertEqual(RULES.affected(["unknown"]), set())
+
+
+class ConfigLinterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as fh:
+            fh.write(text)
+        return path
+
+    def test_sections(self):
+        self.write("good.conf", "[esx1]\ntype=esx\nserver=esx.example.com\nusername=admin\n"
+                                "encrypted_password=0123\nowner=ACME\nenv=Library\nhypervisor_id=uuid\n")
+        self.write("bad.conf", "[libvirt1]\ntype=libvirt\n\n[sat1]\ntype=esx\nserver=esx.example.com\n"
+                               "sat_server=sat.example.com\n")
+        self.write("ignored.txt", "[x]\ntype=unknown\n")
+        results = list(ConfigLinter().lint_paths([self.dir]))
+        self.assertEqual([(os.path.basename(r.path), r.section) for r in results],
+                         [("bad.conf", "libvirt1"), ("bad.conf", "sat1"), ("good.conf", "esx1")])
+        self.assertEqual(results[0].errors, [])
+        self.assertEqual([e.field for e in results[1].errors], ["sat_username", "sat_password"])
+        self.assertEqual(results[2].errors, [])
+
+    def test_custom_rhsm(self):
+        linter = ConfigLinter()
+        path = self.write("rhsm.conf", "[esx1]\ntype=esx\nserver=esx.example.com\nowner=ACME\nenv=Library\n"
+                                       "rhsm_hostname=rhsm.example.com\nrhsm_port=https\n")
+        result, = linter.lint_file(path)
+        self.assertEqual([e.field for e in result.errors], ["rhsm_username", "rhsm_password", "rhsm_port"])
+
+    def test_unreadable(self):
+        path = self.write("broken.conf", "type=esx\n")
+        result, = ConfigLinter().lint_file(path)
+        self.assertEqual(result.section, None)
+        self.assertEqual(result.errors[0].group, "file")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+from virt_who_tui.service import run, CommandTimeout, VirtWhoService
+
+# Stand-in of systemctl: the service is active once the marker file exists
+SYSTEMCTL = """#!/bin/sh
+echo "$@" >> %(dir)s/calls
+case "$1" in
+    is-active) test -e %(dir)s/active ;;
+    restart) echo "Job for virt-who.service failed." ; exit 1 ;;
+esac
+"""
+
+
+class RunTest(unittest.TestCase):
+    def test_output(self):
+        self.assertEqual(run(["sh", "-c", "echo out; echo err >&2; exit 3"], 5), (3, "out\nerr\n"))
+
+    def test_big_output(self):
+        # More than a pipe holds, read while the command runs
+        returncode, output = run([sys.executable, "-c", "print('x' * 200000)"], 5)
+        self.assertEqual((returncode, len(output)), (0, 200001))
+
+    def test_timeout(self):
+        started = time.time()
+        with self.assertRaises(CommandTimeout) as cm:
+            run(["sh", "-c", "echo started; exec sleep 10"], 0.5)
+        self.assertTrue(time.time() - started < 5)
+        self.assertEqual(cm.exception.output, "started\n")
+
+    def test_child_keeps_pipe(self):
+        # A background child keeps the output open, the deadline still applies
+        with self.assertRaises(CommandTimeout):
+            run(["sh", "-c", "sleep 2 & echo done"], 0.5)
+
+    def test_missing_command(self):
+        self.assertRaises(OSError, run, ["/nonexistent/command"], 5)
+
+
+class VirtWhoServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        systemctl = os.path.join(self.dir, "systemctl")
+        with open(systemctl, "w") as fh:
+            fh.write(SYSTEMCTL % {"dir": self.dir})
+        os.chmod(systemctl, 0o755)
+        self.service = VirtWhoService(timeout=1)
+        self.service.SYSTEMCTL = systemctl
+        self.service._systemd = True
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def activate(self):
+        open(os.path.join(self.dir, "active"), "w").close()
+
+    def calls(self):
+        with open(os.path.join(self.dir, "calls")) as fh:
+            return fh.read().splitlines()
+
+    def test_wait_active(self):
+        self.activate()
+        started = time.time() - 3
+        elapsed = self.service.wait_active(started)
+        # Measured from the start of the restart
+        self.assertTrue(3 <= elapsed < 4, elapsed)
+
+    def test_wait_inactive(self):
+        started = time.time()
+        self.assertEqual(self.service.wait_active(started), None)
+        self.assertTrue(time.time() - started >= 1)
+        self.assertTrue(len(self.calls()) > 1)
+
+    def test_errors(self):
+        self.assertEqual(self.service.restart(), "Job for virt-who.service failed.\n")
+        self.assertEqual(self.service.enable(), None)
+        self.assertEqual(self.calls(), ["restart virt-who", "enable virt-who"])
+        self.service.SYSTEMCTL = os.path.join(self.dir, "missing")
+        self.assertTrue(self.service.restart().startswith("Failed to run"))
+
+    def test_command_timeout(self):
+        self.assertEqual(self.service._run(["sleep", "5"]), "'sleep 5' timed out after 1 s")
+
+
+if __name__ == "__main__":
+    unittest.main()
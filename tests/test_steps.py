@@ -0,0 +1,72 @@
+import json
+import unittest
+
+from virt_who_tui.steps import StepCache
+
+FIELDS = {
+    "sm": ["rhsm_hostname", "rhsm_password"],
+    "virt": ["type", "server", "password"],
+}
+
+VALUES = {
+    "rhsm_hostname": "rhsm.example.com",
+    "rhsm_password": "hunter2",
+    "type": "esx",
+    "server": "esx.example.com",
+    "password": "secret",
+    "owner": "ACME",
+}
+
+
+def values(**changes):
+    result = dict(VALUES)
+    result.update(changes)
+    return result
+
+
+class StepCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.steps = StepCache(FIELDS)
+
+    def test_same_settings(self):
+        self.assertEqual(self.steps.get("virt", values()), None)
+        self.steps.put("virt", values(), {"hypervisors": 3}, 1.5)
+        cached = self.steps.get("virt", values())
+        self.assertEqual((cached.value, cached.elapsed), ({"hypervisors": 3}, 1.5))
+        # The settings the step doesn't depend on don't matter
+        self.assertTrue(self.steps.get("virt", values(owner="Initech", rhsm_password="other")) is cached)
+
+    def test_changed_settings(self):
+        self.steps.put("virt", values())
+        self.steps.put("sm", values())
+        self.assertEqual(self.steps.get("virt", values(server="esx2.example.com")), None)
+        self.assertEqual(self.steps.get("virt", values(password="changed")), None)
+        self.assertNotEqual(self.steps.get("sm", values(server="esx2.example.com")), None)
+
+    def test_missing_settings(self):
+        # A missing setting is the same as one which isn't set
+        self.steps.put("virt", values(server=None))
+        self.assertNotEqual(self.steps.get("virt", dict((k, v) for k, v in VALUES.items() if k != "server")), None)
+        self.assertEqual(self.steps.get("virt", values(server="")), None)
+
+    def test_replaced(self):
+        self.steps.put("virt", values())
+        self.steps.put("virt", values(server="esx2.example.com"), "second")
+        self.assertEqual(self.steps.get("virt", values()), None)
+        self.assertEqual(self.steps.get("virt", values(server="esx2.example.com")).value, "second")
+
+    def test_forget(self):
+        self.steps.put("virt", values())
+        self.steps.forget("virt")
+        self.steps.forget("sm")
+        self.assertEqual(self.steps.get("virt", values()), None)
+
+    def test_passwords_not_kept(self):
+        self.steps.put("sm", values())
+        self.steps.put("virt", values())
+        kept = json.dumps([(key, result.value) for key, result in self.steps._results.values()])
+        self.assertFalse("hunter2" in kept or "secret" in kept)
+
+
+if __name__ == "__main__":
+    unittest.main()
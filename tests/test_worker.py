@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+import unittest
+
+import urwid
+
+from virt_who_tui.task import TaskResult
+from virt_who_tui.worker import CheckWorker, WorkerPool, WorkerTask
+
+
+class Checks(object):
+    """
+    Stand-in of VirtConfig, with checks taking the values as configuration
+    """
+    LOCAL_CERTIFICATES = []
+
+    def load_values(self, values):
+        self.values = values
+
+    def get_config(self):
+        return self.values
+
+    def sleep(self, config):
+        time.sleep(config["seconds"])
+        return os.getpid()
+
+
+class WorkerTaskTest(unittest.TestCase):
+    def setUp(self):
+        self.worker = CheckWorker(Checks())
+        self.loop = urwid.MainLoop(urwid.SolidFill())
+        self.results = []
+
+    def tearDown(self):
+        self.worker.shutdown()
+
+    def done(self, result):
+        self.results.append(result)
+        if len(self.results) == 2:
+            raise urwid.ExitMainLoop()
+
+    def test_busy(self):
+        WorkerTask(self.loop, self.worker, "sleep", {"seconds": 0.3}, 5, self.done).start()
+        WorkerTask(self.loop, self.worker, "sleep", {"seconds": 0}, 5, self.done).start()
+        # The screen isn't needed, only the callbacks
+        self.loop.event_loop.run()
+        busy, slept = self.results
+        self.assertEqual(busy.status, TaskResult.ERROR)
+        self.assertTrue("already running" in busy.message())
+        self.assertTrue(slept.ok, slept.message())
+        # The worker is free again
+        self.assertTrue(self.worker.run("sleep", {"seconds": 0}, 5).ok)
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(CheckWorker(Checks()), 2)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def run_checks(self, count, seconds):
+        results = [None] * count
+
+        def run(idx):
+            results[idx] = self.pool.run("sleep", {"seconds": seconds}, 5)
+
+        threads = [threading.Thread(target=run, args=(idx,)) for idx in xrange(count)]
+        for thread in threads:
+            thread.start()
+            # Let the check take its worker
+            time.sleep(0.1)
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent(self):
+        started = time.time()
+        results = self.run_checks(2, 0.5)
+        self.assertTrue(time.time() - started < 0.9)
+        self.assertTrue(all(result.ok for result in results))
+        self.assertNotEqual(results[0].value, results[1].value)
+
+    def test_busy(self):
+        results = self.run_checks(3, 0.5)
+        self.assertTrue(results[0].ok and results[1].ok)
+        self.assertEqual(results[2], None)
+
+    def test_timeout(self):
+        worker = self.pool.workers[0]
+        pid = worker.pid
+        result = worker.run("sleep", {"seconds": 5}, 0.3)
+        self.assertEqual(result.status, TaskResult.TIMEOUT)
+        self.assertNotEqual(worker.pid, pid)
+        self.assertTrue(worker.run("sleep", {"seconds": 0}, 5).ok)
+
+
+if __name__ == "__main__":
+    unittest.main()
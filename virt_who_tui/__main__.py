@@ -2,25 +2,114 @@
 
 import sys
 import os
+import argparse
 
-from virt_who_tui.page import WelcomePage
-from virt_who_tui.virt_config import VirtConfig
-from virt_who_tui.display import TuiContainerDisplay
 
-def main():
+def timeout_option(value):
+    name, sep, seconds = value.partition("=")
+    if not sep or not seconds.isdigit() or int(seconds) <= 0:
+        raise argparse.ArgumentTypeError("'%s' is not in the OPERATION=SECONDS format" % value)
+    return name, int(seconds)
+
+
+def wizard(argv):
+    from virt_who_tui.page import WelcomePage
+    from virt_who_tui.virt_config import VirtConfig
+    from virt_who_tui.display import TuiContainerDisplay
+
+    parser = argparse.ArgumentParser(prog="virt-who-tui",
+        description="A Text-based user interface for configuring virt-who.")
+    parser.add_argument("--timeout", metavar="OPERATION=SECONDS", type=timeout_option, action="append", default=[],
+        help="deadline of an operation, one of: %s" % ", ".join(
+            "%s (default %d)" % item for item in sorted(VirtConfig.TIMEOUTS.iteritems())))
+    parser.add_argument("--record", metavar="FILE",
+        help="record the keys typed on each page in FILE, to be replayed with 'virt-who-tui replay --script FILE'")
+    parser.add_argument("--track-memory", action="store_true",
+        help="measure the memory used by each page and backend call, and print a summary on exit")
+    args = parser.parse_args(argv)
+
     if os.geteuid() != 0:
         print >>sys.stderr, "This application requires root permission. Please run it as root."
-        sys.exit(1)
+        return 1
+
+    if args.track_memory:
+        from virt_who_tui.memtrack import TRACKER
+        TRACKER.enable()
 
     virt_config = VirtConfig()
+    for name, seconds in args.timeout:
+        try:
+            virt_config.set_timeout(name, seconds)
+        except KeyError as e:
+            parser.error(e.args[0])
+
+    # Fork the zygote of the workers running the hypervisor checks while
+    # the process is small, and warm up the first worker
+    virt_config.worker.start()
+
     container = TuiContainerDisplay(virt_config.logger, 80, 80)
+    if args.record:
+        from virt_who_tui.replay import KeyRecorder
+        rhsm = dict((key, virt_config._rhsm_config.get('server', key)) for key in ["hostname", "prefix", "port"])
+        container.recorder = KeyRecorder(args.record, rhsm)
     WelcomePage(container, input_data=virt_config).render()
     exitcode, error = container.run()
 
+    if container.recorder is not None:
+        container.recorder.save()
+
+    if args.track_memory:
+        summary = "\n".join(TRACKER.summary())
+        virt_config.logger.info("Memory usage:\n%s" % summary)
+        print >>sys.stderr, summary
+
     if error:
         sys.stderr.write(error + "\n")
 
-    sys.exit(exitcode)
+    return exitcode
+
+
+def lint(argv):
+    from virt_who_tui import lint
+    return lint.main(argv)
+
+
+def daemon(argv):
+    from virt_who_tui import daemon
+    return daemon.main(argv)
+
+
+def discover(argv):
+    from virt_who_tui import discovery
+    return discovery.main(argv)
+
+
+def stats(argv):
+    from virt_who_tui import logstats
+    return logstats.main(argv)
+
+
+def replay(argv):
+    from virt_who_tui import replay
+    return replay.main(argv)
+
+
+# The sub commands are imported lazily, so that the commands which don't
+# need the virt-who backends don't pay for importing them.
+COMMANDS = {
+    "lint": lint,
+    "daemon": daemon,
+    "discover": discover,
+    "stats": stats,
+    "replay": replay,
+}
+
+
+def main():
+    argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        sys.exit(COMMANDS[argv[0]](argv[1:]))
+    sys.exit(wizard(argv))
 
 if __name__=="__main__":
     main()
@@ -0,0 +1,209 @@
+"""
+Recommend a virt-who reporting interval from the measured report costs.
+
+Each successful hypervisor check measures how long the one shot report
+took and how big it was. The measurements of all the configurations are
+kept, so that the interval can be chosen for everything virt-who reports:
+long enough to keep the report gathering and the uploads to the
+subscription manager a small share of the time, but not longer than
+needed, so that the subscriptions don't go stale.
+"""
+import os
+import re
+import json
+import math
+import time
+import errno
+from ConfigParser import SafeConfigParser, Error as ConfigParserError
+
+from virt_who_tui.utils import atomic_write
+
+STATS_FILE = "/var/lib/virt-who-tui/reports.json"
+SYSCONFIG_FILE = "/etc/sysconfig/virt-who"
+CONFIG_DIR = "/etc/virt-who.d"
+
+# virt-who doesn't accept shorter intervals, and reports every hour by default
+MIN_INTERVAL = 60
+DEFAULT_INTERVAL = 3600
+# Gathering the reports shouldn't take more than this share of the time
+MAX_DUTY_CYCLE = 0.1
+# Average upload rate the subscription manager should be able to absorb
+MAX_BYTES_PER_SECOND = 5 * 1024
+# Cost assumed for the configurations that have never been measured
+DEFAULT_COST = {"seconds": 30.0, "bytes": 100 * 1024}
+NICE_INTERVALS = [60, 120, 300, 600, 900, 1800, 3600, 7200, 14400, 28800, 43200, 86400]
+
+INTERVAL_RE = re.compile(r'^\s*#?\s*VIRTWHO_INTERVAL\s*=')
+
+
+def measure_report(report):
+    """
+    Return the number of hypervisors, guests and the approximate size in
+    bytes of a report put in the queue by virt-who.
+    """
+    if isinstance(report, tuple):
+        report = report[-1]
+
+    hypervisors = 0
+    guests = 0
+    payload = []
+    association = getattr(report, 'association', None)
+    if association:
+        for hypervisor in association.get('hypervisors', []):
+            hypervisors += 1
+            guests += len(getattr(hypervisor, 'guestIds', []))
+            payload.append(hypervisor.toDict() if hasattr(hypervisor, 'toDict') else repr(hypervisor))
+    elif getattr(report, 'guests', None) is not None:
+        for guest in report.guests:
+            guests += 1
+            payload.append(guest.toDict() if hasattr(guest, 'toDict') else repr(guest))
+    else:
+        return 0, 0, 0
+
+    return hypervisors, guests, len(json.dumps(payload, default=repr))
+
+
+class ReportStats(object):
+    """
+    The last measured report of each configuration
+    """
+    def __init__(self, path=STATS_FILE):
+        self.path = path
+        self._stats = None
+
+    @property
+    def stats(self):
+        if self._stats is None:
+            try:
+                with open(self.path) as fh:
+                    self._stats = dict(json.load(fh))
+            except (IOError, ValueError, TypeError):
+                self._stats = {}
+        return self._stats
+
+    def get(self, name):
+        return self.stats.get(name)
+
+    def record(self, name, measurement):
+        self.stats[name] = dict(measurement, measured=time.time())
+        try:
+            os.makedirs(os.path.dirname(self.path), 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        atomic_write(self.path, lambda fh: json.dump(self.stats, fh))
+
+
+def configured_names(config_dir=CONFIG_DIR):
+    names = []
+    try:
+        filenames = sorted(os.listdir(config_dir))
+    except OSError:
+        return names
+    for filename in filenames:
+        if not filename.endswith(".conf"):
+            continue
+        parser = SafeConfigParser()
+        try:
+            parser.read([os.path.join(config_dir, filename)])
+        except ConfigParserError:
+            continue
+        names.extend(parser.sections())
+    return names
+
+
+def nice_interval(seconds):
+    for interval in NICE_INTERVALS:
+        if interval >= seconds:
+            return interval
+    return int(math.ceil(seconds / 3600.0)) * 3600
+
+
+def recommend_interval(costs):
+    """
+    Recommend an interval for reports costing {"seconds", "bytes"} each.
+    Return the interval in seconds and the reasons.
+    """
+    seconds = sum(cost["seconds"] for cost in costs)
+    size = sum(cost["bytes"] for cost in costs)
+
+    by_duty = seconds / MAX_DUTY_CYCLE
+    by_size = float(size) / MAX_BYTES_PER_SECOND
+    interval = nice_interval(max(MIN_INTERVAL, by_duty, by_size))
+
+    reasons = ["%d configuration(s) take %.1f s and %.0f KiB per report." % (len(costs), seconds, size / 1024.0)]
+    if by_duty >= by_size and by_duty > MIN_INTERVAL:
+        reasons.append("Gathering the reports should take at most %d%% of the time." % (MAX_DUTY_CYCLE * 100))
+    elif by_size > MIN_INTERVAL:
+        reasons.append("Uploads should stay below %d KiB/s on average." % (MAX_BYTES_PER_SECOND / 1024))
+    else:
+        reasons.append("The reports are cheap, the shortest interval is safe.")
+    return interval, reasons
+
+
+class IntervalAdvisor(object):
+    def __init__(self, stats=None, config_dir=CONFIG_DIR, sysconfig=SYSCONFIG_FILE):
+        self.stats = stats or ReportStats()
+        self.config_dir = config_dir
+        self.sysconfig = sysconfig
+
+    def costs(self, names):
+        measured = [self.stats.get(name) for name in names]
+        known = [m for m in measured if m]
+        # Assume the unknown configurations cost as much as the known ones on average
+        default = DEFAULT_COST
+        if known:
+            default = {
+                "seconds": sum(m["seconds"] for m in known) / len(known),
+                "bytes": sum(m["bytes"] for m in known) / len(known),
+            }
+        return [m or default for m in measured]
+
+    def recommend(self, extra_names=()):
+        """
+        Recommend an interval for the configurations of the configuration
+        directory and the ones about to be written.
+        """
+        names = configured_names(self.config_dir)
+        names += [name for name in extra_names if name not in names]
+        if not names:
+            return DEFAULT_INTERVAL, ["No configuration has been measured yet."]
+        return recommend_interval(self.costs(names))
+
+    def current_interval(self):
+        try:
+            with open(self.sysconfig) as fh:
+                for line in fh:
+                    if INTERVAL_RE.match(line) and not line.lstrip().startswith("#"):
+                        value = line.split("=", 1)[1].strip().strip('"\'')
+                        return int(value) if value.isdigit() else None
+        except IOError:
+            pass
+        return None
+
+    def apply(self, interval):
+        """
+        Set VIRTWHO_INTERVAL in the virt-who sysconfig file. virt-who must
+        be restarted to use it.
+        """
+        lines = []
+        if os.path.exists(self.sysconfig):
+            with open(self.sysconfig) as fh:
+                lines = fh.readlines()
+
+        setting = "VIRTWHO_INTERVAL=%d\n" % interval
+        active = [i for i, line in enumerate(lines) if INTERVAL_RE.match(line) and not line.lstrip().startswith("#")]
+        commented = [i for i, line in enumerate(lines) if INTERVAL_RE.match(line)]
+        if active:
+            lines[active[0]] = setting
+            for i in reversed(active[1:]):
+                del lines[i]
+        elif commented:
+            # Put it below the commented example
+            lines.insert(commented[0] + 1, setting)
+        else:
+            if lines and not lines[-1].endswith("\n"):
+                lines[-1] += "\n"
+            lines.append(setting)
+
+        atomic_write(self.sysconfig, lambda fh: fh.writelines(lines), mode=0644)
@@ -0,0 +1,181 @@
+"""
+Catalog of the organizations and environments known by RHSM.
+
+The catalog is fetched once through the RHSM connection, cached on disk
+for a while and searched in memory, so that the organization and
+environment pickers can filter it while the user types.
+"""
+import os
+import json
+import time
+import errno
+import hashlib
+from bisect import bisect_left
+
+from virt_who_tui.utils import atomic_write
+
+CACHE_DIR = "/var/cache/virt-who-tui"
+
+
+class PrefixIndex(object):
+    """
+    Case insensitive search of (value, label) entries. The entries whose
+    value or label starts with the text come first, followed by the ones
+    containing it. Longer texts are looked up with a trigram index.
+    """
+    GRAM = 3
+
+    def __init__(self, entries):
+        self.entries = sorted(set(entries), key=lambda e: e[0].lower())
+        self._haystacks = [(u"%s\t%s" % e).lower() for e in self.entries]
+        # Both the values and the labels can be looked up by prefix
+        self._prefixes = sorted(
+            [(e[0].lower(), i) for i, e in enumerate(self.entries)] +
+            [(e[1].lower(), i) for i, e in enumerate(self.entries) if e[1] != e[0]])
+        self._grams = {}
+        for i, haystack in enumerate(self._haystacks):
+            for gram in self._ngrams(haystack):
+                self._grams.setdefault(gram, set()).add(i)
+
+    def _ngrams(self, text):
+        return set(text[i:i + self.GRAM] for i in xrange(len(text) - self.GRAM + 1))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, text, limit=None):
+        text = unicode(text).lower()
+        if not text:
+            return self.entries[:limit]
+
+        found = []
+        seen = set()
+        pos = bisect_left(self._prefixes, (text,))
+        while pos < len(self._prefixes) and self._prefixes[pos][0].startswith(text):
+            idx = self._prefixes[pos][1]
+            if idx not in seen:
+                seen.add(idx)
+                found.append(idx)
+            pos += 1
+
+        if limit is None or len(found) < limit:
+            if len(text) >= self.GRAM:
+                candidates = None
+                for gram in self._ngrams(text):
+                    ids = self._grams.get(gram, set())
+                    candidates = ids if candidates is None else candidates & ids
+                    if not candidates:
+                        break
+                candidates = sorted(candidates or ())
+            else:
+                candidates = xrange(len(self.entries))
+            for idx in candidates:
+                if idx not in seen and text in self._haystacks[idx]:
+                    found.append(idx)
+                    if limit is not None and len(found) >= limit:
+                        break
+
+        return [self.entries[idx] for idx in found[:limit]]
+
+
+class Catalog(object):
+    """
+    The organizations and the environments of each organization
+    """
+    def __init__(self, orgs, environments, fetched=None):
+        # [(key, display name)]
+        self.orgs = orgs
+        # {org key: [environment name]}
+        self.environments = environments
+        self.fetched = fetched or time.time()
+        self._org_index = None
+        self._env_indexes = {}
+
+    @classmethod
+    def fetch(cls, connection, username=None, uuid=None, owner=None):
+        """
+        Fetch the organizations the user, or the registered host, belongs
+        to and their environments. The organization of the registered host
+        isn't fetched again if it is given as 'owner'.
+        """
+        if username:
+            owners = connection.getOwnerList(username)
+        else:
+            owners = [owner or connection.getOwner(uuid)]
+
+        orgs = []
+        environments = {}
+        for owner in owners:
+            if not owner:
+                continue
+            orgs.append((owner["key"], owner.get("displayName") or owner["key"]))
+            try:
+                envs = connection.getEnvironmentList(owner["key"])
+            except Exception:
+                # Environments are not supported by all the RHSM servers,
+                # e.g. the Customer Portal.
+                envs = []
+            environments[owner["key"]] = [env["name"] for env in envs]
+        return cls(orgs, environments)
+
+    def org_index(self):
+        if self._org_index is None:
+            self._org_index = PrefixIndex(self.orgs)
+        return self._org_index
+
+    def env_index(self, org=None):
+        """
+        Index of the environments of an organization, or of all the
+        organizations if the organization is unknown.
+        """
+        if org not in self.environments:
+            org = None
+        if org not in self._env_indexes:
+            if org is None:
+                names = set(name for envs in self.environments.itervalues() for name in envs)
+            else:
+                names = self.environments[org]
+            self._env_indexes[org] = PrefixIndex([(name, name) for name in names])
+        return self._env_indexes[org]
+
+    def to_dict(self):
+        return {
+            "orgs": self.orgs,
+            "environments": self.environments,
+            "fetched": self.fetched,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([tuple(org) for org in data["orgs"]], data["environments"], data["fetched"])
+
+
+class CatalogCache(object):
+    """
+    Cache the catalogs on disk for 'max_age' seconds
+    """
+    def __init__(self, cache_dir=CACHE_DIR, max_age=3600):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+
+    def path(self, key):
+        name = hashlib.sha1("\0".join(key)).hexdigest()
+        return os.path.join(self.cache_dir, "catalog-%s.json" % name)
+
+    def load(self, key):
+        try:
+            with open(self.path(key)) as fh:
+                catalog = Catalog.from_dict(json.load(fh))
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+        if time.time() - catalog.fetched > self.max_age:
+            return None
+        return catalog
+
+    def save(self, key, catalog):
+        try:
+            os.makedirs(self.cache_dir, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        atomic_write(self.path(key), lambda fh: json.dump(catalog.to_dict(), fh))
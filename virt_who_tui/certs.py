@@ -0,0 +1,289 @@
+"""
+Certificate inspection without external tools.
+
+The certificates are parsed in process with a minimal DER reader, which
+only extracts what the wizard needs: the subject, the issuer, the
+validity and the DNS names. Parsed local certificates are cached by path
+and modification time, the certificates of the servers by host and port.
+"""
+import os
+import re
+import ssl
+import time
+import base64
+import socket
+import calendar
+import threading
+from binascii import hexlify
+from collections import namedtuple
+
+Certificate = namedtuple('Certificate', ['subject', 'issuer', 'not_before', 'not_after', 'dns_names'])
+
+NAME_OIDS = {
+    "2.5.4.3": "CN",
+    "2.5.4.6": "C",
+    "2.5.4.7": "L",
+    "2.5.4.8": "ST",
+    "2.5.4.10": "O",
+    "2.5.4.11": "OU",
+}
+SAN_OID = "2.5.29.17"
+
+PEM_RE = re.compile(r'-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----', re.S)
+IP_RE = re.compile(r'^([\d.]+|[\da-fA-F.]*:[\da-fA-F:.]*)$')
+
+
+class CertificateError(Exception):
+    pass
+
+
+def _tlv(data, pos):
+    """
+    Read a DER tag, length and value at pos. Return the tag, the start and
+    the end of the value.
+    """
+    if pos + 2 > len(data):
+        raise CertificateError("Truncated certificate")
+    tag = ord(data[pos])
+    length = ord(data[pos + 1])
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7f
+        if not size or pos + size > len(data):
+            raise CertificateError("Invalid length in certificate")
+        length = int(hexlify(data[pos:pos + size]), 16)
+        pos += size
+    if pos + length > len(data):
+        raise CertificateError("Truncated certificate")
+    return tag, pos, pos + length
+
+
+def _items(data, start, end):
+    pos = start
+    while pos < end:
+        tag, vstart, vend = _tlv(data, pos)
+        yield tag, vstart, vend
+        pos = vend
+
+
+def _oid(value):
+    octets = [ord(c) for c in value]
+    parts = [octets[0] // 40, octets[0] % 40]
+    number = 0
+    for octet in octets[1:]:
+        number = (number << 7) | (octet & 0x7f)
+        if not octet & 0x80:
+            parts.append(number)
+            number = 0
+    return ".".join(str(p) for p in parts)
+
+
+def _name(data, start, end):
+    name = []
+    for _, rdn_start, rdn_end in _items(data, start, end):
+        for _, attr_start, attr_end in _items(data, rdn_start, rdn_end):
+            attr = list(_items(data, attr_start, attr_end))
+            oid = _oid(data[attr[0][1]:attr[0][2]])
+            name.append((NAME_OIDS.get(oid, oid), data[attr[1][1]:attr[1][2]]))
+    return tuple(name)
+
+
+def _time(tag, value):
+    if tag == 0x17:
+        # UTCTime: YYMMDDHHMMSSZ
+        year = int(value[:2])
+        value = ("19" if year >= 50 else "20") + value
+    return calendar.timegm(time.strptime(value[:14], "%Y%m%d%H%M%S"))
+
+
+def _dns_names(data, start, end):
+    names = []
+    for _, ext_start, ext_end in _items(data, start, end):
+        parts = list(_items(data, ext_start, ext_end))
+        if _oid(data[parts[0][1]:parts[0][2]]) != SAN_OID:
+            continue
+        # The value is the last part, after the optional critical flag
+        _, octets_start, octets_end = parts[-1]
+        _, seq_start, seq_end = _tlv(data, octets_start)
+        for tag, name_start, name_end in _items(data, seq_start, seq_end):
+            if tag == 0x82:
+                names.append(data[name_start:name_end])
+    return names
+
+
+def parse_certificate(der):
+    """
+    Parse a DER encoded X.509 certificate
+    """
+    try:
+        _, cert_start, cert_end = _tlv(der, 0)
+        _, tbs_start, tbs_end = _tlv(der, cert_start)
+        fields = list(_items(der, tbs_start, tbs_end))
+        if fields and fields[0][0] == 0xa0:
+            # Skip the explicit version
+            fields = fields[1:]
+        # serial, signature algorithm, issuer, validity, subject, public key, ...
+        issuer = _name(der, fields[2][1], fields[2][2])
+        validity = list(_items(der, fields[3][1], fields[3][2]))
+        subject = _name(der, fields[4][1], fields[4][2])
+        dns_names = []
+        for tag, start, end in fields[6:]:
+            if tag == 0xa3:
+                _, exts_start, exts_end = _tlv(der, start)
+                dns_names = _dns_names(der, exts_start, exts_end)
+        return Certificate(subject, issuer,
+                           _time(validity[0][0], der[validity[0][1]:validity[0][2]]),
+                           _time(validity[1][0], der[validity[1][1]:validity[1][2]]),
+                           dns_names)
+    except (IndexError, ValueError) as e:
+        raise CertificateError("Invalid certificate: %s" % e)
+
+
+def pem_to_der(pem):
+    match = PEM_RE.search(pem)
+    if not match:
+        raise CertificateError("No PEM certificate found")
+    return base64.b64decode("".join(match.group(1).split()))
+
+
+def common_name(name):
+    for key, value in name:
+        if key == "CN":
+            return value
+    return None
+
+
+_files = {}
+_files_lock = threading.Lock()
+
+
+def load_certificate_file(path):
+    """
+    Parse a PEM certificate file. The result is cached until the file is
+    modified.
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime, stat.st_size)
+    with _files_lock:
+        cached = _files.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    with open(path) as fh:
+        cert = parse_certificate(pem_to_der(fh.read()))
+    with _files_lock:
+        _files[path] = (key, cert)
+    return cert
+
+
+def subject_common_name(path):
+    """
+    Return the common name of the subject of a certificate file, or None
+    """
+    try:
+        return common_name(load_certificate_file(path).subject)
+    except (IOError, OSError, CertificateError):
+        return None
+
+
+def fetch_server_certificate(host, port=443, timeout=10):
+    """
+    Return the DER encoded certificate presented by a server
+    """
+    sock = socket.create_connection((host, port), timeout)
+    try:
+        if hasattr(ssl, "SSLContext"):
+            # Name the host, a server hosting several names would present
+            # its default certificate otherwise
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.verify_mode = ssl.CERT_NONE
+            tls = context.wrap_socket(sock, server_hostname=None if IP_RE.match(host) else host)
+        else:
+            tls = ssl.wrap_socket(sock, cert_reqs=ssl.CERT_NONE)
+        try:
+            return tls.getpeercert(binary_form=True)
+        finally:
+            tls.close()
+    finally:
+        sock.close()
+
+
+class ServerCertificates(object):
+    """
+    Certificates of the servers, fetched at most once every 'ttl' seconds
+    """
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._certs = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, host, port):
+        with self._lock:
+            cached = self._certs.get((host, port))
+        if cached and time.time() - cached[0] < self.ttl:
+            return cached
+        return None
+
+    def get(self, host, port):
+        cached = self._entry(host, port)
+        return cached[1] if cached else None
+
+    def put(self, host, port, der):
+        with self._lock:
+            # The certificate is parsed when its warnings are first asked for
+            self._certs[(host, port)] = (time.time(), der, None)
+
+    def missing(self, endpoints):
+        return [endpoint for endpoint in endpoints if self.get(*endpoint) is None]
+
+    def warnings(self, host, port, now=None):
+        cached = self._entry(host, port)
+        if cached is None:
+            return []
+        fetched, der, cert = cached
+        if cert is None:
+            cert = parse_certificate(der)
+            with self._lock:
+                # Unless it has been fetched again meanwhile
+                if self._certs.get((host, port)) is cached:
+                    self._certs[(host, port)] = (fetched, der, cert)
+        return certificate_warnings(cert, host, now)
+
+
+def fetch_certificates(endpoints, timeout=10):
+    """
+    Fetch the certificates of several (host, port) endpoints. Return a dict
+    of the DER certificates and a dict of the errors.
+    """
+    certs = {}
+    errors = {}
+    for host, port in endpoints:
+        try:
+            certs[(host, port)] = fetch_server_certificate(host, port, timeout)
+        except (socket.error, ssl.SSLError) as e:
+            errors[(host, port)] = str(e)
+    return certs, errors
+
+
+def _hostname_matches(host, pattern):
+    host = host.lower()
+    pattern = pattern.lower()
+    if pattern.startswith("*."):
+        return host.count(".") == pattern.count(".") and host.endswith(pattern[1:])
+    return host == pattern
+
+
+def certificate_warnings(cert, host, now=None):
+    now = now or time.time()
+    warnings = []
+    if cert.not_after < now:
+        warnings.append("The certificate of %s has expired on %s." % (host, time.strftime("%Y-%m-%d", time.gmtime(cert.not_after))))
+    elif cert.not_after - now < 30 * 24 * 3600:
+        warnings.append("The certificate of %s expires on %s." % (host, time.strftime("%Y-%m-%d", time.gmtime(cert.not_after))))
+    if cert.not_before > now:
+        warnings.append("The certificate of %s is not valid yet." % host)
+    if cert.subject == cert.issuer:
+        warnings.append("The certificate of %s is self-signed." % host)
+    names = cert.dns_names or [common_name(cert.subject) or ""]
+    if not IP_RE.match(host) and not any(_hostname_matches(host, name) for name in names):
+        warnings.append("The certificate of %s is issued for %s." % (host, ", ".join(names)))
+    return warnings
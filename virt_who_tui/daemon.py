@@ -0,0 +1,310 @@
+"""
+Long running mode serving a JSON API on a local Unix socket.
+
+Automation can validate, test, write configurations and restart virt-who
+without paying the start up cost of the application for every call. The
+verified subscription manager sessions are kept for a while, so testing
+several configurations reporting to the same server only connects once.
+
+Every request and response is a JSON object on a single line:
+
+    {"id": 1, "method": "validate", "params": {"config_name": "esx1", "type": "esx", ...}}
+    {"id": 1, "ok": true, "result": {"errors": []}}
+"""
+import os
+import sys
+import json
+import time
+import errno
+import hashlib
+import argparse
+import threading
+import SocketServer
+
+from virt_who_tui.task import TaskResult
+from virt_who_tui.worker import WorkerPool
+
+SOCKET_PATH = "/run/virt-who-tui.sock"
+
+
+class RequestError(Exception):
+    pass
+
+
+def call_with_deadline(func, timeout):
+    """
+    Call func in a thread and return its TaskResult. The thread is left
+    behind if the deadline is reached.
+    """
+    result = {}
+
+    def target():
+        try:
+            result["value"] = func()
+        except Exception as e:
+            result["error"] = repr(e)
+
+    started = time.time()
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        task_result = TaskResult(TaskResult.TIMEOUT, timeout=timeout)
+    elif "error" in result:
+        task_result = TaskResult(TaskResult.ERROR, result["error"])
+    else:
+        task_result = TaskResult(TaskResult.OK, result["value"])
+    task_result.elapsed = time.time() - started
+    return task_result
+
+
+class SessionCache(object):
+    """
+    Subscription manager connections which have been verified recently,
+    by connection settings. A connection is only reused once a request
+    made with it has succeeded again.
+    """
+    FIELDS = ["smType", "sat_server", "sat_username", "sat_password", "rhsm_hostname", "rhsm_prefix",
+              "rhsm_port", "rhsm_username", "rhsm_password", "rhsm_proxy_hostname", "rhsm_proxy_port",
+              "rhsm_proxy_user", "rhsm_proxy_password"]
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def key(self, values):
+        # Don't keep the passwords in memory longer than needed
+        return hashlib.sha256(json.dumps([values.get(field) for field in self.FIELDS])).hexdigest()
+
+    def get(self, key):
+        """
+        Return the manager and its lock, or None
+        """
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry and time.time() - entry[0] < self.ttl:
+                return entry[1], entry[2]
+            self._sessions.pop(key, None)
+            return None
+
+    def put(self, key, manager, lock=None):
+        with self._lock:
+            self._sessions[key] = (time.time(), manager, lock or threading.Lock())
+
+    def forget(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def _reuse(self, key, timeout):
+        """
+        Make a request with the cached connection. Return True if it has
+        succeeded.
+        """
+        entry = self.get(key)
+        if entry is None:
+            return False
+        manager, lock = entry
+        # The connection isn't shared, e.g. with a request left behind by a deadline
+        if not lock.acquire(False):
+            return False
+
+        def ping():
+            try:
+                errors = []
+                with manager.sm_error_handler(errors):
+                    manager.ping()
+                return errors
+            finally:
+                lock.release()
+
+        result = call_with_deadline(ping, timeout)
+        if result.ok and not result.value:
+            self.put(key, manager, lock)
+            return True
+        self.forget(key)
+        return False
+
+    def connect(self, virt_config, config, timeout):
+        """
+        Check the connection to the subscription manager, with the one
+        verified recently with the same settings if there is one. Return
+        the errors and whether the session has been reused.
+        """
+        key = self.key(virt_config.values())
+        if self._reuse(key, timeout):
+            return [], True
+
+        def connect():
+            errors = []
+            manager = virt_config.get_sm_manager(config)
+            with manager.sm_error_handler(errors):
+                manager.connect()
+            return manager, errors
+
+        result = call_with_deadline(connect, timeout)
+        if not result.ok:
+            return [result.message()], False
+        manager, errors = result.value
+        if not errors:
+            self.put(key, manager)
+        return errors, False
+
+
+class ProvisioningDaemon(object):
+    """
+    Handle the API requests. Each request works on its own copy of the
+    warm VirtConfig, so the requests can be handled concurrently.
+    """
+    def __init__(self, virt_config, socket_path=SOCKET_PATH, session_ttl=300, workers=2):
+        self.virt_config = virt_config
+        self.socket_path = socket_path
+        self.sessions = SessionCache(session_ttl)
+        # The hypervisor checks of concurrent requests run in their own workers
+        self.workers = WorkerPool(virt_config.worker, workers)
+        # Writing the files and restarting the service are serialized
+        self.write_lock = threading.Lock()
+        self.methods = {
+            "validate": self.validate,
+            "test-connection": self.test_connection,
+            "write-config": self.write_config,
+            "restart-service": self.restart_service,
+        }
+
+    def load(self, params):
+        virt_config = self.virt_config.clone()
+        virt_config.load_values(params)
+        return virt_config
+
+    def validate(self, params):
+        virt_config = self.load(params)
+        return {"errors": [e.message for e in virt_config.lint()]}
+
+    def test_connection(self, params):
+        virt_config = self.load(params)
+        config = virt_config.get_config()
+        sm_errors, cached = self.sessions.connect(virt_config, config, virt_config.timeouts["sm"])
+
+        # The hypervisor check redirects stdout and stderr, so it must run
+        # in its own process. Forking from the request threads could
+        # deadlock on a lock held by another thread, the checks are run
+        # by the workers instead.
+        result = self.workers.run("check_virt_connection", virt_config.values(), virt_config.timeouts["virt"])
+        if result is None:
+            raise RequestError("The %d workers are busy checking other hypervisors, try again later" % len(self.workers))
+        virt_errors = result.value if result.ok else [result.message()]
+        return {
+            "sm_errors": sm_errors,
+            "sm_session_reused": cached,
+            "virt_errors": virt_errors,
+            "virt_seconds": round(result.elapsed, 3),
+        }
+
+    def write_config(self, params):
+        virt_config = self.load(params)
+        errors = [e.message for e in virt_config.lint()]
+        if errors:
+            raise RequestError("; ".join(errors))
+
+        virt_config.encrypt_passwords()
+        with self.write_lock:
+            changes = virt_config.config_changes()
+            if changes is not None:
+                virt_config.to_ini()
+        return {
+            "filename": virt_config.filename(),
+            "changed": changes is not None,
+            "diff": changes or [],
+        }
+
+    def restart_service(self, params):
+        with self.write_lock:
+            error, elapsed = self.virt_config.restart_and_enable_virt_who()
+        if error:
+            raise RequestError(error)
+        return {"active_after": round(elapsed, 3)}
+
+    def handle(self, request):
+        response = {"id": request.get("id") if isinstance(request, dict) else None}
+        try:
+            if not isinstance(request, dict) or request.get("method") not in self.methods:
+                raise RequestError("Unknown method, choose from: %s" % ", ".join(sorted(self.methods)))
+            params = request.get("params") or {}
+            if not isinstance(params, dict):
+                raise RequestError("'params' must be an object")
+            response["result"] = self.methods[request["method"]](params)
+            response["ok"] = True
+        except Exception as e:
+            if not isinstance(e, RequestError):
+                self.virt_config.logger.exception("Failed to handle %r" % request.get("method"))
+            response["ok"] = False
+            response["error"] = str(e) or repr(e)
+        return response
+
+    def server(self):
+        daemon = self
+
+        class Handler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                for line in iter(self.rfile.readline, ""):
+                    if not line.strip():
+                        continue
+                    try:
+                        request = json.loads(line)
+                    except ValueError as e:
+                        response = {"id": None, "ok": False, "error": "Invalid JSON: %s" % e}
+                    else:
+                        response = daemon.handle(request)
+                    self.wfile.write(json.dumps(response) + "\n")
+                    self.wfile.flush()
+
+        try:
+            os.unlink(self.socket_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        # The API can write configurations, so only root can use it
+        old_umask = os.umask(0077)
+        try:
+            server = SocketServer.ThreadingUnixStreamServer(self.socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+        server.daemon_threads = True
+        return server
+
+    def serve_forever(self):
+        server = self.server()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(self.socket_path)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="virt-who-tui daemon",
+        description="Serve a JSON API to validate, test and write virt-who configurations.")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="path of the Unix socket (default: %s)" % SOCKET_PATH)
+    parser.add_argument("--session-ttl", type=int, default=300,
+        help="seconds a verified subscription manager connection is reused (default: 300)")
+    parser.add_argument("--workers", type=int, default=2,
+        help="number of hypervisor checks run at the same time (default: 2)")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    if os.geteuid() != 0:
+        print >>sys.stderr, "This application requires root permission. Please run it as root."
+        return 1
+
+    from virt_who_tui.virt_config import VirtConfig
+    virt_config = VirtConfig()
+    daemon = ProvisioningDaemon(virt_config, args.socket, args.session_ttl, args.workers)
+    daemon.workers.start()
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -0,0 +1,341 @@
+"""
+Discovery of the hypervisor management endpoints of a subnet.
+
+Every address of the subnet is probed concurrently by a bounded pool of
+threads. A probe first connects to one of the ports used by the virt-who
+backends and, only if it is open, asks the service to identify itself:
+
+    esx      vCenter/ESXi SDK over HTTPS
+    rhevm    RHEV-M/oVirt REST API over HTTPS
+    xen      XenServer management API over HTTPS
+    hyperv   WinRM over HTTP or HTTPS
+    libvirt  libvirtd listening on TCP or TLS
+
+Each socket operation of a probe has its own deadline, so unreachable
+addresses don't hold a worker for long. The ports can be overridden, to
+probe stand-in listeners.
+"""
+import re
+import sys
+import ssl
+import json
+import time
+import socket
+import struct
+import httplib
+import argparse
+import threading
+from Queue import Queue, Empty
+from collections import namedtuple
+
+# A discovered endpoint. 'server' is the value of the server option of virt-who.
+Endpoint = namedtuple('Endpoint', ['type', 'host', 'port', 'server', 'detail'])
+
+DEFAULT_PORTS = {
+    "https": 443,
+    "rhevm3": 8443,
+    "winrm": 5985,
+    "winrms": 5986,
+    "libvirt": 16509,
+    "libvirt_tls": 16514,
+}
+
+# Don't scan more than a /16 by mistake
+MAX_ADDRESSES = 65536
+# Only the beginning of the responses is needed to identify the services
+MAX_BODY = 64 * 1024
+
+
+class DiscoveryError(Exception):
+    pass
+
+
+def _ip_to_int(ip):
+    return struct.unpack("!I", socket.inet_aton(ip))[0]
+
+
+def _int_to_ip(number):
+    return socket.inet_ntoa(struct.pack("!I", number))
+
+
+def parse_network(network):
+    """
+    Return the addresses of a CIDR network, a single address or a host
+    name. The network and broadcast addresses are left out.
+    """
+    address, sep, prefix = network.partition("/")
+    if not sep:
+        return [address]
+    if not re.match(r'^\d+\.\d+\.\d+\.\d+$', address) or not prefix.isdigit() or int(prefix) > 32:
+        raise DiscoveryError("'%s' is not a valid IPv4 network, e.g. 192.168.0.0/24" % network)
+    try:
+        start = _ip_to_int(address)
+    except socket.error:
+        raise DiscoveryError("'%s' is not a valid IPv4 address" % address)
+
+    size = 2 ** (32 - int(prefix))
+    if size > MAX_ADDRESSES:
+        raise DiscoveryError("'%s' has more than %d addresses" % (network, MAX_ADDRESSES))
+    start &= ~(size - 1) & 0xffffffff
+    if size > 2:
+        return [_int_to_ip(n) for n in xrange(start + 1, start + size - 1)]
+    return [_int_to_ip(n) for n in xrange(start, start + size)]
+
+
+def _wrap_tls(sock, host):
+    # The endpoints commonly use self-signed certificates
+    if hasattr(ssl, "_create_unverified_context"):
+        return ssl._create_unverified_context().wrap_socket(sock, server_hostname=host)
+    return ssl.wrap_socket(sock, cert_reqs=ssl.CERT_NONE)
+
+
+def http_request(host, port, method, path, tls, timeout):
+    """
+    Return the status, the lower cased headers and the beginning of the
+    body of an HTTP response. Every socket operation waits at most
+    'timeout' seconds.
+    """
+    sock = socket.create_connection((host, port), timeout)
+    data = []
+    try:
+        if tls:
+            sock = _wrap_tls(sock, host)
+        sock.sendall("%s %s HTTP/1.0\r\nHost: %s:%d\r\nContent-Length: 0\r\nConnection: close\r\n\r\n" % (
+            method, path, host, port))
+        size = 0
+        try:
+            while size < MAX_BODY:
+                chunk = sock.recv(8192)
+                if not chunk:
+                    break
+                data.append(chunk)
+                size += len(chunk)
+        except (socket.error, ssl.SSLError):
+            # Some servers close the connection without shutting TLS down
+            if not data:
+                raise
+    finally:
+        sock.close()
+
+    head, sep, body = "".join(data).partition("\r\n\r\n")
+    lines = head.split("\r\n")
+    status = lines[0].split(None, 2)
+    if len(status) < 2 or not status[0].startswith("HTTP/") or not status[1].isdigit():
+        raise httplib.BadStatusLine(lines[0])
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return int(status[1]), headers, body
+
+
+def check_esx(host, port, timeout):
+    status, headers, body = http_request(host, port, "GET", "/sdk/vimServiceVersions.xml", True, timeout)
+    if "urn:vim25" in body:
+        return host if port == 443 else "https://%s:%d" % (host, port), "vSphere SDK"
+    return None
+
+
+def check_rhevm(host, port, timeout):
+    for path in ["/ovirt-engine/api", "/api"]:
+        status, headers, body = http_request(host, port, "GET", path, True, timeout)
+        realm = headers.get("www-authenticate", "")
+        if status in (200, 401) and ("RESTAPI" in realm or "ENGINE" in realm or "<api" in body):
+            server = "https://%s:%d%s" % (host, port, path[:-len("/api")])
+            return server, "oVirt API (%s)" % path
+    return None
+
+
+def check_xen(host, port, timeout):
+    status, headers, body = http_request(host, port, "GET", "/", True, timeout)
+    for product in ["XenServer", "Citrix Hypervisor", "XCP-ng"]:
+        if product in body:
+            return "https://%s" % host if port == 443 else "https://%s:%d" % (host, port), product
+    return None
+
+
+def check_hyperv(host, port, timeout, tls):
+    status, headers, body = http_request(host, port, "POST", "/wsman", tls, timeout)
+    if "Microsoft-HTTPAPI" in headers.get("server", ""):
+        if tls:
+            return "https://%s:%d" % (host, port), "WinRM over HTTPS"
+        return host if port == 5985 else "%s:%d" % (host, port), "WinRM"
+    return None
+
+
+# Header of a libvirt RPC call: length, program, version, procedure, type, serial, status
+LIBVIRT_PROGRAM = 0x20008086
+LIBVIRT_AUTH_LIST = 66
+LIBVIRT_HEADER = struct.Struct("!IIIiIII")
+
+
+def check_libvirt(host, port, timeout, transport):
+    """
+    libvirtd doesn't greet the clients, so ask it for the supported
+    authentication methods, which doesn't need to be authenticated.
+    """
+    raw = socket.create_connection((host, port), timeout)
+    try:
+        sock = raw
+        if transport == "tls":
+            try:
+                sock = _wrap_tls(raw, host)
+            except ssl.SSLError as e:
+                # libvirtd usually requires a client certificate
+                if "certificate" not in str(e).lower():
+                    raise
+                sock = None
+        if sock is not None:
+            sock.sendall(LIBVIRT_HEADER.pack(LIBVIRT_HEADER.size, LIBVIRT_PROGRAM, 1, LIBVIRT_AUTH_LIST, 0, 1, 0))
+            reply = ""
+            while len(reply) < LIBVIRT_HEADER.size:
+                chunk = sock.recv(LIBVIRT_HEADER.size - len(reply))
+                if not chunk:
+                    return None
+                reply += chunk
+            if LIBVIRT_HEADER.unpack(reply)[1] != LIBVIRT_PROGRAM:
+                return None
+    finally:
+        raw.close()
+
+    if port in (16509, 16514):
+        return "qemu+%s://%s/system" % (transport, host), "libvirtd (%s)" % transport
+    return "qemu+%s://%s:%d/system" % (transport, host, port), "libvirtd (%s)" % transport
+
+
+# The fingerprints of the services listening on each port
+FINGERPRINTS = {
+    "https": [("esx", check_esx), ("rhevm", check_rhevm), ("xen", check_xen)],
+    "rhevm3": [("rhevm", check_rhevm)],
+    "winrm": [("hyperv", lambda host, port, timeout: check_hyperv(host, port, timeout, False))],
+    "winrms": [("hyperv", lambda host, port, timeout: check_hyperv(host, port, timeout, True))],
+    "libvirt": [("libvirt", lambda host, port, timeout: check_libvirt(host, port, timeout, "tcp"))],
+    "libvirt_tls": [("libvirt", lambda host, port, timeout: check_libvirt(host, port, timeout, "tls"))],
+}
+
+
+class Discoverer(object):
+    """
+    Probe the addresses with at most 'workers' concurrent connections,
+    each socket operation waiting at most 'timeout' seconds.
+    """
+    def __init__(self, ports=None, timeout=2.0, workers=64):
+        self.ports = dict(DEFAULT_PORTS)
+        self.ports.update(ports or {})
+        self.timeout = timeout
+        self.workers = workers
+
+    def port_open(self, host, port):
+        try:
+            sock = socket.create_connection((host, port), self.timeout)
+        except (socket.error, socket.timeout):
+            return False
+        sock.close()
+        return True
+
+    def probe(self, host, service, types=None):
+        """
+        Return the endpoints found on a port of a host
+        """
+        port = self.ports[service]
+        if not self.port_open(host, port):
+            return []
+        found = []
+        for virt_type, check in FINGERPRINTS[service]:
+            if types and virt_type not in types:
+                continue
+            try:
+                result = check(host, port, self.timeout)
+            except (socket.error, socket.timeout, ssl.SSLError, httplib.HTTPException):
+                # Not the service, or it doesn't speak the expected protocol
+                continue
+            if result:
+                server, detail = result
+                found.append(Endpoint(virt_type, host, port, server, detail))
+                break
+        return found
+
+    def discover(self, network, types=None):
+        """
+        Return the endpoints found on a network, sorted by address
+        """
+        services = [service for service, checks in sorted(FINGERPRINTS.iteritems())
+                    if not types or any(virt_type in types for virt_type, check in checks)]
+        jobs = Queue()
+        for host in parse_network(network):
+            for service in services:
+                jobs.put((host, service))
+
+        found = []
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                try:
+                    host, service = jobs.get_nowait()
+                except Empty:
+                    return
+                endpoints = self.probe(host, service, types)
+                if endpoints:
+                    with lock:
+                        found.extend(endpoints)
+
+        threads = [threading.Thread(target=worker) for i in xrange(min(self.workers, jobs.qsize()))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        def address_key(endpoint):
+            try:
+                return (0, _ip_to_int(endpoint.host), endpoint.port)
+            except socket.error:
+                return (1, endpoint.host, endpoint.port)
+        return sorted(found, key=address_key)
+
+
+def discover(network, timeout=2.0, workers=64, ports=None, types=None):
+    return Discoverer(ports, timeout, workers).discover(network, types)
+
+
+def port_option(value):
+    service, sep, port = value.partition("=")
+    if not sep or service not in DEFAULT_PORTS or not port.isdigit() or not 0 < int(port) < 65536:
+        raise argparse.ArgumentTypeError("'%s' is not in the SERVICE=PORT format, SERVICE being one of: %s" % (
+            value, ", ".join(sorted(DEFAULT_PORTS))))
+    return service, int(port)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="virt-who-tui discover",
+        description="Find the hypervisor management endpoints of a network.")
+    parser.add_argument("network", help="IPv4 network in the CIDR notation, an address or a host name")
+    parser.add_argument("--timeout", type=float, default=2.0, help="deadline of each connection in seconds (default: 2)")
+    parser.add_argument("--workers", type=int, default=64, help="number of concurrent probes (default: 64)")
+    parser.add_argument("--type", action="append", dest="types", choices=sorted(set(
+        virt_type for checks in FINGERPRINTS.values() for virt_type, check in checks)),
+        help="only look for this hypervisor type, can be repeated")
+    parser.add_argument("--port", metavar="SERVICE=PORT", type=port_option, action="append", default=[],
+        help="probe a service on another port, e.g. a stand-in listener, one of: %s" % ", ".join(
+            "%s (default %d)" % item for item in sorted(DEFAULT_PORTS.iteritems())))
+    parser.add_argument("--json", action="store_true",
+        help="print the endpoints as JSON objects, which can be used as the 'params' of the daemon API")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    try:
+        endpoints = discover(args.network, args.timeout, args.workers, dict(args.port), args.types)
+    except DiscoveryError as e:
+        print >>sys.stderr, e
+        return 2
+
+    for endpoint in endpoints:
+        if args.json:
+            print json.dumps({"config_name": "%s-%s" % (endpoint.type, endpoint.host.replace(".", "-")),
+                              "type": endpoint.type, "server": endpoint.server})
+        else:
+            print "%-8s %-40s %s" % (endpoint.type, endpoint.server, endpoint.detail)
+
+    print >>sys.stderr, "%d endpoint(s) found in %.1fs" % (len(endpoints), time.time() - start)
+    return 0
@@ -1,7 +1,10 @@
+import os
 import sys
 import urwid
+import tempfile
 import traceback
 import StringIO
+from collections import deque
 
 class TextBox(urwid.Edit):
     """
@@ -12,17 +15,74 @@ class TextBox(urwid.Edit):
     Name: [________]
     """
     def __init__(self, caption, *args, **kwargs):
+        self.completer = None
+        self.completion = None
+        # Whether it is a password, which isn't shown or recorded
+        self.secret = False
         super(TextBox, self).__init__(*args, **kwargs)
         self.caption_label = urwid.Text(u"%s: " % caption, align="right")
         self.textbox_map = self
 
     def set_attr_field(self, notfocus, focus):
-        self.textbox_map = urwid.AttrMap(self, notfocus, focus)
+        self.textbox_map = urwid.AttrMap(self, {None: notfocus, 'completion': 'completion'},
+                                         {None: focus, 'completion': 'focuscompletion'})
+
+    def set_mask(self, mask):
+        super(TextBox, self).set_mask(mask)
+        self.secret = mask is not None
+
+    def set_completer(self, completer):
+        """
+        Complete the text inline while typing, e.g. with the values used
+        before. The completion is accepted with the Tab or Right key.
+        """
+        self.completer = completer
+        self._update_completion()
+
+    def _update_completion(self):
+        completion = None
+        if self.completer:
+            completion = self.completer.complete(self.get_edit_text())
+        if completion != self.completion:
+            self.completion = completion
+            self._invalidate()
+
+    def set_edit_text(self, text):
+        super(TextBox, self).set_edit_text(text)
+        self._update_completion()
+
+    def get_text(self):
+        text, attrib = super(TextBox, self).get_text()
+        if not self.completion or self.edit_pos != len(self.edit_text):
+            return text, attrib
+        # Show the rest of the completion after the text
+        suffix = self.completion[len(self.edit_text):]
+        return text + suffix, list(attrib) + [(None, len(text) - sum(n for a, n in attrib)), ('completion', len(suffix))]
+
+    def keypress(self, size, key):
+        if key in ('tab', 'right') and self.completion and self.edit_pos == len(self.edit_text):
+            self.set_edit_text(self.completion)
+            self.set_edit_pos(len(self.edit_text))
+            return None
+        return super(TextBox, self).keypress(size, key)
 
     def column(self):
         return urwid.Columns([(17, self.caption_label), (50, self.textbox_map)], dividechars=1)
 
 
+def focused_widget(widget):
+    """
+    Return the widget the keys are sent to
+    """
+    while widget is not None:
+        widget = widget.base_widget
+        focus = widget.focus
+        if focus is None:
+            return widget
+        widget = focus
+    return None
+
+
 class LabelBox(urwid.Text):
     """
     This class is used to render a read only field to be used in a form.
@@ -43,6 +103,219 @@ class LabelBox(urwid.Text):
         return urwid.Columns([(self.caption_size, self.caption_label), self.labelbox_map], dividechars=1)
 
 
+class SuggestionList(urwid.Pile):
+    """
+    This class is used to render a list of suggested values below a text
+    box. The suggestions are filtered while the user types and selecting
+    one of them fills the text box.
+    For example:
+
+    Organization: [ac_______]
+                  < ACME_Corporation >
+                  < Black_Acme       >
+    """
+    def __init__(self, textbox, suggest=None, limit=5, caption_size=17):
+        super(SuggestionList, self).__init__([])
+        self.textbox = textbox
+        self.suggest = suggest
+        self.limit = limit
+        self.caption_size = caption_size
+        urwid.connect_signal(textbox, 'change', self._on_change)
+
+    def _on_change(self, widget, text):
+        self.update(text)
+
+    def set_suggest(self, suggest):
+        self.suggest = suggest
+        self.update()
+
+    def update(self, text=None):
+        """
+        Show the suggestions of the current text
+        """
+        if text is None:
+            text = self.textbox.get_edit_text()
+        items = self.suggest(text, self.limit + 1) if self.suggest else []
+        widgets = []
+        for value, label in items[:self.limit]:
+            if value == text:
+                continue
+            caption = value if label == value else u"%s (%s)" % (label, value)
+            button = urwid.Button(caption, self._on_select, value)
+            widgets.append(urwid.Columns([(self.caption_size, urwid.Text("")),
+                                          urwid.AttrMap(button, 'help', 'focus')], dividechars=1))
+        if len(items) > self.limit:
+            widgets.append(urwid.Columns([(self.caption_size, urwid.Text("")),
+                                          urwid.Text(('help', u"  ... keep typing to narrow the list"))], dividechars=1))
+        self.contents[:] = [(w, self.options()) for w in widgets]
+
+    def _on_select(self, button, value):
+        self.textbox.set_edit_text(value)
+        self.textbox.set_edit_pos(len(value))
+
+
+class ErrorLine(urwid.Pile):
+    """
+    This class is used to render an error below a field. It takes no room
+    when there is no error.
+    For example:
+
+    Port: [44x______]
+          Port must be an integer.
+    """
+    def __init__(self, caption_size=17):
+        super(ErrorLine, self).__init__([])
+        self.caption_size = caption_size
+        self.message = None
+
+    def set_error(self, message):
+        if message == self.message:
+            return
+        self.message = message
+        widgets = []
+        if message:
+            widget = urwid.Text(('fail', message))
+            if self.caption_size:
+                widget = urwid.Columns([(self.caption_size, urwid.Text("")), widget], dividechars=1)
+            widgets.append(widget)
+        self.contents[:] = [(w, self.options()) for w in widgets]
+
+
+class Debouncer(object):
+    """
+    Call 'callback' from the urwid main loop with the keys which have been
+    triggered, once none has been triggered for 'delay' seconds.
+    """
+    def __init__(self, container, delay, callback):
+        self.container = container
+        self.delay = delay
+        self.callback = callback
+        self.keys = set()
+        self._alarm = None
+
+    def trigger(self, key):
+        self.keys.add(key)
+        loop = getattr(self.container, "loop", None)
+        if loop is None:
+            # Not running yet, the keys are kept until the next trigger
+            return
+        if self._alarm is not None:
+            loop.remove_alarm(self._alarm)
+        self._alarm = loop.set_alarm_in(self.delay, self._fire)
+
+    def cancel(self):
+        if self._alarm is not None:
+            self.container.loop.remove_alarm(self._alarm)
+            self._alarm = None
+        self.keys = set()
+
+    def _fire(self, loop, data):
+        self._alarm = None
+        keys, self.keys = self.keys, set()
+        self.callback(keys)
+
+
+class LineWalker(urwid.ListWalker):
+    """
+    This class walks through the lines of a text. The text is only split
+    as far as it is shown, and a widget is only made for the lines around
+    the visible ones, so a long text is wrapped a screen at a time.
+    """
+    CACHE_SIZE = 200
+
+    def __init__(self, text):
+        self.text = text.rstrip("\n")
+        # The offsets of the lines found so far
+        self.starts = [0]
+        self.complete = False
+        self.focus = 0
+        self._widgets = {}
+
+    def _has_line(self, pos):
+        while len(self.starts) <= pos and not self.complete:
+            end = self.text.find("\n", self.starts[-1])
+            if end < 0:
+                self.complete = True
+            else:
+                self.starts.append(end + 1)
+        return 0 <= pos < len(self.starts)
+
+    def line(self, pos):
+        start = self.starts[pos]
+        end = self.text.find("\n", start)
+        return self.text[start:] if end < 0 else self.text[start:end]
+
+    def _widget(self, pos):
+        if not self._has_line(pos):
+            return None, None
+        widget = self._widgets.get(pos)
+        if widget is None:
+            if len(self._widgets) >= self.CACHE_SIZE:
+                self._widgets.clear()
+            widget = self._widgets[pos] = urwid.Text(self.line(pos).expandtabs(4))
+        return widget, pos
+
+    def get_focus(self):
+        return self._widget(self.focus)
+
+    def set_focus(self, pos):
+        self.focus = pos
+        self._modified()
+
+    def get_next(self, pos):
+        return self._widget(pos + 1)
+
+    def get_prev(self, pos):
+        return self._widget(pos - 1)
+
+
+class TextViewer(urwid.ListBox):
+    """
+    This class is used to render a long text, such as a traceback, which
+    can be scrolled with the arrow and page keys or the mouse wheel.
+    """
+    def __init__(self, text):
+        self.walker = LineWalker(text)
+        super(TextViewer, self).__init__(self.walker)
+        self._size = None
+
+    def render(self, size, focus=False):
+        self._size = size
+        return super(TextViewer, self).render(size, focus)
+
+    def scroll(self, key):
+        """
+        Scroll with a key, while the focus is on another widget
+        """
+        if self._size is None:
+            return key
+        return self.keypress(self._size, key)
+
+    def mouse_event(self, size, event, button, col, row, focus):
+        if button in (4, 5) and urwid.util.is_mouse_press(event):
+            for i in xrange(3):
+                self.keypress(size, 'up' if button == 4 else 'down')
+            return True
+        return super(TextViewer, self).mouse_event(size, event, button, col, row, focus)
+
+
+class ScrollKeys(urwid.WidgetWrap):
+    """
+    Pass the scrolling keys the focused widget doesn't use to a viewer
+    """
+    KEYS = ('up', 'down', 'page up', 'page down')
+
+    def __init__(self, widget, viewer):
+        super(ScrollKeys, self).__init__(widget)
+        self.viewer = viewer
+
+    def keypress(self, size, key):
+        key = self._w.keypress(size, key)
+        if key in self.KEYS:
+            return self.viewer.scroll(key)
+        return key
+
+
 class TuiContainerDisplay(object):
     """
     This class provides a container that can contain urwid widgets.
@@ -59,7 +332,9 @@ class TuiContainerDisplay(object):
         ('error',      'white',      'dark red'),
         ('fail',       'dark red',   'light gray'),
         ('pass',       'dark green', 'light gray'),
-        ('help',       'light blue', 'light gray')
+        ('help',       'light blue', 'light gray'),
+        ('completion', 'dark gray',  'dark cyan'),
+        ('focuscompletion', 'light blue', 'dark blue'),
     ]
 
     def __init__(self, logger, height, width):
@@ -86,9 +361,44 @@ class TuiContainerDisplay(object):
         w = urwid.Padding(w, 'center', self.width)
         w = urwid.Filler(w, 'middle', self.height)
         self.main = urwid.AttrWrap(w, 'border')
+        # The page being shown
+        self.page = None
+        # Record the keys typed on each page, see replay.KeyRecorder
+        self.recorder = None
+        # The calls queued by threads for the main loop, see call_soon()
+        self._calls = deque()
+        self._pipe = None
+
+    def filter_input(self, keys, raw):
+        if self.recorder is not None:
+            self.recorder.record(self.page, keys, self.loop.screen_size, focused_widget(self.main))
+        return keys
+
+    def watch_calls(self):
+        """
+        Get ready to run the calls queued by threads. It must be called
+        from the main loop, before the threads are started.
+        """
+        if self._pipe is None:
+            self._pipe = self.loop.watch_pipe(self._run_calls)
+
+    def call_soon(self, func, *args):
+        """
+        Queue a call to be run by the main loop. Threads must use it
+        instead of changing the widgets themselves.
+        """
+        self._calls.append((func, args))
+        # Wake the main loop up
+        os.write(self._pipe, "x")
+
+    def _run_calls(self, data):
+        while self._calls:
+            func, args = self._calls.popleft()
+            func(*args)
+        return True
 
     def run(self):
-        self.loop = urwid.MainLoop(self.main, self.palette)
+        self.loop = urwid.MainLoop(self.main, self.palette, input_filter=self.filter_input)
         try:
             self.loop.run()
             return 0, ""
@@ -110,6 +420,8 @@ class TuiDisplay(object):
         self.title = None
         self.body = []
         self.buttons = []
+        # Called on 'Quit', the application only exits if it returns True
+        self.confirm_exit = None
         # Default exit button
         self.add_button('Quit', self.exit_program)
 
@@ -117,6 +429,11 @@ class TuiDisplay(object):
         """
         Exit the application
         """
+        if self.confirm_exit is not None and not self.confirm_exit():
+            return
+        self.exit_now(button)
+
+    def exit_now(self, button):
         raise urwid.ExitMainLoop()
 
     def add_button(self, name, callback=None):
@@ -149,15 +466,16 @@ class TuiDisplay(object):
                 return button
         raise KeyError("Could not find button '%s'" % name)
 
-    def set_frame(self, focus_part='body'):
+    def set_frame(self, focus_part='body', list_box=None):
         """
-        Add all widgets into a frame.
+        Add all widgets into a frame, or the given list box instead.
         """
-        if self.text is not None:
-            self.body = [urwid.Text(self.text), urwid.Divider()] + self.body
+        if list_box is None:
+            if self.text is not None:
+                self.body = [urwid.Text(self.text), urwid.Divider()] + self.body
 
-        self.contents = urwid.SimpleFocusListWalker(self.body)
-        list_box = urwid.ListBox(self.contents)
+            self.contents = urwid.SimpleFocusListWalker(self.body)
+            list_box = urwid.ListBox(self.contents)
         frame = urwid.Frame(urwid.LineBox(list_box), focus_part=focus_part)
 
         if self.title is not None:
@@ -166,11 +484,22 @@ class TuiDisplay(object):
             frame.header = urwid.Pile([title_wid, urwid.Divider()])
 
         if self.buttons:
-            button_grid = urwid.GridFlow(self.buttons, 10, 3, 1, 'right')
-            frame.footer = urwid.Pile([button_grid])
+            frame.footer = self.button_grid()
 
         return frame
 
+    def button_grid(self):
+        # Make the cells wide enough for the longest label: "< label >"
+        width = max([10] + [len(button.label) + 4 for button in self.buttons])
+        return urwid.Pile([urwid.GridFlow(self.buttons, width, 3, 1, 'right')])
+
+    def refresh_buttons(self):
+        """
+        Redraw the buttons of a frame at runtime.
+        """
+        self.current_frame.footer = self.button_grid() if self.buttons else None
+        self.container.loop.draw_screen()
+
     def refresh_body(self):
         """
         Redraw the body of a frame at runtime. Usually, it is used to
@@ -221,6 +550,8 @@ class FormTuiDisplay(TuiDisplay):
         label_size = kwargs.get("label_size", 17)
         help_msg = kwargs.get("help")
         value = kwargs.get("value", "")
+        # Called with the name of the field when its value changes
+        on_change = kwargs.get("on_change")
 
         if not label:
             raise KeyError("Please specify label for the field.")
@@ -237,12 +568,23 @@ class FormTuiDisplay(TuiDisplay):
 
             textbox.set_attr_field('inputtext', 'focustext')
             setattr(self, name, textbox)
-            input_fields.append(textbox.column())
+            column = textbox.column()
+            if on_change:
+                urwid.connect_signal(textbox, 'change', lambda widget, text: on_change(name))
+                # The list box doesn't like empty widgets, keep the error with the field
+                column = urwid.Pile([column, self._error_line(name, label_size)])
+            input_fields.append(column)
             if help_msg:
                 labelbox = LabelBox("", help_msg)
                 labelbox.set_attr_field('help', None)
                 labelbox.caption_size = label_size
                 input_fields.append(labelbox.column())
+            if kwargs.get("completer"):
+                textbox.set_completer(kwargs["completer"])
+            if "suggest" in kwargs:
+                suggestions = SuggestionList(textbox, kwargs["suggest"], caption_size=label_size)
+                setattr(self, "%s_suggestions" % name, suggestions)
+                input_fields.append(suggestions)
         elif ftype == 'label':
             labelbox = LabelBox(label, value)
             labelbox.caption_size = label_size
@@ -265,11 +607,20 @@ class FormTuiDisplay(TuiDisplay):
                 field = urwid.RadioButton(getattr(self, name), l, False)
                 field_map = urwid.AttrMap(field, 'selectable', 'focus')
                 input_fields.append(field)
+                if on_change:
+                    urwid.connect_signal(field, 'change', lambda widget, state: on_change(name))
+            if on_change:
+                input_fields[-1] = urwid.Pile([input_fields[-1], self._error_line(name, 0)])
         else:
             raise KeyError("Field '%s' is not supported." % ftype)
 
         self.body += input_fields
 
+    def _error_line(self, name, caption_size):
+        error = ErrorLine(caption_size)
+        setattr(self, "%s_error" % name, error)
+        return error
+
     def print_text(self, name, **kwargs):
         """
         Print text to the screen at runtime.
@@ -283,12 +634,19 @@ class FormTuiDisplay(TuiDisplay):
 
 class PopUpTuiDisplay(FormTuiDisplay):
     """
-    This is a base class for a Pop up dialog box.
+    This is a base class for a Pop up dialog box. Contents too long for
+    the box are shown in a viewer which scrolls and can save them.
     """
+    # The room for the contents in the box
+    WIDTH = 52
+    LINES = 12
+
     def __init__(self, *args, **kwargs):
         super(PopUpTuiDisplay, self).__init__(*args, **kwargs)
         self.current_widget = self.container.body.original_widget
         self.pop_up = None
+        self.viewer = None
+        self.status = None
         self.remove_button("Quit")
 
     def close(self, button):
@@ -297,11 +655,51 @@ class PopUpTuiDisplay(FormTuiDisplay):
             self.pop_up._invalidate()
             self.pop_up = None
 
-    def render(self, contents=[]):
+    def is_long(self, contents):
+        """
+        Return True if the contents need more lines than a pop up has
+        """
+        lines = 0
         for content in contents:
-            self.body.append(urwid.Text(content))
+            if not isinstance(content, basestring):
+                return False
+            # The lines are wrapped at about the width of the pop up
+            lines += sum(len(line) // self.WIDTH + 1 for line in content.split("\n"))
+            if lines > self.LINES:
+                return True
+        return False
+
+    def save(self, button):
+        """
+        Save the whole text shown by the viewer to a file
+        """
+        text = self.viewer.walker.text
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        try:
+            # A new file only readable by the owner, whose name can't be guessed
+            fd, filename = tempfile.mkstemp(prefix="virt-who-tui-", suffix=".txt")
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(text + "\n")
+        except (IOError, OSError) as e:
+            self.status.set_text(('fail', "Failed to save: %s" % e))
+        else:
+            self.status.set_text(('pass', "Saved to %s" % filename))
 
-        w = self.set_frame(focus_part='footer')
+    def render(self, contents=[]):
+        if self.is_long(contents):
+            # Only the visible part of a long text is wrapped and rendered
+            self.viewer = TextViewer("\n".join(contents))
+            self.status = urwid.Text("")
+            # Last, the focus stays on OK or NO
+            self.add_button("Save", self.save)
+            w = self.set_frame(focus_part='footer', list_box=self.viewer)
+            w.footer = urwid.Pile([self.status, w.footer])
+            w = ScrollKeys(w, self.viewer)
+        else:
+            for content in contents:
+                self.body.append(urwid.Text(content))
+            w = self.set_frame(focus_part='footer')
         w = urwid.Padding(w, ('fixed left',2), ('fixed right',2))
         w = urwid.Filler(w, ('fixed top',1), ('fixed bottom',1))
         w = urwid.AttrWrap(w, 'body')
@@ -309,7 +707,10 @@ class PopUpTuiDisplay(FormTuiDisplay):
         w = urwid.Columns([w,('fixed', 2, urwid.AttrWrap(urwid.Filler(urwid.Text(('border', '  ')), "top"), 'shadow'))])
         w = urwid.Frame(w, footer=urwid.AttrWrap(urwid.Text(('border', '  ')),'shadow'))
         self.pop_up = w
-        widget = urwid.Overlay(self.pop_up, self.current_widget, ('fixed left', 5), 60, ('fixed top',10), 20)
+        if self.viewer is not None:
+            widget = urwid.Overlay(self.pop_up, self.current_widget, 'center', ('relative', 90), 'middle', ('relative', 90))
+        else:
+            widget = urwid.Overlay(self.pop_up, self.current_widget, ('fixed left', 5), 60, ('fixed top',10), 20)
         self.container.body.original_widget = widget
 
 class OkPopUpTuiDisplay(PopUpTuiDisplay):
@@ -327,6 +728,12 @@ class YesNoPopUpTuiDisplay(PopUpTuiDisplay):
     """
     def __init__(self, *args, **kwargs):
         on_yes = kwargs.pop("on_yes")
+        self.on_no = kwargs.pop("on_no", None)
         super(YesNoPopUpTuiDisplay, self).__init__(*args, **kwargs)
-        self.add_button("NO", self.close)
+        self.add_button("NO", self.no)
         self.add_button("YES", on_yes)
+
+    def no(self, button):
+        self.close(button)
+        if self.on_no:
+            self.on_no(button)
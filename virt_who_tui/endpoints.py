@@ -0,0 +1,142 @@
+"""
+Choose the closest of several subscription manager endpoints, e.g. the
+capsules of a Satellite 6 in different regions.
+
+All the candidates are probed at the same time. Each probe measures the
+TCP connection, the TLS handshake and an authenticated request to the
+API, every stage with its own deadline. The candidates which answered
+every stage are ranked by their total latency.
+"""
+import re
+import ssl
+import time
+import socket
+import threading
+from collections import namedtuple
+
+DEFAULT_PORT = 443
+
+
+class ProbeError(Exception):
+    pass
+
+
+class Measurement(namedtuple('Measurement', ['host', 'port', 'tcp', 'tls', 'api', 'error'])):
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def total(self):
+        return sum(stage for stage in [self.tcp, self.tls, self.api] if stage is not None)
+
+    def describe(self):
+        stages = []
+        for name, value in [("TCP", self.tcp), ("TLS", self.tls), ("API", self.api)]:
+            if value is not None:
+                stages.append("%s %.0f ms" % (name, value * 1000))
+        text = ", ".join(stages) or "unreachable"
+        if self.error:
+            text += " - %s" % self.error
+        return text
+
+
+def parse_candidates(text, default_port=DEFAULT_PORT):
+    """
+    Return the (host, port) of the candidates separated by commas or spaces
+    """
+    candidates = []
+    for item in re.split(r'[\s,]+', text or ""):
+        if not item:
+            continue
+        host, sep, port = item.rpartition(":")
+        if not sep or not port.isdigit():
+            host, port = item, default_port
+        candidates.append((host, int(port)))
+    return candidates
+
+
+def _stage(func, timeout):
+    """
+    Call func in a thread, and return how long it took and the error. A
+    stage which doesn't complete in time is left behind.
+    """
+    result = {}
+
+    def target():
+        try:
+            func()
+        except Exception as e:
+            result["error"] = str(e) or repr(e)
+
+    started = time.time()
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        return None, "timed out after %d s" % timeout
+    return time.time() - started, result.get("error")
+
+
+class EndpointProber(object):
+    """
+    Probe the candidates. api_check(host, port) makes the authenticated
+    request, and raises an exception if it fails.
+    """
+    def __init__(self, api_check=None, timeout=10):
+        self.api_check = api_check
+        self.timeout = timeout
+
+    def _tcp(self, host, port):
+        socket.create_connection((host, port), self.timeout).close()
+
+    def _tls(self, host, port):
+        sock = socket.create_connection((host, port), self.timeout)
+        try:
+            # Only the handshake is measured, the API check verifies the certificate
+            if hasattr(ssl, "_create_unverified_context"):
+                tls = ssl._create_unverified_context().wrap_socket(sock, server_hostname=host)
+            else:
+                tls = ssl.wrap_socket(sock, cert_reqs=ssl.CERT_NONE)
+            tls.close()
+        finally:
+            sock.close()
+
+    def probe(self, host, port):
+        timings = []
+        stages = [self._tcp, self._tls]
+        if self.api_check:
+            stages.append(self.api_check)
+        for stage in stages:
+            elapsed, error = _stage(lambda: stage(host, port), self.timeout)
+            if stage == self._tls and elapsed is not None and timings:
+                # The handshake includes connecting again
+                elapsed = max(elapsed - timings[0], 0.0)
+            if error:
+                # The stage failed, its duration means nothing
+                timings.append(None)
+                break
+            timings.append(elapsed)
+        timings += [None] * (3 - len(timings))
+        return Measurement(host, port, timings[0], timings[1], timings[2], error)
+
+    def rank(self, candidates):
+        """
+        Return the measurements of the candidates, the fastest first and
+        the failed ones last.
+        """
+        measurements = [None] * len(candidates)
+
+        def probe(idx, host, port):
+            measurements[idx] = self.probe(host, port)
+
+        threads = []
+        for idx, (host, port) in enumerate(candidates):
+            thread = threading.Thread(target=probe, args=(idx, host, port))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return sorted(measurements, key=lambda m: (not m.ok, m.total))
@@ -0,0 +1,86 @@
+"""
+The settings of a configuration, with their changes tracked.
+
+Every change of a value bumps the version of the model and records which
+field changed, so what is derived from the settings, such as the
+configuration parsed by virt-who, is only computed again when one of the
+fields it depends on has changed. Snapshots of the values are cheap and
+can be compared.
+"""
+
+
+class Snapshot(object):
+    """
+    The values of the fields of a model at a given version
+    """
+    __slots__ = ["fields", "values", "version"]
+
+    def __init__(self, fields, values, version):
+        self.fields = fields
+        self.values = values
+        self.version = version
+
+    def __eq__(self, other):
+        return isinstance(other, Snapshot) and self.fields == other.fields and self.values == other.values
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.values)
+
+    def get(self, field):
+        return self.values[self.fields.index(field)]
+
+    def as_dict(self):
+        return dict(zip(self.fields, self.values))
+
+
+class FieldModel(object):
+    """
+    The values of a fixed set of fields
+    """
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self._values = dict.fromkeys(self.fields)
+        # The version at which each field has last changed
+        self._changed = dict.fromkeys(self.fields, 0)
+        self.version = 0
+
+    def __contains__(self, field):
+        return field in self._values
+
+    def get(self, field):
+        return self._values[field]
+
+    def set(self, field, value):
+        """
+        Set a value. Return True if it has changed.
+        """
+        old = self._values[field]
+        # A str replacing the same unicode string is a change, RHSM only works with str
+        if old == value and type(old) is type(value):
+            return False
+        self.version += 1
+        self._values[field] = value
+        self._changed[field] = self.version
+        return True
+
+    def changed_since(self, version, fields=None):
+        """
+        Return True if one of the fields, or any field, has changed after
+        the given version
+        """
+        changed = self._changed
+        return any(changed[field] > version for field in (fields if fields is not None else self.fields))
+
+    def snapshot(self):
+        return Snapshot(self.fields, tuple(self._values[field] for field in self.fields), self.version)
+
+    def copy(self):
+        other = FieldModel.__new__(FieldModel)
+        other.fields = self.fields
+        other._values = dict(self._values)
+        other._changed = dict(self._changed)
+        other.version = self.version
+        return other
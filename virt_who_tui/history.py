@@ -0,0 +1,176 @@
+"""
+History of the values entered in the wizard, used to complete them.
+
+The values are collected from the existing configuration files and from
+the previous runs, ranked by how often and how recently they have been
+used and stored in a prefix tree.
+"""
+import os
+import json
+import time
+import errno
+from ConfigParser import SafeConfigParser, Error as ConfigParserError
+
+from virt_who_tui.utils import atomic_write
+
+HISTORY_FILE = "/var/lib/virt-who-tui/history.json"
+CONFIG_DIR = "/etc/virt-who.d"
+
+# The weight of a use is halved every HALF_LIFE seconds
+HALF_LIFE = 30 * 24 * 3600
+
+
+class _Node(object):
+    __slots__ = ('children', 'best', 'score')
+
+    def __init__(self):
+        self.children = {}
+        self.best = None
+        self.score = None
+
+
+class CompletionTrie(object):
+    """
+    Case insensitive prefix tree of values. Every node keeps the best
+    ranked value below it, so looking up the completion of a prefix
+    doesn't depend on the number of values.
+    """
+    def __init__(self, scores):
+        self.root = _Node()
+        for value, score in scores.iteritems():
+            self.insert(value, score)
+
+    def insert(self, value, score):
+        node = self.root
+        self._offer(node, value, score)
+        for char in value.lower():
+            node = node.children.setdefault(char, _Node())
+            self._offer(node, value, score)
+
+    def _offer(self, node, value, score):
+        if node.score is None or score > node.score:
+            node.best = value
+            node.score = score
+
+    def node(self, prefix, start=None):
+        node = start or self.root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+
+class Completer(object):
+    """
+    Complete the text of a text box. When the text grows by one character,
+    which is the case for every key stroke while typing, the lookup only
+    takes a single step from the previous node.
+    """
+    def __init__(self, trie):
+        self.trie = trie
+        self._text = ""
+        self._node = trie.root
+
+    def complete(self, text):
+        """
+        Return the best value starting with the text, or None
+        """
+        if not text:
+            return None
+        if self._node is not None and len(text) == len(self._text) + 1 and text.startswith(self._text):
+            node = self.trie.node(text[-1], self._node)
+        else:
+            node = self.trie.node(text)
+        self._text = text
+        self._node = node
+        if node is None or node.best is None or node.best == text:
+            return None
+        return node.best
+
+
+class HistoryStore(object):
+    """
+    Values of the fields used in the existing configurations and in the
+    previous runs of the wizard.
+    """
+    FIELDS = ["server", "username", "sat_server", "sat_username", "rhsm_hostname", "rhsm_username"]
+
+    def __init__(self, path=HISTORY_FILE, config_dir=CONFIG_DIR):
+        self.path = path
+        self.config_dir = config_dir
+        self._entries = None
+        self._completers = {}
+
+    @property
+    def entries(self):
+        # {field: {value: [count, last used]}}
+        if self._entries is None:
+            self._entries = self.load()
+        return self._entries
+
+    def load(self):
+        entries = dict((field, {}) for field in self.FIELDS)
+        try:
+            with open(self.path) as fh:
+                for field, values in json.load(fh).iteritems():
+                    if field in entries:
+                        entries[field].update(values)
+        except (IOError, ValueError, AttributeError):
+            pass
+
+        # The values of the existing configurations count as one use
+        for filename in self._config_files():
+            parser = SafeConfigParser()
+            try:
+                parser.read([filename])
+                mtime = os.path.getmtime(filename)
+            except (ConfigParserError, OSError):
+                continue
+            for section in parser.sections():
+                for field in self.FIELDS:
+                    if not parser.has_option(section, field):
+                        continue
+                    value = parser.get(section, field, raw=True)
+                    if value and value not in entries[field]:
+                        entries[field][value] = [1, mtime]
+        return entries
+
+    def _config_files(self):
+        try:
+            names = os.listdir(self.config_dir)
+        except OSError:
+            return []
+        return [os.path.join(self.config_dir, name) for name in sorted(names) if name.endswith(".conf")]
+
+    def scores(self, field, now=None):
+        now = now or time.time()
+        return dict((value, count * 0.5 ** (max(now - last, 0) / HALF_LIFE))
+                    for value, (count, last) in self.entries.get(field, {}).iteritems())
+
+    def completer(self, field):
+        if field not in self._completers:
+            self._completers[field] = Completer(CompletionTrie(self.scores(field)))
+        return self._completers[field]
+
+    def record(self, values):
+        """
+        Record the values used in a configuration and save the history
+        """
+        now = time.time()
+        for field in self.FIELDS:
+            value = values.get(field)
+            if not value:
+                continue
+            count, last = self.entries[field].get(value, [0, now])
+            self.entries[field][value] = [count + 1, now]
+            self._completers.pop(field, None)
+        self.save()
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        atomic_write(self.path, lambda fh: json.dump(self.entries, fh))
@@ -0,0 +1,82 @@
+"""
+Preview of the filter_hosts and exclude_hosts options of virt-who.
+
+The patterns are matched the way virt-who does it: a host is matched if
+the pattern matches its identifier as a wildcard or as a regular
+expression. The hosts matched by each pattern are remembered, so that
+editing the patterns only matches the new patterns against the hosts.
+"""
+import re
+import json
+import fnmatch
+from collections import namedtuple
+
+Host = namedtuple('Host', ['id', 'name', 'guests', 'bytes'])
+Preview = namedtuple('Preview', ['hosts', 'guests', 'bytes', 'total_hosts', 'total_guests', 'total_bytes'])
+
+
+def report_hosts(report):
+    """
+    Return the hosts of a report put in the queue by virt-who
+    """
+    if isinstance(report, tuple):
+        report = report[-1]
+    association = getattr(report, 'association', None) or {}
+    hosts = []
+    for hypervisor in association.get('hypervisors', []):
+        data = hypervisor.toDict() if hasattr(hypervisor, 'toDict') else repr(hypervisor)
+        name = getattr(hypervisor, 'name', None) or hypervisor.hypervisorId
+        hosts.append(Host(hypervisor.hypervisorId, name, len(getattr(hypervisor, 'guestIds', [])),
+                          len(json.dumps(data, default=repr))))
+    return hosts
+
+
+def parse_patterns(text):
+    return [p.strip() for p in (text or "").split(",") if p.strip()]
+
+
+class HostFilter(object):
+    def __init__(self, hosts):
+        self.hosts = list(hosts)
+        self._matches = {}
+        self._all = frozenset(xrange(len(self.hosts)))
+        self.total = self._sum(self._all)
+
+    def _sum(self, indexes):
+        guests = 0
+        size = 0
+        for idx in indexes:
+            guests += self.hosts[idx].guests
+            size += self.hosts[idx].bytes
+        return len(indexes), guests, size
+
+    def match(self, pattern):
+        """
+        Return the indexes of the hosts matched by a pattern
+        """
+        if pattern not in self._matches:
+            try:
+                regex = re.compile(pattern + "$")
+            except re.error:
+                regex = None
+            self._matches[pattern] = frozenset(
+                idx for idx, host in enumerate(self.hosts)
+                if fnmatch.fnmatch(host.id, pattern) or (regex is not None and regex.match(host.id)))
+        return self._matches[pattern]
+
+    def select(self, filter_hosts, exclude_hosts):
+        """
+        Return the indexes of the hosts which would be reported
+        """
+        include = parse_patterns(filter_hosts)
+        selected = self._all
+        if include:
+            selected = frozenset().union(*[self.match(p) for p in include])
+        exclude = parse_patterns(exclude_hosts)
+        if exclude:
+            selected = selected - frozenset().union(*[self.match(p) for p in exclude])
+        return selected
+
+    def preview(self, filter_hosts, exclude_hosts):
+        hosts, guests, size = self._sum(self.select(filter_hosts, exclude_hosts))
+        return Preview(hosts, guests, size, *self.total)
@@ -0,0 +1,105 @@
+"""
+Offline linter for virt-who configuration files.
+
+It checks every section of the configuration files against the
+validation rules used by the wizard and reports all the errors found,
+without connecting to any server.
+"""
+import os
+import sys
+import time
+import argparse
+from collections import namedtuple
+from ConfigParser import SafeConfigParser, Error as ConfigParserError
+
+from virt_who_tui.rules import RULES, RuleError
+
+CONFIG_DIR = "/etc/virt-who.d"
+
+LintResult = namedtuple('LintResult', ['path', 'section', 'errors'])
+
+
+class ConfigLinter(object):
+    """
+    Lint configuration files, directories of configuration files or
+    already parsed configurations.
+    """
+    def __init__(self, rules=RULES):
+        self.rules = rules
+        self.base_groups = [g for g in rules.groups() if g not in ("sm_type", "rhsm", "sat")]
+
+    def section_values(self, parser, section):
+        values = dict(parser.items(section, raw=True))
+        values["config_name"] = section
+        # The subscription manager is not stored in the file, it is
+        # Satellite 5 when the sat_* options are used, RHSM otherwise.
+        sat = any(key.startswith("sat_") for key in values)
+        values["smType"] = "sat" if sat else "rhsm"
+        return values
+
+    def groups(self, values):
+        groups = list(self.base_groups)
+        if values["smType"] == "sat":
+            groups.append("sat")
+        elif any(key.startswith("rhsm_") for key in values):
+            # Custom RHSM, otherwise the registration of the host is used
+            groups.append("rhsm")
+        return groups
+
+    def lint_values(self, values):
+        return self.rules.check(values, self.groups(values))
+
+    def lint_parser(self, parser, path=None):
+        results = []
+        for section in parser.sections():
+            values = self.section_values(parser, section)
+            results.append(LintResult(path, section, self.lint_values(values)))
+        return results
+
+    def lint_file(self, path):
+        parser = SafeConfigParser()
+        try:
+            with open(path) as fh:
+                parser.readfp(fh, path)
+        except (IOError, ConfigParserError) as e:
+            message = "; ".join(line.strip() for line in str(e).strip().splitlines())
+            return [LintResult(path, None, [RuleError("file", None, message)])]
+        return self.lint_parser(parser, path)
+
+    def config_files(self, path):
+        if not os.path.isdir(path):
+            return [path]
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.endswith(".conf")]
+
+    def lint_paths(self, paths):
+        for path in paths:
+            for filename in self.config_files(path):
+                for result in self.lint_file(filename):
+                    yield result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="virt-who-tui lint",
+        description="Check virt-who configuration files without connecting to any server.")
+    parser.add_argument("paths", nargs="*", default=[CONFIG_DIR],
+        help="configuration files or directories (default: %s)" % CONFIG_DIR)
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print the errors")
+    args = parser.parse_args(argv)
+
+    linter = ConfigLinter()
+    sections = 0
+    errors = 0
+    start = time.time()
+    for result in linter.lint_paths(args.paths):
+        sections += 1
+        errors += len(result.errors)
+        location = result.path if result.section is None else "%s [%s]" % (result.path, result.section)
+        for error in result.errors:
+            print "%s: %s" % (location, error.message)
+
+    if not args.quiet:
+        print >>sys.stderr, "%d section(s) checked, %d error(s) found in %.3fs" % (
+            sections, errors, time.time() - start)
+
+    return 1 if errors else 0
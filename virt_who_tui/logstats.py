@@ -0,0 +1,347 @@
+"""
+Statistics of the virt-who reports, computed from the virt-who log.
+
+The log is read once, line by line, and only the lines which may be
+interesting are matched against the precompiled patterns. The memory used
+doesn't depend on the size of the log: the durations and sizes are
+counted in logarithmic buckets, from which the percentiles are estimated.
+
+The statistics and the position reached in the log are cached, so that
+the next run only reads what has been appended since.
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import errno
+import hashlib
+import argparse
+
+from virt_who_tui.utils import atomic_write
+
+CACHE_DIR = "/var/cache/virt-who-tui"
+
+LINE_RE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d):(\d\d)(?:[,.](\d+))? \[(\S+) (\w+)\].*? - (.*)$')
+CONFIG_RE = re.compile(r'config "([^"]+)"')
+GATHERED_RE = re.compile(r'Report for config "([^"]+)" gathered')
+SENDING_RE = re.compile(r'(\d+) hypervisors and (\d+) guests')
+UPDATED_RE = re.compile(r'Mapping for config "([^"]+)" updated')
+PAYLOAD_RE = re.compile(r'(?:mapping|report)[^{\[]*?: ([{\[].*)$', re.I)
+
+# The lines of interest contain one of these, which is much cheaper to
+# look for than matching the patterns
+KEYWORDS = ("config \"", " ERROR]", " CRITICAL]", "hypervisors and", "apping")
+
+# Each bucket of the histograms is 10% wider than the previous one
+BUCKET_BASE = 1.1
+
+
+class Histogram(object):
+    """
+    Approximate distribution of positive values in constant memory
+    """
+    def __init__(self, buckets=None, count=0, total=0.0, maximum=0.0):
+        self.buckets = buckets or {}
+        self.count = count
+        self.total = total
+        self.maximum = maximum
+
+    def add(self, value):
+        idx = int(math.floor(math.log(max(value, 1e-3), BUCKET_BASE)))
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, pct):
+        if not self.count:
+            return None
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                # The upper bound of the bucket, but not more than the maximum
+                return min(BUCKET_BASE ** (idx + 1), self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        return {"buckets": dict((str(k), v) for k, v in self.buckets.iteritems()),
+                "count": self.count, "total": self.total, "maximum": self.maximum}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(dict((int(k), v) for k, v in data["buckets"].iteritems()),
+                   data["count"], data["total"], data["maximum"])
+
+
+class ConfigStats(object):
+    def __init__(self):
+        self.reports = 0
+        # The reports which have failed to be sent, whatever the number of
+        # errors they have logged
+        self.failed = 0
+        self.errors = 0
+        self.hypervisors = 0
+        self.guests = 0
+        self.durations = Histogram()
+        self.sizes = Histogram()
+        # When the report being sent has been gathered
+        self.gathered = None
+        self.last_error = None
+
+    def error_rate(self):
+        return float(self.failed) / self.reports if self.reports else (1.0 if self.errors else 0.0)
+
+    def to_dict(self):
+        data = dict(self.__dict__)
+        data["durations"] = self.durations.to_dict()
+        data["sizes"] = self.sizes.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.__dict__.update(data)
+        stats.durations = Histogram.from_dict(data["durations"])
+        stats.sizes = Histogram.from_dict(data["sizes"])
+        return stats
+
+
+class LogStats(object):
+    """
+    Statistics of the reports by configuration, and how far the log has
+    been read.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.configs = {}
+        self.offset = 0
+        self.identity = None
+        self.lines = 0
+        # The last configuration mentioned, to attribute the lines which
+        # don't name theirs
+        self._current = None
+        self._minutes = {}
+
+    def config(self, name):
+        if name not in self.configs:
+            self.configs[name] = ConfigStats()
+        return self.configs[name]
+
+    def _timestamp(self, minute, second, fraction):
+        # Parsing the dates is slow, so only do it once a minute
+        base = self._minutes.get(minute)
+        if base is None:
+            if len(self._minutes) > 1000:
+                self._minutes.clear()
+            base = self._minutes[minute] = time.mktime(time.strptime(minute, "%Y-%m-%d %H:%M"))
+        return base + int(second) + (float("0." + fraction) if fraction else 0.0)
+
+    def feed(self, line):
+        self.lines += 1
+        if not any(keyword in line for keyword in KEYWORDS):
+            return
+        match = LINE_RE.match(line)
+        if not match:
+            return
+        minute, second, fraction, logger, level, message = match.groups()
+
+        config = CONFIG_RE.search(message)
+        if config:
+            name = config.group(1)
+        elif logger.startswith("virtwho.") and not logger.startswith("virtwho.destination") and \
+                logger not in ("virtwho.main", "virtwho.rhsm"):
+            # The backends log with the name of their configuration
+            name = logger[len("virtwho."):]
+        else:
+            name = self._current
+        if name is not None:
+            self._current = name
+
+        if level in ("ERROR", "CRITICAL"):
+            if name is not None:
+                stats = self.config(name)
+                stats.errors += 1
+                stats.last_error = message[:200]
+                if stats.gathered is not None:
+                    # The report being sent has failed
+                    stats.failed += 1
+                    stats.gathered = None
+            return
+        if name is None:
+            return
+
+        stats = self.config(name)
+        gathered = GATHERED_RE.search(message)
+        if gathered:
+            stats.reports += 1
+            stats.gathered = self._timestamp(minute, second, fraction)
+            return
+
+        sending = SENDING_RE.search(message)
+        if sending:
+            stats.hypervisors = int(sending.group(1))
+            stats.guests = int(sending.group(2))
+            return
+
+        if UPDATED_RE.search(message):
+            if stats.gathered is not None:
+                stats.durations.add(max(self._timestamp(minute, second, fraction) - stats.gathered, 0.0))
+                stats.gathered = None
+            return
+
+        payload = PAYLOAD_RE.search(message)
+        if payload:
+            stats.sizes.add(len(payload.group(1)))
+
+    def update(self):
+        """
+        Read the lines appended since the last update. The log is read from
+        its start again if it has been rotated or truncated.
+        """
+        stat = os.stat(self.path)
+        identity = [stat.st_dev, stat.st_ino]
+        if identity != self.identity or stat.st_size < self.offset:
+            self.__init__(self.path)
+            self.identity = identity
+
+        with open(self.path, "rb") as fh:
+            fh.seek(self.offset)
+            for line in fh:
+                if not line.endswith("\n"):
+                    # Incomplete, it will be read next time
+                    break
+                self.offset += len(line)
+                self.feed(line)
+        return self
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "offset": self.offset,
+            "identity": self.identity,
+            "lines": self.lines,
+            "current": self._current,
+            "configs": dict((name, stats.to_dict()) for name, stats in self.configs.iteritems()),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data["path"])
+        stats.offset = data["offset"]
+        stats.identity = data["identity"]
+        stats.lines = data["lines"]
+        stats._current = data["current"]
+        stats.configs = dict((name, ConfigStats.from_dict(c)) for name, c in data["configs"].iteritems())
+        return stats
+
+    def summary(self):
+        """
+        Return a row of statistics by configuration
+        """
+        rows = []
+        for name in sorted(self.configs):
+            stats = self.configs[name]
+            rows.append({
+                "config": name,
+                "reports": stats.reports,
+                "failed": stats.failed,
+                "errors": stats.errors,
+                "error_rate": round(stats.error_rate(), 3),
+                "hypervisors": stats.hypervisors,
+                "guests": stats.guests,
+                "duration_p50": stats.durations.percentile(50),
+                "duration_p90": stats.durations.percentile(90),
+                "duration_p99": stats.durations.percentile(99),
+                "duration_max": stats.durations.maximum or None,
+                "size_mean": stats.sizes.mean(),
+                "size_max": stats.sizes.maximum or None,
+                "last_error": stats.last_error,
+            })
+        return rows
+
+
+class LogStatsCache(object):
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def filename(self, path):
+        return os.path.join(self.cache_dir, "logstats-%s.json" % hashlib.sha1(os.path.abspath(path)).hexdigest())
+
+    def load(self, path):
+        try:
+            with open(self.filename(path)) as fh:
+                return LogStats.from_dict(json.load(fh))
+        except (IOError, ValueError, KeyError, TypeError):
+            return LogStats(path)
+
+    def save(self, stats):
+        try:
+            os.makedirs(self.cache_dir, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        atomic_write(self.filename(stats.path), lambda fh: json.dump(stats.to_dict(), fh))
+
+
+def analyze(path, cache=None):
+    """
+    Update the cached statistics of a log. Return the summary, the number
+    of bytes read and the total number of lines.
+    """
+    stats = cache.load(path) if cache else LogStats(path)
+    offset = stats.offset
+    stats.update()
+    read = stats.offset - offset if stats.offset >= offset else stats.offset
+    if cache:
+        try:
+            cache.save(stats)
+        except (IOError, OSError):
+            pass
+    return stats.summary(), read, stats.lines
+
+
+def _seconds(value):
+    return "-" if value is None else "%.1fs" % value
+
+
+def format_rows(rows):
+    lines = ["%-20s %7s %6s %6s %6s %8s %8s %8s %9s" % (
+        "CONFIG", "REPORTS", "FAILED", "ERRORS", "RATE", "P50", "P90", "MAX", "PAYLOAD")]
+    for row in rows:
+        lines.append("%-20s %7d %6d %6d %5.0f%% %8s %8s %8s %9s" % (
+            row["config"][:20], row["reports"], row["failed"], row["errors"], row["error_rate"] * 100,
+            _seconds(row["duration_p50"]), _seconds(row["duration_p90"]), _seconds(row["duration_max"]),
+            "-" if row["size_mean"] is None else "%.0f B" % row["size_mean"]))
+    return lines
+
+
+def main(argv):
+    from virtwho import log
+    default = os.path.join(log.DEFAULT_LOG_DIR, log.DEFAULT_LOG_FILE)
+    parser = argparse.ArgumentParser(prog="virt-who-tui stats",
+        description="Show how long the virt-who reports take and how often they fail, by configuration.")
+    parser.add_argument("log", nargs="?", default=default, help="virt-who log file (default: %s)" % default)
+    parser.add_argument("--no-cache", action="store_true", help="read the whole log instead of what has been appended")
+    parser.add_argument("--json", action="store_true", help="print the statistics as JSON")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    try:
+        rows, read, lines = analyze(args.log, None if args.no_cache else LogStatsCache())
+    except (IOError, OSError) as e:
+        print >>sys.stderr, "Failed to read '%s': %s" % (args.log, e)
+        return 1
+
+    if args.json:
+        print json.dumps(rows, indent=2)
+    else:
+        print "\n".join(format_rows(rows))
+    print >>sys.stderr, "%d line(s), %d new byte(s) read in %.2fs" % (lines, read, time.time() - start)
+    return 0
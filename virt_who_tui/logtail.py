@@ -0,0 +1,129 @@
+"""
+Follow the end of a log file, however big it is.
+
+Only the last lines are kept. They are found by reading the file
+backwards from its end, and the file is then polled for appended lines.
+The rotations are noticed when the file is replaced or truncated.
+"""
+import os
+from collections import deque
+
+# Read the file backwards by blocks of this size
+BLOCK_SIZE = 8192
+# When more than this has been appended since the last poll, only the end
+# of the file is read again
+MAX_CATCH_UP = 1024 * 1024
+
+
+class LogTail(object):
+    """
+    The last 'size' lines of a log file
+    """
+    def __init__(self, path, size=200):
+        self.path = path
+        self.lines = deque(maxlen=size)
+        self._fh = None
+        self._identity = None
+        self._offset = 0
+        self._mtime = None
+        self._partial = ""
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+        self._fh = None
+
+    def _decode(self, line):
+        return line.rstrip("\r").decode("utf-8", "replace")
+
+    def _open(self, from_end):
+        self.close()
+        # Unbuffered, so that nothing stale is read after a truncation
+        self._fh = open(self.path, "rb", 0)
+        stat = os.fstat(self._fh.fileno())
+        self._identity = (stat.st_dev, stat.st_ino)
+        self._partial = ""
+        if from_end:
+            self._read_last_lines(stat.st_size)
+        else:
+            self._offset = 0
+            self._read_appended(stat.st_size)
+        self._mtime = stat.st_mtime
+
+    def _read_last_lines(self, size):
+        """
+        Read the last lines of the file, without reading all of it
+        """
+        pos = size
+        blocks = []
+        newlines = 0
+        while pos > 0 and newlines <= self.lines.maxlen and size - pos < MAX_CATCH_UP:
+            step = min(BLOCK_SIZE, pos)
+            pos -= step
+            self._fh.seek(pos)
+            block = self._fh.read(step)
+            blocks.append(block)
+            newlines += block.count("\n")
+
+        lines = "".join(reversed(blocks)).split("\n")
+        if pos > 0:
+            # The first line is incomplete
+            lines = lines[1:]
+        self._partial = lines.pop()
+        self.lines.clear()
+        self.lines.extend(self._decode(line) for line in lines[-self.lines.maxlen:])
+        self._offset = size
+
+    def _read_appended(self, size):
+        if size - self._offset > MAX_CATCH_UP:
+            self._read_last_lines(size)
+            return
+        self._fh.seek(self._offset)
+        data = self._fh.read(size - self._offset)
+        self._offset += len(data)
+        lines = (self._partial + data).split("\n")
+        self._partial = lines.pop()
+        self.lines.extend(self._decode(line) for line in lines)
+
+    def poll(self):
+        """
+        Read what has been appended since the last poll. Return True if the
+        lines have changed.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # The file may be missing for a moment while it is rotated
+            return False
+
+        if self._fh is None:
+            self._open(from_end=True)
+            return True
+
+        if (stat.st_dev, stat.st_ino) != self._identity:
+            # Rotated: read the end of the old file, then the new one from its start
+            self._read_appended(os.fstat(self._fh.fileno()).st_size)
+            self._open(from_end=False)
+            return True
+
+        truncated = stat.st_size < self._offset
+        if truncated:
+            # Truncated in place
+            self._offset = 0
+            self._partial = ""
+        elif stat.st_size == self._offset and stat.st_mtime == self._mtime:
+            return False
+
+        offset = self._offset
+        self._read_appended(stat.st_size)
+        self._mtime = stat.st_mtime
+        return truncated or self._offset != offset
+
+    def window(self, height):
+        """
+        Return the last 'height' lines, with the incomplete last line
+        """
+        lines = list(self.lines)
+        if self._partial:
+            lines.append(self._decode(self._partial))
+        return lines[-height:] if height > 0 else []
@@ -0,0 +1,191 @@
+"""
+Track the memory used to build the pages and by the backend calls.
+
+The tracking is off unless 'virt-who-tui --track-memory' is used. Each
+tracked operation records how much the resident memory grew while it
+ran and, when the tracemalloc module is available, how much the traced
+allocations grew. On exit, the operations are summarized with the places
+which allocated the most since the start: the source lines with
+tracemalloc, the types of the objects otherwise.
+
+The operations run by the worker process are measured there and sent back
+with the results of the checks.
+"""
+import gc
+import resource
+import threading
+import functools
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 only has it when patched for pytracemalloc
+    tracemalloc = None
+
+TOP_SITES = 10
+
+
+def rss():
+    """
+    Return the resident memory of the current process in bytes
+    """
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * resource.getpagesize()
+    except (IOError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss():
+    # Linux reports it in KiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _kib(value):
+    return "-" if value is None else "%+.0f KiB" % (value / 1024.0)
+
+
+class Usage(object):
+    """
+    How much the memory grew during the calls of an operation
+    """
+    def __init__(self):
+        self.calls = 0
+        self.rss = 0
+        self.max_rss = 0
+        self.traced = None
+
+    def add(self, rss_delta, traced_delta):
+        self.calls += 1
+        self.rss += rss_delta
+        self.max_rss = max(self.max_rss, rss_delta)
+        if traced_delta is not None:
+            self.traced = (self.traced or 0) + traced_delta
+
+
+class MemoryTracker(object):
+    """
+    The memory used by each operation, by label
+    """
+    def __init__(self):
+        self.enabled = False
+        self.usage = {}
+        # The records not sent to the parent process yet, only kept in the worker
+        self.pending = None
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def enable(self, frames=1):
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._baseline = self._snapshot()
+        self.enabled = True
+
+    def _snapshot(self):
+        if tracemalloc is not None:
+            return tracemalloc.take_snapshot()
+        counts = {}
+        for obj in gc.get_objects():
+            name = type(obj).__name__
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def _traced(self):
+        return tracemalloc.get_traced_memory()[0] if tracemalloc is not None else None
+
+    def start(self, label):
+        """
+        Start measuring an operation. Return a token to be given to stop(),
+        or None if the tracking is off.
+        """
+        if not self.enabled:
+            return None
+        return label, rss(), self._traced()
+
+    def stop(self, token):
+        if token is None:
+            return
+        label, rss_before, traced_before = token
+        traced = self._traced()
+        self.record(label, rss() - rss_before, None if traced is None else traced - traced_before)
+
+    @contextmanager
+    def measure(self, label):
+        token = self.start(label)
+        try:
+            yield
+        finally:
+            self.stop(token)
+
+    def record(self, label, rss_delta, traced_delta):
+        with self._lock:
+            if label not in self.usage:
+                self.usage[label] = Usage()
+            self.usage[label].add(rss_delta, traced_delta)
+            if self.pending is not None:
+                self.pending.append((label, rss_delta, traced_delta))
+
+    def drain(self):
+        """
+        Return the records made since the last call, to be sent to the
+        parent process
+        """
+        with self._lock:
+            records, self.pending = self.pending or [], ([] if self.enabled else None)
+        return records
+
+    def merge(self, records, suffix=""):
+        for label, rss_delta, traced_delta in records:
+            self.record(label + suffix, rss_delta, traced_delta)
+
+    def top_sites(self, limit=TOP_SITES):
+        """
+        Return the places which allocated the most since the tracking was
+        enabled, as (place, bytes or None, count)
+        """
+        snapshot = self._snapshot()
+        if tracemalloc is not None:
+            stats = snapshot.compare_to(self._baseline, "lineno")[:limit]
+            return [("%s:%d" % (stat.traceback[0].filename, stat.traceback[0].lineno), stat.size_diff, stat.count_diff)
+                    for stat in stats]
+        growth = [(name, None, count - self._baseline.get(name, 0)) for name, count in snapshot.iteritems()]
+        growth.sort(key=lambda site: -site[2])
+        return [site for site in growth[:limit] if site[2] > 0]
+
+    def summary(self):
+        lines = ["%-36s %6s %12s %12s %12s" % ("OPERATION", "CALLS", "RSS", "RSS MAX", "ALLOCATED")]
+        for label in sorted(self.usage, key=lambda label: -self.usage[label].rss):
+            usage = self.usage[label]
+            lines.append("%-36s %6d %12s %12s %12s" % (
+                label[:36], usage.calls, _kib(usage.rss), _kib(usage.max_rss), _kib(usage.traced)))
+        current = rss()
+        lines.append("Resident memory: %.1f MiB, peak %.1f MiB" % (current / 1048576.0, max(current, peak_rss()) / 1048576.0))
+
+        sites = self.top_sites()
+        if sites:
+            if tracemalloc is not None:
+                lines.append("Top allocation sites since the start:")
+            else:
+                lines.append("Top object types since the start (tracemalloc isn't available):")
+            for place, size, count in sites:
+                lines.append("  %-60s %12s %+8d" % (place[-60:], _kib(size) if size is not None else "", count))
+        return lines
+
+
+TRACKER = MemoryTracker()
+
+
+def tracked(label):
+    """
+    Decorate a function to measure its memory use when the tracking is on
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACKER.enabled:
+                return func(*args, **kwargs)
+            with TRACKER.measure(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,9 +1,21 @@
 import sys
 import os
+import time
 import urwid
 import logging
-
-from virt_who_tui.display import FormTuiDisplay, OkPopUpTuiDisplay, YesNoPopUpTuiDisplay
+import threading
+from contextlib import contextmanager
+
+from virt_who_tui.display import FormTuiDisplay, OkPopUpTuiDisplay, YesNoPopUpTuiDisplay, Debouncer
+from virt_who_tui.task import Task
+from virt_who_tui.worker import WorkerTask
+from virt_who_tui.hostfilter import HostFilter
+from virt_who_tui import discovery
+from virt_who_tui.logtail import LogTail
+from virt_who_tui import logstats
+from virt_who_tui.endpoints import parse_candidates
+from virt_who_tui.memtrack import TRACKER
+from virt_who_tui.rules import RULES
 
 from virtwho import log
 from virtwho.config import InvalidOption
@@ -14,14 +26,33 @@ class FormBase(object):
     This is a base class for a page. It provides basic functions to
     render and operate a page.
     """
+    # Seconds without any change before the fields are checked
+    CHECK_DELAY = 0.3
+    # The fields holding host names, which are resolved in the background
+    RESOLVED_FIELDS = ["server", "rhsm_hostname", "sat_server"]
+
     def __init__(self, container, input_data=None):
+        # Measure the memory used to build the page, until it is rendered
+        self._build = TRACKER.start("page %s" % type(self).__name__)
         self.input_data = input_data
         self.form = FormTuiDisplay(container)
         self.form.title = 'Virt-who TUI'
+        self.form.confirm_exit = self.confirm_exit
         self.container = container
         self.previous_page = None
         self.next_page = None
         self.next_button_label = "Next"
+        self.task = None
+        # The fields checked while typing, and the ones the user has changed
+        self.watched = []
+        self.touched = set()
+        self.checks = Debouncer(container, self.CHECK_DELAY, self.check_fields)
+        self._rule_errors = {}
+        self._host_errors = {}
+        # {field: hosts being resolved}
+        self._lookups = {}
+        # Set while the code, not the user, changes the fields
+        self._updating = False
 
     def render(self):
         """
@@ -33,7 +64,11 @@ class FormBase(object):
         if self.next_page:
             self.form.add_button(self.next_button_label, callback=self.go_next)
 
-        return self.form.render()
+        self.container.page = self
+        out = self.form.render()
+        TRACKER.stop(self._build)
+        self._build = None
+        return out
 
     def pop_up(self, title, contents, status='error'):
         """
@@ -43,14 +78,143 @@ class FormBase(object):
         dialog.title = (status, title)
         dialog.render(contents)
 
-    def yesno_pop_up(self, title, contents, on_yes):
+    def yesno_pop_up(self, title, contents, on_yes, on_no=None):
         """
         Pop up a dialog box with "YES" and "NO" buttons
         """
-        dialog = YesNoPopUpTuiDisplay(self.container, on_yes=on_yes)
+        dialog = YesNoPopUpTuiDisplay(self.container, on_yes=on_yes, on_no=on_no)
         dialog.title = ('error', title)
         dialog.render(contents)
 
+    def run_task(self, name, func, args, on_done):
+        """
+        Run a slow operation in a child process with a "Cancel" button. The
+        deadline of the operation is looked up by 'name'. on_done is called
+        with a TaskResult when the operation has completed.
+        """
+        self.cancel_task()
+        self.start_task(Task(self.container.loop, func, args, self.input_data.timeouts[name]), on_done)
+
+    def run_check(self, method, on_done, values=None):
+        """
+        Run a hypervisor check, a method of VirtConfig taking the parsed
+        configuration, in the warm worker process. It behaves like run_task.
+        The check uses the current settings, unless other 'values' are given.
+        """
+        self.cancel_task()
+        if values is None:
+            values = self.input_data.values()
+        task = WorkerTask(self.container.loop, self.input_data.worker, method, values,
+                          self.input_data.timeouts["virt"])
+        self.start_task(task, on_done)
+
+    def start_task(self, task, on_done):
+        def done(result):
+            self.task = None
+            self.form.remove_button("Cancel")
+            self.form.refresh_buttons()
+            on_done(result)
+
+        self.task = task
+        self.task.on_done = done
+        self.form.add_button("Cancel", lambda button: self.task.cancel())
+        self.form.refresh_buttons()
+        self.task.start()
+
+    def cancel_task(self):
+        if self.task:
+            self.task.cancel()
+        self.checks.cancel()
+
+    def add_checked_field(self, name, ftype, **kwargs):
+        """
+        Add a field which is checked while the user types. Its errors are
+        shown below it.
+        """
+        self.form.add_field(name, ftype, on_change=self.field_changed, **kwargs)
+        self.watched.append(name)
+
+    @contextmanager
+    def updating_fields(self):
+        """
+        The changes made to the fields by the code, unlike the ones made
+        by the user, don't make their errors appear
+        """
+        self._updating = True
+        try:
+            yield
+        finally:
+            self._updating = False
+
+    def field_changed(self, name):
+        if not self._updating:
+            self.touched.add(name)
+        self.checks.trigger(name)
+
+    def field_setting(self, name):
+        """
+        Return the setting a field of the form is for, and its value
+        """
+        return name, self.widget_value(getattr(self.form, name))
+
+    def check_fields(self, names):
+        """
+        Check the fields whose rules depend on the changed ones. Only the
+        errors of the fields the user has changed are shown.
+        """
+        values = self.input_data.values()
+        fields = {}
+        for name in self.watched:
+            setting, value = self.field_setting(name)
+            values[setting] = value
+            fields[setting] = name
+
+        for setting in RULES.affected([self.field_setting(name)[0] for name in names]):
+            name = fields.get(setting)
+            if name is None or name not in self.touched:
+                continue
+            error = RULES.field_error(values, setting)
+            self._rule_errors[name] = error.message if error else None
+            self.show_error(name)
+
+        for name in names:
+            if name in self.RESOLVED_FIELDS:
+                self.resolve_later(name, values[name])
+
+    def show_error(self, name):
+        error = getattr(self.form, "%s_error" % name)
+        error.set_error(self._rule_errors.get(name) or self._host_errors.get(name))
+
+    def resolve_later(self, name, value):
+        """
+        Resolve the host names of a field in a thread, the user interface
+        isn't blocked by a slow DNS server
+        """
+        hosts = self.input_data.server_hosts(name, value)
+        self._lookups[name] = hosts
+        self._host_errors.pop(name, None)
+        self.show_error(name)
+        if not hosts:
+            return
+        self.container.watch_calls()
+        container = self.container
+        resolve_host = self.input_data.resolve_host
+
+        def resolve():
+            errors = [error for error in map(resolve_host, hosts) if error]
+            container.call_soon(self._hosts_resolved, name, hosts, errors)
+
+        thread = threading.Thread(target=resolve)
+        thread.daemon = True
+        thread.start()
+
+    def _hosts_resolved(self, name, hosts, errors):
+        if self._lookups.get(name) != hosts:
+            # The field has changed since
+            return
+        self._host_errors[name] = "; ".join(errors) or None
+        self.show_error(name)
+
     def validate(self):
         """
         Perform validations before proceeding to the next page. This
@@ -64,6 +228,7 @@ class FormBase(object):
         the next page if all validations are passed, otherwise pop up a
         dialog box with error message.
         """
+        self.cancel_task()
         try:
             if self.validate():
                 self.render_next_page()
@@ -75,7 +240,28 @@ class FormBase(object):
         Go back to the previous page. It is triggered when the "BACK" button
         is clicked.
         """
+        self.cancel_task()
+        self.container.page = self.previous_page
         self.previous_page.form.set_current()
+        self.previous_page.resumed()
+
+    def resumed(self):
+        """
+        Called when the user comes back to this page from the next one
+        """
+        pass
+
+    def confirm_exit(self):
+        """
+        Return True if the application can exit. The configurations which
+        haven't been written yet are listed and the user is asked first.
+        """
+        pending = self.input_data.pending if self.input_data else []
+        if not pending:
+            return True
+        self.yesno_pop_up("Quit without writing the following configurations?", [p.filename for p in pending],
+                          self.form.exit_now)
+        return False
 
     def render_next_page(self):
         """
@@ -91,30 +277,32 @@ class FormBase(object):
         among the forms.
         """
         for args in fields:
-            value = None
             field = args[0] if isinstance(args, list) else args
             if not hasattr(self.form, field):
                 continue
-            # Clear old value
-            setattr(self.input_data, field, None)
-            element = getattr(self.form, field)
-            if isinstance(element, urwid.CheckBox):
-                value = element.state
-            elif isinstance(element, list):
-                # Elements are radio buttons
-                for e in element:
-                    if e.state:
-                        value = e.label
-                        break
-            else:
-                value = element.get_edit_text()
-                # Force unicode string to normal string, because unicode doesn't
-                # seem to work for RHSM connection. When providing unicode to
-                # connect to RHSM, the application crash.
-                if isinstance(value, unicode):
-                    value = str(value)
+            setattr(self.input_data, field, self.widget_value(getattr(self.form, field)))
 
-            setattr(self.input_data, field, value)
+    def widget_value(self, element):
+        """
+        Return the value of a field of the form
+        """
+        value = None
+        if isinstance(element, urwid.CheckBox):
+            value = element.state
+        elif isinstance(element, list):
+            # Elements are radio buttons
+            for e in element:
+                if e.state:
+                    value = e.label
+                    break
+        else:
+            value = element.get_edit_text()
+            # Force unicode string to normal string, because unicode doesn't
+            # seem to work for RHSM connection. When providing unicode to
+            # connect to RHSM, the application crash.
+            if isinstance(value, unicode):
+                value = str(value)
+        return value
 
 
 class WelcomePage(FormBase):
@@ -127,7 +315,7 @@ class WelcomePage(FormBase):
         self.form.title = "Welcome to Virt-who TUI"
         self.form.text = "Virt-who TUI aims to simplify the complexity of settings up virt-who by guiding users step by step.\n\n" + \
             "Please enter a name for your configuration. It can be any name that is meaningful to you, such as 'redhat_rhevm_library'."
-        self.form.add_field("config_name", "text", label="Name")
+        self.add_checked_field("config_name", "text", label="Name")
         self.next_page = SMPage
 
     def go_next(self, button):
@@ -154,7 +342,8 @@ class SMPage(FormBase):
         self.form.text = "Where does your Virt-who report to?"
         self.form.add_field("smType", "radio", label=self.input_data.SM)
         # Set RHSM to default
-        self.form.smType[0].set_state(True)
+        with self.updating_fields():
+            self.form.smType[0].set_state(True)
         # Need to set a default next page here, otherwise the next button won't appear
         self.next_page = SMConfigPage
 
@@ -220,20 +409,69 @@ class SMConfigPage(FormBase):
         self.form.title = "%s Information" % self.input_data.smType_label
 
         for args in self.FIELDS[self.prefix]:
-            self.form.add_field(args[0], args[1], label=args[2], div=args[3])
+            completer = None
+            if args[0] in self.input_data.history.FIELDS:
+                completer = self.input_data.history.completer(args[0])
+            help_msg = None
+            if args[0] == "rhsm_hostname":
+                help_msg = "Separate several capsules with commas to use the fastest one"
+            if args[1] == "check":
+                self.form.add_field(args[0], args[1], label=args[2], div=args[3])
+            else:
+                self.add_checked_field(args[0], args[1], label=args[2], div=args[3], completer=completer, help=help_msg)
 
         encrypt_checkbox = getattr(self.form, "%s_encrypt_pass" % self.prefix)
         encrypt_checkbox.state = True
 
         if self.input_data.smType_label == "Red Hat Customer Portal":
-            self.form.rhsm_hostname.set_edit_text(self.input_data.PORTAL_URL)
+            with self.updating_fields():
+                self.form.rhsm_hostname.set_edit_text(self.input_data.PORTAL_URL)
 
+        self.results_at = None
         self.next_page = VirtPage
 
     def go_next(self, button):
         self.populate_inputs(self.FIELDS[self.prefix])
+        if self.prefix == "rhsm" and len(parse_candidates(self.input_data.rhsm_hostname)) > 1:
+            self.find_fastest()
+            return
         super(SMConfigPage, self).go_next(button)
 
+    def find_fastest(self):
+        """
+        Probe the candidate hostnames and keep the fastest one
+        """
+        if self.results_at is not None:
+            del self.form.body[self.results_at:]
+        self.results_at = len(self.form.body)
+        self.form.print_text("probing", label="Measuring %d endpoints" % len(parse_candidates(self.input_data.rhsm_hostname)), div=1)
+        self.run_task("endpoints", self.input_data.rank_rhsm_endpoints, (self.input_data.rhsm_hostname,), self.endpoints_ranked)
+
+    def endpoints_ranked(self, result):
+        if not result.ok:
+            self.form.probing.set_text(('fail', result.state()))
+            if result.status != result.CANCELLED:
+                self.pop_up("Failed to measure the endpoints", [result.message()])
+            return
+
+        measurements = result.value
+        for idx, m in enumerate(measurements):
+            self.form.print_text("endpoint_%d" % idx, label="%s:%d" % (m.host, m.port),
+                                 value=(('pass' if m.ok else 'fail'), m.describe()), label_size=30)
+
+        best = measurements[0]
+        if not best.ok:
+            self.form.probing.set_text(('fail', "FAILED"))
+            self.pop_up("None of the endpoints answered", ["%s:%d: %s" % (m.host, m.port, m.error) for m in measurements])
+            return
+
+        self.form.probing.set_text(('pass', "%s:%d is the fastest" % (best.host, best.port)))
+        with self.updating_fields():
+            self.form.rhsm_hostname.set_edit_text(best.host)
+            if best.port != 443 or self.form.rhsm_port.get_edit_text():
+                self.form.rhsm_port.set_edit_text(str(best.port))
+        self.form.refresh_body()
+
     def validate(self):
         self.input_data.validate_rhsm_config()
         self.input_data.validate_satellite_config()
@@ -248,20 +486,126 @@ class VirtPage(FormBase):
         super(VirtPage, self).__init__(*args, **kwargs)
         self.form.title = 'Hypervisor Backend'
         self.form.text = "Choose a hypervisor backend that should be used to gather host/guest associations:"
-        self.form.add_field("virtual", "radio", label=self.input_data.VIRT_MAP.keys())
+        # Another configuration is being added, so it needs a name too
+        self.add_another = bool(self.input_data.pending)
+        if self.add_another:
+            names = ", ".join(p.name for p in self.input_data.pending)
+            self.form.text = "Configurations to be saved: %s\n\n" % names + \
+                "Please enter a name for the next configuration and " + self.form.text[0].lower() + self.form.text[1:]
+            self.add_checked_field("config_name", "text", label="Name", div=0)
+            self.form.body.append(urwid.Divider())
+        self.add_checked_field("virtual", "radio", label=self.input_data.VIRT_MAP.keys())
+        self.form.add_button("Discover", self.discover)
+        self.discovered = None
         self.next_page = VirtConfigPage
 
+    def field_setting(self, name):
+        if name == "virtual":
+            label = self.widget_value(self.form.virtual)
+            return "type", self.input_data.VIRT_MAP.get(label)
+        return super(VirtPage, self).field_setting(name)
+
+    def discover(self, button):
+        page = DiscoveryPage(self.container, input_data=self.input_data)
+        page.previous_page = self
+        page.render()
+
+    def use_endpoint(self, endpoint):
+        """
+        Select the backend of a discovered endpoint, its server is filled
+        in on the next page.
+        """
+        self.discovered = endpoint
+        for v in self.form.virtual:
+            if self.input_data.VIRT_MAP[v.label] == endpoint.type:
+                with self.updating_fields():
+                    v.set_state(True)
+
     def go_next(self, button):
+        if self.add_another:
+            self.populate_inputs(["config_name"])
         self.input_data.type = None
         for v in self.form.virtual:
             if not v.state:
                 continue
             self.input_data.set_type_by_label(v.label)
+        if self.discovered and self.discovered.type == self.input_data.type:
+            self.input_data.server = self.discovered.server
 
         super(VirtPage, self).go_next(button)
 
     def validate(self):
+        if self.add_another:
+            self.input_data.validate_new_config_name()
         self.input_data.validate_virt_type()
+        if self.add_another and os.path.exists(self.input_data.filename()):
+            msg = "A configuraton with the same name already exists in %s. Are you sure you want to REPLACE it?" % self.input_data.filename()
+            self.yesno_pop_up("Warning", [msg], lambda button: self.render_next_page())
+            return False
+        return True
+
+
+class DiscoveryPage(FormBase):
+    """
+    This page scans a network for hypervisor management endpoints, to
+    pick the one to be configured.
+    """
+    def __init__(self, *args, **kwargs):
+        super(DiscoveryPage, self).__init__(*args, **kwargs)
+        self.form.title = 'Discover Hypervisors'
+        self.form.text = "Enter a network to scan for vCenter/ESXi, RHEV-M, XenServer, Hyper-V and libvirt endpoints:"
+        self.form.add_field("network", "text", label="Network", help="e.g. 192.168.0.0/24")
+        self.form.add_button("Scan", self.scan)
+        self.endpoints = []
+        self.results_at = None
+
+    def scan(self, button):
+        network = self.form.network.get_edit_text().strip()
+        try:
+            discovery.parse_network(network)
+        except discovery.DiscoveryError as e:
+            self.pop_up("Invalid network", [str(e)])
+            return
+
+        # Replace the results of the previous scan
+        if self.results_at is not None:
+            del self.form.body[self.results_at:]
+        self.results_at = len(self.form.body)
+        self.form.endpoint = []
+        self.form.remove_button("Use")
+        self.form.print_text("scanning", label="Scanning %s" % network, div=1)
+        self.run_task("discover", discovery.discover, (network,), self.scanned)
+
+    def scanned(self, result):
+        if not result.ok:
+            self.form.scanning.set_text(('fail', result.state()))
+            if result.status != result.CANCELLED:
+                self.pop_up("Failed to scan the network", [result.message()])
+            return
+
+        self.endpoints = result.value
+        self.form.scanning.set_text(('pass', "%d FOUND in %.1fs" % (len(self.endpoints), result.elapsed)))
+        if not self.endpoints:
+            self.form.refresh_body()
+            return
+
+        labels = dict((value, label) for label, value in self.input_data.VIRT_MAP.iteritems())
+        self.form.add_field("endpoint", "radio", label=[
+            "%-8s %s (%s)" % (labels.get(e.type, e.type), e.server, e.detail) for e in self.endpoints], div=1)
+        with self.updating_fields():
+            self.form.endpoint[0].set_state(True)
+        self.form.refresh_body()
+        self.form.add_button("Use", self.use)
+        self.form.refresh_buttons()
+
+    def use(self, button):
+        for endpoint, radio in zip(self.endpoints, self.form.endpoint):
+            if radio.state:
+                self.previous_page.use_endpoint(endpoint)
+                break
+        self.go_back(button)
+
+    def validate(self):
         return True
 
 
@@ -286,25 +630,31 @@ class VirtConfigPage(FormBase):
                           "RHEV-M 4: https://host.example.com:443/ovirt-engine"
             username_help = "e.g. admin@internal"
 
+        self.catalog = None
         self.auto_set_owner = self.should_auto_set_owner()
         if self.auto_set_owner:
-            self.form.add_field("owner", "text", label="Organization:", value="Fetching...")
+            self.add_checked_field("owner", "text", label="Organization:", value="Fetching...", suggest=self.suggest_owner)
         else:
-            self.form.add_field("owner", "text", label="Organization", help="Can be retrieved by executing 'subscription-manager orgs' command. e.g. 1234567")
+            self.add_checked_field("owner", "text", label="Organization", help="Start typing to search, or run 'subscription-manager orgs' command. e.g. 1234567", value=self.input_data.owner or "", suggest=self.suggest_owner)
 
-        self.form.add_field("env",               "text",     label="Environment",  help="e.g. Library")
-        self.form.add_field("server",            "text",     label="Server",       help=server_help)
-        self.form.add_field("username",          "text",     label="Username",     help=username_help)
-        self.form.add_field("password",          "password", label="Password")
+        self.add_checked_field("env",            "text",     label="Environment",  help="e.g. Library", value=self.input_data.env or "", suggest=self.suggest_env)
+        history = self.input_data.history
+        self.add_checked_field("server",         "text",     label="Server",       help=server_help, value=self.input_data.server or "", completer=history.completer("server"))
+        self.add_checked_field("username",       "text",     label="Username",     help=username_help, completer=history.completer("username"))
+        self.add_checked_field("password",       "password", label="Password")
         self.form.add_field("hypervisor_label",  "label",    label="How will the hypervisor(s) be identified?", value="", div=2, label_size=50)
         self.form.hypervisor_label.caption_label.set_align_mode("left")
-        self.form.add_field("hypervisor_id",     "radio",    label=self.input_data.HYPERVISOR_IDS)
+        self.add_checked_field("hypervisor_id",  "radio",    label=self.input_data.HYPERVISOR_IDS)
         self.form.add_field("encrypt_pass",      "check",    label="Encrypt Password?", div=2)
         # Set uuid as default hypervisor id
-        self.form.hypervisor_id[0].set_state(True)
+        with self.updating_fields():
+            self.form.hypervisor_id[0].set_state(True)
         self.form.encrypt_pass.state = True
-        self.next_page = DetailPage
-        self.next_button_label = "Submit"
+        if self.input_data.type in self.input_data.FILTERABLE_VIRT:
+            self.next_page = FilterPage
+        else:
+            self.next_page = DetailPage
+            self.next_button_label = "Submit"
 
     def render(self):
         out = super(VirtConfigPage, self).render()
@@ -323,29 +673,102 @@ class VirtConfigPage(FormBase):
                 return True
         return False
 
-    def set_owner(self):
-        errors = []
-        owner = None
+    def suggest_owner(self, text, limit):
+        if not self.catalog:
+            return []
+        return self.catalog.org_index().search(text, limit)
+
+    def suggest_env(self, text, limit):
+        if not self.catalog:
+            return []
+        owner = self.form.owner.get_edit_text()
+        return self.catalog.env_index(owner).search(text, limit)
 
+    def load_catalog(self):
+        """
+        Load the organizations and environments to be suggested, from the
+        cache or from RHSM.
+        """
+        if self.input_data.smType != "rhsm":
+            return
+
+        self.catalog = self.input_data.catalogs.load(self.input_data.catalog_key())
+        if self.catalog:
+            self.catalog_loaded()
+            return
+
+        config = self.input_data.get_config()
+        self.run_task("catalog", self.input_data.get_catalog, (config,), self.catalog_fetched)
+
+    def catalog_fetched(self, result):
+        if not result.ok:
+            # The suggestions are optional, so don't bother the user
+            self.input_data.logger.warning("Failed to fetch the organizations: %s" % result.message())
+            return
+
+        catalog, errors = result.value
+        if errors:
+            self.input_data.logger.warning("Failed to fetch the organizations: %s" % ", ".join(errors))
+        if catalog:
+            self.use_catalog(catalog)
+
+    def use_catalog(self, catalog):
+        """
+        Suggest the organizations and environments of a fetched catalog,
+        and cache it
+        """
+        self.catalog = catalog
+        try:
+            self.input_data.catalogs.save(self.input_data.catalog_key(), catalog)
+        except (IOError, OSError) as e:
+            self.input_data.logger.warning("Failed to cache the organizations: %r" % e)
+        self.catalog_loaded()
+
+    def catalog_loaded(self):
+        self.form.owner_suggestions.update()
+        self.form.env_suggestions.update()
+        self.container.loop.draw_screen()
+
+    def set_owner(self):
         if not self.auto_set_owner:
+            self.load_catalog()
             return
 
+        # The catalog is fetched over the same connection, unless it is cached
+        self.catalog = self.input_data.catalogs.load(self.input_data.catalog_key())
+        if self.catalog:
+            self.catalog_loaded()
         config = self.input_data.get_config()
-        manager = self.input_data.get_sm_manager(config)
-        with manager.sm_error_handler(errors):
-            manager.connect()
-            owner = manager.connection.getOwner(manager.sm_manager.uuid())
-            if owner:
-                self.form.owner.set_edit_text(owner["key"])
-                self.input_data.owner = owner["key"]
+        self.run_task("owner", self.input_data.get_owner, (config, self.catalog is None), self.owner_fetched)
+
+    def owner_fetched(self, result):
+        if result.status == result.CANCELLED:
+            # Keep what the user may have typed in the meantime
+            if self.form.owner.get_edit_text() == "Fetching...":
+                with self.updating_fields():
+                    self.form.owner.set_edit_text("")
+            return
 
-        if not owner:
-            self.form.owner.set_edit_text("")
+        owner = None
+        catalog = None
+        errors = []
+        if result.ok:
+            owner, catalog, errors = result.value
+        else:
+            errors = [result.message()]
+
+        with self.updating_fields():
+            self.form.owner.set_edit_text(owner or "")
+        self.input_data.owner = owner
 
         if errors:
             self.pop_up("Failed to get Organization", errors)
 
+        if catalog:
+            self.use_catalog(catalog)
+
     def go_next(self, button):
+        self.cancel_task()
         fields = ["owner", "env", "server", "username", "password", "encrypt_pass", "hypervisor_id"]
         self.populate_inputs(fields)
         super(VirtConfigPage, self).go_next(button)
@@ -355,6 +778,78 @@ class VirtConfigPage(FormBase):
         return True
 
 
+class FilterPage(FormBase):
+    """
+    This page allows user to choose which hosts should be reported, with a
+    preview of how many hosts and guests would be reported.
+    """
+    def __init__(self, *args, **kwargs):
+        super(FilterPage, self).__init__(*args, **kwargs)
+        self.form.title = "Host Filtering (optional)"
+        self.form.text = "Reporting only the hosts that need subscriptions makes the reports smaller and faster. " + \
+            "Enter comma separated host identifiers (%s), wildcards such as 'esx-*' or regular expressions." % self.input_data.hypervisor_id
+        self.host_filter = None
+        self.probed = None
+        help_msg = "Leave empty to report all the hosts."
+        self.form.add_field("filter_hosts",  "text", label="Report only",  help=help_msg, value=self.input_data.filter_hosts or "")
+        self.form.add_field("exclude_hosts", "text", label="Exclude",      help=help_msg, value=self.input_data.exclude_hosts or "")
+        self.form.add_field("preview", "label", label="Listing the hosts...", value="", div=1, label_size=50)
+        self.form.preview.caption_label.set_align_mode("left")
+        urwid.connect_signal(self.form.filter_hosts, 'change', lambda widget, text: self.update_preview(filter_hosts=text))
+        urwid.connect_signal(self.form.exclude_hosts, 'change', lambda widget, text: self.update_preview(exclude_hosts=text))
+        self.next_page = DetailPage
+        self.next_button_label = "Submit"
+
+    def render(self):
+        out = super(FilterPage, self).render()
+        self.container.loop.draw_screen()
+        # List the hosts without any filter, as the empty fields of the form
+        # would set them, leaving the settings of the user alone
+        probe = self.input_data.clone()
+        probe.filter_hosts = ""
+        probe.exclude_hosts = ""
+        self.probed = probe.values()
+        self.run_check("probe_hosts", self.hosts_listed, self.probed)
+        return out
+
+    def hosts_listed(self, result):
+        if result.ok and not result.value[0]:
+            errors, hosts, measurement = result.value
+            self.host_filter = HostFilter(hosts)
+            self.update_preview()
+            # The probe is the report DetailPage would check without filters
+            self.input_data.steps.put("virt", self.probed, measurement, result.elapsed)
+            return
+
+        if result.ok:
+            message = "Failed to list the hosts, the filters can't be previewed."
+            self.input_data.logger.warning("%s %s" % (message, result.value[0]))
+        else:
+            message = "Listing the hosts: %s. The filters can't be previewed." % result.message()
+        self.form.preview.caption_label.set_text(('fail', message))
+
+    def update_preview(self, filter_hosts=None, exclude_hosts=None):
+        if self.host_filter is None:
+            return
+        if filter_hosts is None:
+            filter_hosts = self.form.filter_hosts.get_edit_text()
+        if exclude_hosts is None:
+            exclude_hosts = self.form.exclude_hosts.get_edit_text()
+        preview = self.host_filter.preview(filter_hosts, exclude_hosts)
+        self.form.preview.caption_label.set_text(
+            "Would report %d of %d hosts, %d of %d guests, about %.0f of %.0f KiB." % (
+                preview.hosts, preview.total_hosts, preview.guests, preview.total_guests,
+                preview.bytes / 1024.0, preview.total_bytes / 1024.0))
+
+    def go_next(self, button):
+        self.cancel_task()
+        self.populate_inputs(["filter_hosts", "exclude_hosts"])
+        super(FilterPage, self).go_next(button)
+
+    def validate(self):
+        return True
+
+
 class DetailPage(FormBase):
     """
     This is the last page. It tests the connections to the Subscription Manager
@@ -396,67 +891,429 @@ class DetailPage(FormBase):
 
         self.set_pass_state(self.form.get_config)
 
-        has_error = False
+        self.config = config
+        self.has_error = False
+        # The steps which passed with the same settings are not run again
+        self.values = self.input_data.values()
 
         # Test to connect to the subscription manager
         self.form.print_text("check_sm_connection", label="Connecting to Subscription Manager")
-        sm_errors = []
-        manager = self.input_data.get_sm_manager(config)
-        with manager.sm_error_handler(sm_errors):
-            manager.connect()
-            manager.logout()
-
-        if sm_errors:
-            self.pop_up("Failed to connect to '%s' server" % self.input_data.smType_label, sm_errors)
+        cached = self.input_data.steps.get("sm", self.values)
+        if cached:
+            self.set_cached_state(self.form.check_sm_connection, cached)
+            self.check_virt()
+            return
+        self.run_task("sm", self.input_data.check_sm_connection, (config,), self.sm_checked)
+
+    def set_cached_state(self, field, cached, details=None):
+        state = "PASSED (%s, cached from %s)" % (details or "in %.1fs" % cached.elapsed,
+                                                time.strftime("%H:%M:%S", time.localtime(cached.finished)))
+        field.set_text(('pass', state))
+
+    def set_task_fail_state(self, field, result):
+        """
+        Show why a background operation didn't complete. Return True if the
+        processing should go on.
+        """
+        field.set_text(('fail', result.state()))
+        if result.status == result.CANCELLED:
+            return False
+        if result.status == result.TIMEOUT:
+            self.pop_up(result.state().title(), [result.message()])
+        else:
+            self.pop_up("Unexpected error", [result.message()])
+        return True
+
+    def sm_checked(self, result):
+        if not result.ok:
+            self.has_error = True
+            if not self.set_task_fail_state(self.form.check_sm_connection, result):
+                return
+        elif result.value:
+            self.pop_up("Failed to connect to '%s' server" % self.input_data.smType_label, result.value)
             self.set_fail_state(self.form.check_sm_connection)
-            has_error = True
+            self.has_error = True
         else:
             self.set_pass_state(self.form.check_sm_connection)
+            self.input_data.steps.put("sm", self.values, elapsed=result.elapsed)
+
+        self.check_virt()
 
+    def check_virt(self):
         # Test to connect to the hypervisor backend
         self.form.print_text("check_virt_connection", label="Connecting to Hypervisor Backend")
-        errors = self.input_data.check_virt_connection(config)
+        cached = self.input_data.steps.get("virt", self.values)
+        if cached:
+            self.virt_passed(cached.value, cached)
+            return
+        self.run_check("check_virt_report", self.virt_checked)
+
+    def virt_checked(self, result):
+        if not result.ok:
+            self.set_task_fail_state(self.form.check_virt_connection, result)
+            return
+
+        errors, measurement = result.value
         if errors:
             self.pop_up("Failed to connect to '%s' server" %  self.input_data.humanize_type(), errors)
             self.set_fail_state(self.form.check_virt_connection)
-            has_error = True
+            return
+
+        self.input_data.steps.put("virt", self.values, measurement, result.elapsed)
+        self.virt_passed(measurement)
+
+    def virt_passed(self, measurement, cached=None):
+        details = None
+        if measurement:
+            details = "%d hosts, %d guests in %.1fs" % (
+                measurement["hypervisors"], measurement["guests"], measurement["seconds"])
+        if cached:
+            self.set_cached_state(self.form.check_virt_connection, cached, details)
+        elif details:
+            self.form.check_virt_connection.set_text(('pass', "PASSED (%s)" % details))
         else:
             self.set_pass_state(self.form.check_virt_connection)
 
-        if has_error:
+        if measurement:
+            # Also record it for a new configuration of the same hypervisor
+            try:
+                self.input_data.report_stats.record(self.input_data.config_name, measurement)
+            except (IOError, OSError) as e:
+                self.input_data.logger.warning("Failed to save the report measurement: %r" % e)
+
+        if self.has_error:
+            return
+
+        self.check_certificates()
+
+    def check_certificates(self):
+        """
+        Warn about the certificates of the servers. The certificates already
+        fetched during this session aren't fetched again.
+        """
+        self.endpoints = self.input_data.certificate_endpoints()
+        if not self.endpoints:
+            self.ready()
+            return
+        self.form.print_text("check_certificates", label="Checking server certificates")
+        self.run_task("certs", self.input_data.fetch_certificates, (self.endpoints,), self.certificates_checked)
+
+    def certificates_checked(self, result):
+        if result.status == result.CANCELLED:
+            self.form.check_certificates.set_text(('fail', result.state()))
             return
 
-        # Write the settings to file
+        # The certificates are only advisory, the connections have been tested already
+        if not result.ok:
+            self.input_data.logger.warning("Failed to fetch the server certificates: %s" % result.message())
+            self.form.check_certificates.set_text(('fail', result.state()))
+        else:
+            fetched, errors = result.value
+            self.input_data.store_certificates(fetched)
+            for (host, port), error in errors.iteritems():
+                self.input_data.logger.warning("Failed to fetch the certificate of %s:%d: %s" % (host, port, error))
+            warnings = self.input_data.certificate_warnings(self.endpoints)
+            if warnings:
+                self.form.check_certificates.set_text(('fail', "%d WARNING(S)" % len(warnings)))
+                self.pop_up("Certificate warnings", warnings)
+            else:
+                self.set_pass_state(self.form.check_certificates)
+        self.ready()
+
+    def ready(self):
+        self.show_interval()
+        self.form.print_text("ready", label="Press 'Finish' to save the configuration, or 'Add Another' to configure another hypervisor.")
+        self.form.add_button("Add Another", self.add_another)
+        self.form.add_button("Finish", self.finish)
+        self.form.refresh_buttons()
+
+    def show_interval(self):
+        """
+        Recommend a reporting interval for all the configurations.
+        """
+        names = [p.name for p in self.input_data.pending] + [self.input_data.config_name]
+        self.interval, reasons = self.input_data.advisor.recommend(names)
+        current = self.input_data.advisor.current_interval()
+        text = "Recommended report interval: %d s (current: %s). %s" % (
+            self.interval, "%d s" % current if current else "default", " ".join(reasons))
+        self.form.print_text("interval", label=text)
+        if current != self.interval:
+            self.form.add_button("Set Interval", self.set_interval)
+
+    def set_interval(self, button):
+        advisor = self.input_data.advisor
         try:
-            self.form.print_text("write_config", label="Writing configuraton file")
-            self.input_data.to_ini()
-            self.set_pass_state(self.form.write_config)
-        except IOError as e:
-            self.pop_up("Failed to create '%s' configuration file:" % self.input_data.filename(), [repr(e)])
-            self.set_fail_state(self.form.write_config)
+            advisor.apply(self.interval)
+        except (IOError, OSError) as e:
+            self.pop_up("Failed to update '%s':" % advisor.sysconfig, [repr(e)])
             return
+        # virt-who needs to be restarted to use the new interval
+        self.input_data.interval_changed = True
+        self.form.remove_button("Set Interval")
+        self.form.refresh_buttons()
+        self.pop_up("Report interval", ["VIRTWHO_INTERVAL=%d has been set in '%s'. It will be used when virt-who is restarted." % (
+            self.interval, advisor.sysconfig)], status="pass")
+
+    def add_another(self, button):
+        """
+        Queue the configuration and go back to the hypervisor page to
+        configure another hypervisor using the same subscription manager.
+        """
+        self.queued = list(self.input_data.pending)
+        self.input_data.queue_config()
+        self.input_data.start_new_config()
+        page = VirtPage(self.container, input_data=self.input_data)
+        page.previous_page = self
+        page.render()
+
+    def resumed(self):
+        """
+        Back from the other hypervisor: this configuration can be edited or
+        written again
+        """
+        self.unqueue(self.queued)
+        self.input_data.load_values(self.values)
 
-        # Start virt-who service
-        self.form.print_text("start_service", label="Starting virt-who service")
-        error = self.input_data.start_virt_who()
+    def finish(self, button):
+        """
+        Write all the configurations and restart virt-who once.
+        """
+        queued = list(self.input_data.pending)
+        self.input_data.queue_config()
+
+        # Only write the configurations and restart virt-who if the settings have
+        # changed, because restarting virt-who makes it report all the hypervisors again.
+        results = []
+        replaced = []
+        for pending in self.input_data.pending:
+            try:
+                changes = self.input_data.config_changes(pending)
+            except (UnwritableKeyFile, InvalidKeyFile, ValueError) as e:
+                self.unqueue(queued)
+                self.pop_up("Failed to compare with '%s' configuration file:" % pending.filename, [repr(e)])
+                return
+            results.append((pending, changes))
+            if changes and os.path.exists(pending.filename):
+                replaced += changes
+
+        if replaced:
+            self.yesno_pop_up("Apply the following changes?", replaced, lambda button: self.confirm_changes(results),
+                              lambda button: self.unqueue(queued))
+            return
+
+        self.save(results)
+
+    def unqueue(self, queued):
+        """
+        Nothing has been written, the current configuration can still be
+        edited or another one added
+        """
+        self.input_data.pending = queued
+
+    def restore_buttons(self):
+        if self.previous_page:
+            self.form.add_button("Back", self.go_back)
+        self.form.add_button("Add Another", self.add_another)
+        self.form.add_button("Finish", self.finish)
+        self.form.refresh_buttons()
+
+    def confirm_changes(self, results):
+        # Close the pop up
+        self.form.set_current()
+        self.save(results)
+
+    def save(self, results):
+        """
+        Write the changed configuration files and restart the virt-who service.
+        """
+        for label in ["Add Another", "Finish", "Set Interval", "Back"]:
+            self.form.remove_button(label)
+        self.form.refresh_buttons()
+
+        for idx, (pending, changes) in enumerate(results):
+            field = "write_config_%d" % idx
+            self.form.print_text(field, label="Writing '%s'" % pending.filename)
+            if changes is None:
+                getattr(self.form, field).set_text(('pass', "UNCHANGED"))
+                continue
+            try:
+                self.input_data.write_config(pending)
+                self.set_pass_state(getattr(self.form, field))
+                self.input_data.written.append(pending.filename)
+            except (IOError, OSError) as e:
+                self.pop_up("Failed to create '%s' configuration file:" % pending.filename, [repr(e)])
+                self.set_fail_state(getattr(self.form, field))
+                # The files written are applied by the next restart, the
+                # others can be written again
+                current = self.input_data.filename()
+                self.unqueue([p for p, _ in results[idx:] if p.filename != current])
+                self.restore_buttons()
+                return
+
+        self.input_data.pending = []
+
+        if self.input_data.written or self.input_data.interval_changed:
+            # Restart and enable virt-who service
+            self.form.print_text("start_service", label="Restarting virt-who service")
+            self.run_task("service", self.input_data.restart_and_enable_virt_who, (), self.service_restarted)
+        else:
+            # Enable virt-who service
+            self.form.print_text("enable_service", label="Enabling virt-who service")
+            self.run_task("service", self.input_data.enable_virt_who, (), self.service_enabled)
+
+    def service_restarted(self, result):
+        if not result.ok:
+            self.set_task_fail_state(self.form.start_service, result)
+            return
+
+        error, elapsed = result.value
         if error:
-            self.pop_up("Failed to start virt-who service", [error])
+            self.pop_up("Failed to restart virt-who service", [error])
             self.set_fail_state(self.form.start_service)
             return
 
-        self.set_pass_state(self.form.start_service)
+        self.form.start_service.set_text(('pass', "PASSED (active after %.1fs)" % elapsed))
+        self.input_data.interval_changed = False
+        self.input_data.written = []
+        self.completed(restarted=True)
 
-        # Enable virt-who service
-        self.form.print_text("enable_service", label="Enabling virt-who service")
-        error = self.input_data.enable_virt_who()
-        if error:
-            self.pop_up("Failed to enable virt-who service", [error])
+    def service_enabled(self, result):
+        if not result.ok:
+            self.set_task_fail_state(self.form.enable_service, result)
+            return
+
+        if result.value:
+            self.pop_up("Failed to enable virt-who service", [result.value])
             self.set_fail_state(self.form.enable_service)
             return
 
         self.set_pass_state(self.form.enable_service)
+        self.completed()
+
+    def completed(self, restarted=False):
+        summary = "Virt-who configuration has been completed successfully. "
+        if not restarted:
+            summary = "The configuration is already up to date, virt-who has not been restarted. "
 
+        self.form.add_button("View Log", self.view_log)
+        self.form.refresh_buttons()
         self.pop_up("Congratulations!!!", [
-            "Virt-who configuration has been completed successfully. " + \
-            "Please check the virt-who log in '%s/%s' for more information. \n\n" % (log.DEFAULT_LOG_DIR, log.DEFAULT_LOG_FILE) + \
+            summary + \
+            "Please check the virt-who log in '%s/%s' for more information, " % (log.DEFAULT_LOG_DIR, log.DEFAULT_LOG_FILE) + \
+            "or press 'View Log' to follow it here. \n\n" + \
             "Press 'Quit' button to exit this application"], status="pass")
+
+    def view_log(self, button):
+        page = LogPage(self.container, input_data=self.input_data)
+        page.previous_page = self
+        page.render()
+
+
+class LogPage(FormBase):
+    """
+    This page follows the end of the virt-who log, e.g. to watch the first
+    report after virt-who has been restarted.
+    """
+    # Seconds between two checks of the log file
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, *args, **kwargs):
+        super(LogPage, self).__init__(*args, **kwargs)
+        self.path = os.path.join(log.DEFAULT_LOG_DIR, log.DEFAULT_LOG_FILE)
+        self.form.title = "Virt-who Log"
+        self.form.text = "Following '%s':" % self.path
+        # Only the lines which can be seen are kept and drawn
+        self.tail = LogTail(self.path, self.visible_lines())
+        self.lines = urwid.Text("", wrap='clip')
+        self.form.body.append(self.lines)
+        self.form.add_button("Statistics", self.show_stats)
+        self.alarm = None
+
+    def visible_lines(self):
+        cols, rows = self.container.loop.screen.get_cols_rows()
+        # The container takes 80% of the screen, minus the title, the text,
+        # the borders and the buttons
+        return max(5, int(rows * 0.8) - 9)
+
+    def render(self):
+        out = super(LogPage, self).render()
+        self.refresh()
+        return out
+
+    def refresh(self, loop=None, data=None):
+        try:
+            changed = self.tail.poll()
+        except (IOError, OSError) as e:
+            self.lines.set_text(('fail', "Failed to read '%s': %s" % (self.path, e)))
+            changed = False
+        else:
+            if not os.path.exists(self.path) and not self.tail.lines:
+                self.lines.set_text("Waiting for virt-who to create the log...")
+        if changed:
+            self.lines.set_text("\n".join(self.tail.window(self.tail.lines.maxlen)))
+        self.alarm = self.container.loop.set_alarm_in(self.POLL_INTERVAL, self.refresh)
+
+    def stop(self):
+        if self.alarm:
+            self.container.loop.remove_alarm(self.alarm)
+            self.alarm = None
+
+    def show_stats(self, button):
+        self.stop()
+        page = LogStatsPage(self.container, input_data=self.input_data)
+        page.previous_page = self
+        page.path = self.path
+        page.render()
+
+    def go_back(self, button):
+        self.stop()
+        self.tail.close()
+        super(LogPage, self).go_back(button)
+
+    def validate(self):
+        return True
+
+
+class LogStatsPage(FormBase):
+    """
+    This page shows how long the virt-who reports take and how often they
+    fail, by configuration.
+    """
+    def __init__(self, *args, **kwargs):
+        super(LogStatsPage, self).__init__(*args, **kwargs)
+        self.form.title = "Virt-who Report Statistics"
+        self.path = os.path.join(log.DEFAULT_LOG_DIR, log.DEFAULT_LOG_FILE)
+
+    def render(self):
+        self.form.text = "Reports found in '%s':" % self.path
+        out = super(LogStatsPage, self).render()
+        self.form.print_text("analyze", label="Reading the log")
+        self.run_task("stats", logstats.analyze, (self.path, logstats.LogStatsCache()), self.analyzed)
+        return out
+
+    def analyzed(self, result):
+        if not result.ok:
+            self.form.analyze.set_text(('fail', result.state()))
+            if result.status != result.CANCELLED:
+                self.pop_up("Failed to read the log", [result.message()])
+            return
+
+        rows, read, lines = result.value
+        self.form.analyze.set_text(('pass', "%d lines, %d KiB read in %.1fs" % (lines, read / 1024, result.elapsed)))
+        if not rows:
+            self.form.print_text("no_reports", label="No report has been found.")
+            return
+        table = urwid.Text("\n".join(logstats.format_rows(rows)), wrap='clip')
+        self.form.body.append(urwid.Divider())
+        self.form.body.append(table)
+        for row in rows:
+            if row["last_error"]:
+                self.form.print_text("error_%s" % row["config"], label="Last error of %s: %s" % (row["config"], row["last_error"]))
+        self.form.refresh_body()
+
+    def go_back(self, button):
+        super(LogStatsPage, self).go_back(button)
+        self.previous_page.refresh()
+
+    def validate(self):
+        return True
@@ -0,0 +1,520 @@
+"""
+Replay the wizard from the welcome page to the last page, without a
+terminal, to catch the changes which make it slower.
+
+Each scenario is a script of inputs: text typed into the fields, radio
+buttons, check boxes and buttons pressed, or keys recorded from a real
+session with 'virt-who-tui --record FILE'. The script is replayed against
+the main loop of TuiContainerDisplay with a fake screen, which renders the
+pages without drawing them. The subscription managers and the hypervisors
+are replaced by stand-ins answering at once, so the measured time is the
+time spent by the wizard itself: building and drawing the pages, running
+the checks in child processes and in the worker, and handling the results.
+
+The time spent on each page, from when it is shown until the next page
+is shown, is compared with a stored baseline.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import argparse
+import tempfile
+from binascii import hexlify
+
+import urwid
+
+from virt_who_tui.display import TuiContainerDisplay, TextBox
+from virt_who_tui.virt_config import VirtConfig
+from virt_who_tui.page import WelcomePage, DetailPage
+from virt_who_tui.catalog import Catalog, CatalogCache
+from virt_who_tui.history import HistoryStore
+from virt_who_tui.advisor import IntervalAdvisor, ReportStats
+from virt_who_tui.hostfilter import Host
+from virt_who_tui.utils import atomic_write
+from virt_who_tui.memtrack import TRACKER
+
+SCREEN_SIZE = (100, 90)
+# How often the main loop is checked for running operations
+SETTLE_INTERVAL = 0.005
+# A scenario fails if an operation of the stand-ins takes longer than this
+SETTLE_TIMEOUT = 30
+
+# What the host is registered to, as found in rhsm.conf
+REGISTERED = {"hostname": VirtConfig.PORTAL_URL, "prefix": VirtConfig.PORTAL_PREFIX, "port": "443"}
+UNREGISTERED = {"hostname": "", "prefix": "", "port": ""}
+# Recorded instead of what is typed into a password field
+PASSWORD_KEY = "<password>"
+
+
+class ReplayError(Exception):
+    pass
+
+
+class FakeScreen(urwid.BaseScreen):
+    """
+    A screen of a fixed size which renders the canvases without drawing
+    them
+    """
+    def __init__(self, size=SCREEN_SIZE):
+        super(FakeScreen, self).__init__()
+        self.size = size
+        self.frames = 0
+        self._started = True
+
+    def get_cols_rows(self):
+        return self.size
+
+    def draw_screen(self, size, canvas):
+        # Compute the content of every row, as a terminal screen would
+        for row in canvas.content():
+            pass
+        self.frames += 1
+
+    def clear(self):
+        pass
+
+    def set_mouse_tracking(self, enable=True):
+        pass
+
+
+class _RhsmConfig(object):
+    """
+    Stand-in of the rhsm.conf of the host
+    """
+    def __init__(self, server):
+        self.server = server
+
+    def get(self, section, key):
+        return self.server.get(key, "") if section == "server" else ""
+
+
+class ReplayConfig(VirtConfig):
+    """
+    The settings of the wizard, with the files kept in a temporary directory
+    and the connections replaced by stand-ins. The passwords are "encrypted"
+    without the key of virt-who.
+    """
+    # Typed into the password fields of the recorded sessions
+    PASSWORD = "secret"
+
+    def __init__(self, directory, rhsm=REGISTERED):
+        self.CONFIG_DIR = os.path.join(directory, "virt-who.d")
+        self.LOG_FILE = os.path.join(directory, "virt-who-tui.log")
+        os.mkdir(self.CONFIG_DIR)
+        super(ReplayConfig, self).__init__()
+        self.catalogs = CatalogCache(os.path.join(directory, "cache"))
+        self.history = HistoryStore(os.path.join(directory, "history.json"), self.CONFIG_DIR)
+        self.report_stats = ReportStats(os.path.join(directory, "report-stats.json"))
+        self.advisor = IntervalAdvisor(self.report_stats, self.CONFIG_DIR, os.path.join(directory, "virt-who"))
+        self._rhsm_config = _RhsmConfig(rhsm)
+
+    def _encrypt_password(self, field, password, encrypt_password=True):
+        setattr(self, field, hexlify(password) if password and encrypt_password else None)
+
+    def get_owner(self, config, with_catalog=False):
+        return "ACME", (self.get_catalog(config)[0] if with_catalog else None), []
+
+    def get_catalog(self, config):
+        return Catalog([("ACME", "ACME Corporation")], {"ACME": ["Library", "Production"]}), []
+
+    def rank_rhsm_endpoints(self, candidates):
+        raise ReplayError("The endpoints can't be measured in a replay")
+
+    def check_sm_connection(self, config):
+        return []
+
+    MEASUREMENT = {"seconds": 0.5, "hypervisors": 3, "guests": 12, "bytes": 4096}
+
+    def check_virt_report(self, config):
+        return [], dict(self.MEASUREMENT)
+
+    def probe_hosts(self, config):
+        hosts = [Host("host-%d" % idx, "host-%d.example.com" % idx, 4, 1024) for idx in xrange(3)]
+        return [], hosts, dict(self.MEASUREMENT)
+
+    def fetch_certificates(self, endpoints):
+        return {}, {}
+
+    def enable_virt_who(self):
+        return None
+
+    def restart_and_enable_virt_who(self):
+        return None, 0.0
+
+
+class KeyRecorder(object):
+    """
+    Record the keys typed and the mouse events on each page of the wizard,
+    to be replayed as a scenario. The mouse events depend on where the
+    widgets are, so the size of the screen is recorded too. What is typed
+    into a password field is replaced by PASSWORD_KEY.
+    """
+    def __init__(self, path, rhsm=None):
+        self.path = path
+        self.rhsm = rhsm
+        self.size = None
+        # [[page, [keys]]]
+        self.steps = []
+
+    def record(self, page, keys, size=None, focus=None):
+        if self.size is None:
+            self.size = size
+        name = type(page).__name__
+        keys = [key for key in keys if key != "window resize"]
+        if not keys:
+            return
+        if not self.steps or self.steps[-1][0] != name:
+            self.steps.append([name, []])
+        recorded = self.steps[-1][1]
+        secret = isinstance(focus, TextBox) and focus.secret
+        for key in keys:
+            if secret and isinstance(key, basestring) and len(key) == 1:
+                # A single placeholder for the characters typed in a row
+                if not recorded or recorded[-1] != PASSWORD_KEY:
+                    recorded.append(PASSWORD_KEY)
+            else:
+                recorded.append(key)
+
+    def save(self):
+        steps = [["screen"] + list(self.size or SCREEN_SIZE)]
+        steps += [["keys", name, keys] for name, keys in self.steps]
+        atomic_write(self.path, lambda fh: json.dump({"rhsm": self.rhsm, "steps": steps}, fh, indent=2))
+
+
+class Replay(object):
+    """
+    Replay a script against a new wizard. run() returns the time spent on
+    each page, as a list of (transition, seconds).
+    """
+    def __init__(self, script, rhsm=REGISTERED):
+        self.script = script
+        self.rhsm = rhsm
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp(prefix="virt-who-tui-replay-")
+        self.virt_config = ReplayConfig(self.directory, self.rhsm)
+        self.virt_config.worker.start()
+        self.screen = FakeScreen()
+        self.container = TuiContainerDisplay(self.virt_config.logger, 80, 80)
+        self.container.loop = self.loop = urwid.MainLoop(self.container.main, self.container.palette, screen=self.screen)
+        # What MainLoop.run() does, without taking over a terminal
+        self.loop.event_loop.enter_idle(self.loop.entering_idle)
+
+    def teardown(self):
+        page = self.container.page
+        if page is not None:
+            page.cancel_task()
+        self.virt_config.worker.shutdown()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def settle(self):
+        """
+        Run the main loop until the operations of the current page have
+        completed
+        """
+        deadline = time.time() + SETTLE_TIMEOUT
+
+        def check(loop, data):
+            page = self.container.page
+            if page is None or page.task is None:
+                raise urwid.ExitMainLoop()
+            if time.time() > deadline:
+                raise ReplayError("%s is still busy after %d s" % (type(page).__name__, SETTLE_TIMEOUT))
+            loop.set_alarm_in(SETTLE_INTERVAL, check)
+
+        self.loop.set_alarm_in(0, check)
+        self.loop.event_loop.run()
+        self.loop.draw_screen()
+
+        widget = self.container.body.original_widget
+        if isinstance(widget, urwid.Overlay):
+            # Show what the dialog says, as it is drawn
+            rows = widget.top_w.render((60, 20), focus=False).text
+            raise ReplayError("%s popped up a dialog: %s" % (type(self.container.page).__name__,
+                              " ".join(" ".join(row.split()) for row in rows).strip()))
+
+    def _field(self, name):
+        form = self.container.page.form
+        if not hasattr(form, name):
+            raise ReplayError("%s has no field '%s'" % (type(self.container.page).__name__, name))
+        return getattr(form, name)
+
+    def _input(self, widget, key, size=(50,)):
+        widget.keypress(size, key)
+        self.loop.draw_screen()
+        self.settle()
+
+    def play(self, action):
+        kind = action[0]
+        if kind == "type":
+            textbox = self._field(action[1])
+            for char in action[2]:
+                self._input(textbox, char)
+        elif kind == "radio":
+            for radio in self._field(action[1]):
+                if radio.label == action[2]:
+                    self._input(radio, " ")
+                    break
+            else:
+                raise ReplayError("No '%s' choice in '%s'" % (action[2], action[1]))
+        elif kind == "check":
+            checkbox = self._field(action[1])
+            if checkbox.state != action[2]:
+                self._input(checkbox, " ")
+        elif kind == "press":
+            try:
+                button = self.container.page.form.button(action[1])
+            except KeyError as e:
+                raise ReplayError("%s: %s" % (type(self.container.page).__name__, e.args[0]))
+            self._input(button, "enter", (len(action[1]) + 4,))
+        elif kind == "keys":
+            if type(self.container.page).__name__ != action[1]:
+                raise ReplayError("Expected %s, got %s" % (action[1], type(self.container.page).__name__))
+            for key in action[2]:
+                if key == PASSWORD_KEY:
+                    keys = list(self.virt_config.PASSWORD)
+                else:
+                    # The mouse events are lists once loaded from JSON
+                    keys = [tuple(key) if isinstance(key, list) else key]
+                for key in keys:
+                    self.loop.process_input([key])
+                    self.loop.draw_screen()
+                    self.settle()
+        elif kind == "screen":
+            self.screen.size = tuple(action[1:])
+            self.loop.screen_size = None
+            self.loop.draw_screen()
+        else:
+            raise ReplayError("Unknown action '%s'" % kind)
+
+    def finished(self):
+        page = self.container.page
+        if not isinstance(page, DetailPage):
+            return False
+        try:
+            page.form.button("Finish")
+            return True
+        except KeyError:
+            return False
+
+    def run(self):
+        self.setup()
+        try:
+            transitions = []
+            started = time.time()
+            WelcomePage(self.container, input_data=self.virt_config).render()
+            self.settle()
+            page = self.container.page
+            transitions.append(("start -> WelcomePage", time.time() - started))
+            started = time.time()
+            for action in self.script:
+                self.play(action)
+                if self.container.page is not page:
+                    now = time.time()
+                    transitions.append(("%s -> %s" % (type(page).__name__, type(self.container.page).__name__),
+                                        now - started))
+                    page = self.container.page
+                    started = now
+            if not self.finished():
+                raise ReplayError("The script ended on %s before the configuration was ready" % type(page).__name__)
+            return transitions, self.screen.frames
+        finally:
+            self.teardown()
+
+
+# Inputs of the subscription manager pages
+SM_MODES = {
+    "rhsm-registered": (REGISTERED, [
+        ("radio", "smType", "Red Hat Customer Portal"),
+        ("press", "Next"),
+    ]),
+    "rhsm-custom": (UNREGISTERED, [
+        ("radio", "smType", "Red Hat Satellite 6"),
+        ("press", "Next"),
+        ("type", "rhsm_hostname", "satellite.example.com"),
+        ("type", "rhsm_username", "admin"),
+        ("type", "rhsm_password", "secret"),
+        ("press", "Next"),
+    ]),
+    "sat5": (UNREGISTERED, [
+        ("radio", "smType", "Red Hat Satellite 5"),
+        ("press", "Next"),
+        ("type", "sat_server", "https://satellite5.example.com/XMLRPC"),
+        ("type", "sat_username", "admin"),
+        ("type", "sat_password", "secret"),
+        ("press", "Next"),
+    ]),
+}
+
+SERVERS = {
+    "ESX": "https://esx.example.com",
+    "Hyper-V": "hyperv.example.com",
+    "RHEV-M": "https://rhevm.example.com:443/ovirt-engine",
+    "XEN": "https://xen.example.com",
+}
+
+
+def scenario(sm_mode, virt_label):
+    """
+    Return the name, the rhsm.conf and the script of a scenario
+    """
+    rhsm, sm_steps = SM_MODES[sm_mode]
+    vtype = VirtConfig.VIRT_MAP[virt_label]
+    name = "%s/%s" % (sm_mode, vtype)
+    script = [("type", "config_name", "replay_%s" % vtype), ("press", "Next")] + sm_steps
+    script += [("radio", "virtual", virt_label), ("press", "Next")]
+    if virt_label in SERVERS:
+        if sm_mode == "rhsm-custom":
+            # The organization is only found automatically for the registered host
+            script.append(("type", "owner", "ACME"))
+        if sm_mode != "sat5":
+            script.append(("type", "env", "Library"))
+        script += [
+            ("type", "server", SERVERS[virt_label]),
+            ("type", "username", "administrator"),
+            ("type", "password", "secret"),
+        ]
+    script.append(("press", "Submit" if vtype not in VirtConfig.FILTERABLE_VIRT else "Next"))
+    if vtype in VirtConfig.FILTERABLE_VIRT:
+        script += [("type", "exclude_hosts", "host-0*"), ("press", "Submit")]
+    return name, rhsm, script
+
+
+def scenarios():
+    return [scenario(sm_mode, virt_label) for sm_mode in sorted(SM_MODES) for virt_label in sorted(VirtConfig.VIRT_MAP)]
+
+
+def load_script(path):
+    """
+    Return the scenario of a script recorded with 'virt-who-tui --record'
+    """
+    with open(path) as fh:
+        data = json.load(fh)
+    return "script/%s" % os.path.basename(path), data.get("rhsm") or REGISTERED, [tuple(step) for step in data["steps"]]
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def measure(rhsm, script, repeat=1):
+    """
+    Replay a scenario 'repeat' times. Return the median of the total and of
+    each transition.
+    """
+    runs = [Replay(script, rhsm).run() for _ in xrange(repeat)]
+    transitions = []
+    for idx, (label, seconds) in enumerate(runs[0][0]):
+        transitions.append([label, _median([run[idx][1] for run, frames in runs])])
+    return {
+        "total": _median([sum(seconds for label, seconds in run) for run, frames in runs]),
+        "transitions": transitions,
+        "frames": runs[0][1],
+    }
+
+
+def regressions(results, baseline, tolerance, slack):
+    """
+    Return the measurements which are slower than the baseline, by more
+    than 'tolerance' (a ratio) plus 'slack' seconds
+    """
+    found = []
+
+    def compare(what, seconds, reference):
+        if reference is not None and seconds > reference * (1 + tolerance) + slack:
+            found.append("%s: %.0f ms, baseline %.0f ms" % (what, seconds * 1000, reference * 1000))
+
+    for name, result in sorted(results.iteritems()):
+        if name not in baseline:
+            continue
+        compare(name, result["total"], baseline[name]["total"])
+        reference = dict((label, seconds) for label, seconds in baseline[name]["transitions"])
+        for label, seconds in result["transitions"]:
+            compare("%s: %s" % (name, label), seconds, reference.get(label))
+    return found
+
+
+def format_results(results):
+    lines = []
+    for name, result in sorted(results.iteritems()):
+        lines.append("%-32s %8.0f ms %5d frames" % (name, result["total"] * 1000, result["frames"]))
+        for label, seconds in result["transitions"]:
+            lines.append("  %-30s %8.0f ms" % (label, seconds * 1000))
+    return lines
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="virt-who-tui replay",
+        description="Replay the wizard with stand-in servers and report how long each page takes.")
+    parser.add_argument("patterns", nargs="*", metavar="SCENARIO",
+        help="scenarios to replay, wildcards allowed (default: all), e.g. 'sat5/*' or '*/esx'")
+    parser.add_argument("--script", action="append", default=[], help="also replay a script recorded with --record")
+    parser.add_argument("--list", action="store_true", help="list the scenarios")
+    parser.add_argument("--repeat", type=int, default=3, help="replay each scenario N times and keep the median (default: 3)")
+    parser.add_argument("--baseline", metavar="FILE", help="fail if a scenario is slower than in FILE")
+    parser.add_argument("--update", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+        help="how much slower than the baseline is accepted, as a ratio (default: 0.5)")
+    parser.add_argument("--slack", type=float, default=0.05,
+        help="seconds accepted in addition to the tolerance, for the timer noise (default: 0.05)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--track-memory", action="store_true",
+        help="measure the memory used by each page and backend call, and print a summary")
+    args = parser.parse_args(argv)
+    if args.update and not args.baseline:
+        parser.error("--update requires --baseline")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    selected = [s for s in scenarios() if not args.patterns or any(fnmatch.fnmatch(s[0], p) for p in args.patterns)]
+    try:
+        selected += [load_script(path) for path in args.script]
+    except (IOError, ValueError, KeyError) as e:
+        print >>sys.stderr, "Failed to load the script: %s" % e
+        return 1
+    if args.list:
+        print "\n".join(name for name, rhsm, script in selected)
+        return 0
+
+    if args.track_memory:
+        TRACKER.enable()
+
+    results = {}
+    failed = []
+    for name, rhsm, script in selected:
+        try:
+            results[name] = measure(rhsm, script, args.repeat)
+        except ReplayError as e:
+            failed.append("%s: %s" % (name, e))
+
+    if args.json:
+        print json.dumps(results, indent=2, sort_keys=True)
+    else:
+        print "\n".join(format_results(results))
+    for failure in failed:
+        print >>sys.stderr, "FAILED %s" % failure
+    if args.track_memory:
+        print >>sys.stderr, "\n".join(TRACKER.summary())
+
+    if args.update:
+        atomic_write(args.baseline, lambda fh: json.dump(results, fh, indent=2, sort_keys=True))
+        print >>sys.stderr, "Saved the baseline of %d scenario(s) in '%s'" % (len(results), args.baseline)
+    elif args.baseline:
+        try:
+            with open(args.baseline) as fh:
+                baseline = json.load(fh)
+        except (IOError, ValueError) as e:
+            print >>sys.stderr, "Failed to read the baseline '%s': %s" % (args.baseline, e)
+            return 1
+        slower = regressions(results, baseline, args.tolerance, args.slack)
+        for line in slower:
+            print >>sys.stderr, "SLOWER %s" % line
+        if slower:
+            return 1
+
+    return 1 if failed else 0
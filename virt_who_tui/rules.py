@@ -0,0 +1,211 @@
+"""
+Declarative validation rules for virt-who configurations.
+
+The rules only look at plain configuration values, so they can be shared
+by the wizard (which stops at the first error) and by the offline linter
+(which reports every error of a configuration section).
+"""
+from collections import namedtuple
+
+SUPPORTED_VIRT = ('esx', 'rhevm', 'hyperv', 'xen', 'libvirt', 'vdsm')
+REMOTE_VIRT = ('esx', 'rhevm', 'hyperv', 'xen')
+LOCAL_VIRT = ('libvirt', 'vdsm', 'fake')
+HYPERVISOR_IDS = ('uuid', 'hostname', 'hwuuid')
+
+RuleError = namedtuple('RuleError', ['group', 'field', 'message'])
+
+
+def field_label(field):
+    """
+    Humanize a field name, e.g. 'rhsm_hostname' -> 'Hostname'
+    """
+    return field.replace("rhsm_", "").replace("sat_", "").title()
+
+
+class Rule(object):
+    """
+    A single check of a configuration value.
+
+    'check' receives the values mapping and returns True when the values
+    are valid. 'when' can be used to only apply the rule to some
+    configurations. The message is formatted with the values mapping.
+    """
+    def __init__(self, group, field, check, message, when=None, depends=()):
+        self.group = group
+        self.field = field
+        self.check = check
+        self.message = message
+        self.when = when
+        # All the fields the result of this rule depends on
+        self.depends = frozenset((field,) + tuple(depends))
+
+    def error(self, values):
+        if self.when is not None and not self.when(values):
+            return None
+        if self.check(values):
+            return None
+        return RuleError(self.group, self.field, self.message % _Values(values))
+
+
+class _Values(object):
+    """
+    Mapping used to format the messages. Missing values are empty strings.
+    """
+    def __init__(self, values):
+        self.values = values
+
+    def __getitem__(self, key):
+        value = self.values.get(key)
+        return "" if value is None else value
+
+
+def required(group, field, message=None, alternatives=(), when=None, depends=()):
+    fields = (field,) + tuple(alternatives)
+    return Rule(group, field, lambda v: any(v.get(f) for f in fields),
+                message or "%s is required." % field_label(field),
+                when=when, depends=tuple(alternatives) + tuple(depends))
+
+
+def integer(group, field, message=None, when=None):
+    return Rule(group, field, lambda v: not v.get(field) or str(v.get(field)).isdigit(),
+                message or "%s must be an integer." % field_label(field), when=when)
+
+
+def one_of(group, field, choices, message, when=None):
+    return Rule(group, field, lambda v: not v.get(field) or v.get(field) in choices,
+                message, when=when)
+
+
+class RuleSet(object):
+    """
+    A compiled set of rules. Rules are indexed by group and by field once,
+    so checking a configuration only evaluates the relevant rules.
+    """
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self._by_group = {}
+        self._by_field = {}
+        for rule in self.rules:
+            self._by_group.setdefault(rule.group, []).append(rule)
+            for field in rule.depends:
+                self._by_field.setdefault(field, []).append(rule)
+
+    def groups(self):
+        groups = []
+        for rule in self.rules:
+            if rule.group not in groups:
+                groups.append(rule.group)
+        return groups
+
+    def select(self, groups=None):
+        if groups is None:
+            return self.rules
+        rules = []
+        for group in groups:
+            rules.extend(self._by_group.get(group, ()))
+        return rules
+
+    def check(self, values, groups=None):
+        """
+        Return all the errors found in the values
+        """
+        errors = []
+        for rule in self.select(groups):
+            error = rule.error(values)
+            if error is not None:
+                errors.append(error)
+        return errors
+
+    def affected(self, fields):
+        """
+        Return the fields whose rules depend on one of the given fields
+        """
+        affected = set()
+        for field in fields:
+            for rule in self._by_field.get(field, ()):
+                affected.add(rule.field)
+        return affected
+
+    def field_error(self, values, field):
+        """
+        Return the first error of a single field or None
+        """
+        for rule in self._by_field.get(field, ()):
+            if rule.field != field:
+                continue
+            error = rule.error(values)
+            if error is not None:
+                return error
+        return None
+
+    def first_error(self, values, groups=None):
+        """
+        Return the first error found in the values or None
+        """
+        for rule in self.select(groups):
+            error = rule.error(values)
+            if error is not None:
+                return error
+        return None
+
+
+def safe_name(name):
+    """
+    Return True if a configuration name can't make its file name point
+    outside the configuration directory
+    """
+    return "/" not in name and ".." not in name and "\0" not in name
+
+
+def _is_rhsm(values):
+    return values.get("smType") == "rhsm"
+
+
+def _is_sat(values):
+    return values.get("smType") == "sat"
+
+
+def _needs_owner(values):
+    # Environment and owner are not used in non-remote libvirt connection
+    vtype = values.get("type")
+    return _is_rhsm(values) and (
+        vtype in REMOTE_VIRT or (vtype == 'libvirt' and bool(values.get("server"))))
+
+
+def _libvirt_ssh_password(values):
+    server = values.get("server")
+    if values.get("type") != 'libvirt' or not server:
+        return True
+    return not (('ssh://' in server or '://' not in server) and values.get("password"))
+
+
+RULES = RuleSet([
+    required("name", "config_name", "Please enter a name for your configuration"),
+    Rule("name", "config_name", lambda v: not v.get("config_name") or v["config_name"].lower() != "default",
+         "'default' is not a valid configuration name. Please enter other name."),
+    Rule("name", "config_name", lambda v: not v.get("config_name") or safe_name(v["config_name"]),
+         "A configuration name can't contain '/', '..' or NUL characters."),
+
+    required("virt_type", "type", "Please specify a hypervisor backend."),
+    one_of("virt_type", "type", SUPPORTED_VIRT, "'%(type)s' is not a supported hypervisor backend."),
+
+    required("sm_type", "smType", "Please specify where the host/guest associations should be reported."),
+
+    required("rhsm", "rhsm_hostname", when=_is_rhsm, depends=("smType",)),
+    required("rhsm", "rhsm_username", when=_is_rhsm, depends=("smType",)),
+    required("rhsm", "rhsm_password", alternatives=("rhsm_encrypted_password",), when=_is_rhsm, depends=("smType",)),
+    integer("rhsm", "rhsm_port"),
+    integer("rhsm", "rhsm_proxy_port"),
+
+    required("sat", "sat_server", when=_is_sat, depends=("smType",)),
+    required("sat", "sat_username", when=_is_sat, depends=("smType",)),
+    required("sat", "sat_password", alternatives=("sat_encrypted_password",), when=_is_sat, depends=("smType",)),
+
+    required("virt", "server", when=lambda v: v.get("type") not in LOCAL_VIRT, depends=("type",)),
+    required("virt", "env", "Environment is required.", when=_needs_owner, depends=("smType", "type", "server")),
+    required("virt", "owner", "Organization is required.", when=_needs_owner, depends=("smType", "type", "server")),
+    Rule("virt", "password", _libvirt_ssh_password,
+         "Password authentication doesn't work with ssh transport on libvirt backend, please copy your public ssh key to the remote machine.",
+         depends=("type", "server")),
+    one_of("virt", "hypervisor_id", HYPERVISOR_IDS, "'%(hypervisor_id)s' is not a valid hypervisor id."),
+])
@@ -0,0 +1,158 @@
+"""
+Control of the virt-who service.
+
+The init system is detected once and the commands are run with their
+output streamed through a pipe, so that a hung command can be killed when
+its deadline is reached.
+"""
+import os
+import time
+import glob
+import errno
+import select
+import subprocess
+
+
+class CommandTimeout(Exception):
+    def __init__(self, cmd, timeout, output=""):
+        super(CommandTimeout, self).__init__("'%s' timed out after %d s" % (" ".join(cmd), timeout))
+        self.output = output
+
+
+def run(cmd, timeout=None):
+    """
+    Run a command and return its exit code and output (stdout and stderr).
+    Raise CommandTimeout if it doesn't finish within 'timeout' seconds.
+    """
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, close_fds=True)
+    deadline = time.time() + timeout if timeout else None
+    fd = p.stdout.fileno()
+    chunks = []
+
+    def remaining():
+        if deadline is None:
+            return None
+        left = deadline - time.time()
+        if left <= 0:
+            p.kill()
+            p.wait()
+            p.stdout.close()
+            raise CommandTimeout(cmd, timeout, "".join(chunks))
+        return left
+
+    try:
+        while True:
+            try:
+                ready, _, _ = select.select([fd], [], [], remaining())
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                continue
+            data = os.read(fd, 4096)
+            if not data:
+                break
+            chunks.append(data)
+
+        while p.poll() is None:
+            time.sleep(min(0.05, remaining() or 0.05))
+    finally:
+        if not p.stdout.closed:
+            p.stdout.close()
+
+    return p.returncode, "".join(chunks)
+
+
+class VirtWhoService(object):
+    """
+    Restart, enable and check the virt-who service with systemd or SysV init.
+    """
+    NAME = "virt-who"
+    SYSTEMCTL = "/bin/systemctl"
+    SERVICE = "/usr/sbin/service"
+    CHKCONFIG = "/usr/sbin/chkconfig"
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self._systemd = None
+
+    @property
+    def systemd(self):
+        # Same check as sd_booted(), done once
+        if self._systemd is None:
+            self._systemd = os.path.isdir("/run/systemd/system")
+        return self._systemd
+
+    def _run(self, cmd):
+        """
+        Run a command and return its output as an error if it fails.
+        """
+        try:
+            returncode, output = run(cmd, self.timeout)
+        except CommandTimeout as e:
+            return str(e)
+        except OSError as e:
+            return "Failed to run '%s': %s" % (" ".join(cmd), e.strerror)
+        if returncode != 0:
+            return output or "'%s' exited with status %d" % (" ".join(cmd), returncode)
+        return None
+
+    def is_active(self):
+        if self.systemd:
+            cmd = [self.SYSTEMCTL, "is-active", "--quiet", self.NAME]
+        else:
+            cmd = [self.SERVICE, self.NAME, "status"]
+        return self._run(cmd) is None
+
+    def is_enabled(self):
+        # Look at the links instead of running a command
+        if self.systemd:
+            return bool(glob.glob("/etc/systemd/system/*.wants/%s.service" % self.NAME))
+        return bool(glob.glob("/etc/rc.d/rc[345].d/S*%s" % self.NAME))
+
+    def restart(self):
+        if self.systemd:
+            return self._run([self.SYSTEMCTL, "restart", self.NAME])
+        return self._run([self.SERVICE, self.NAME, "restart"])
+
+    def enable(self):
+        if self.systemd:
+            return self._run([self.SYSTEMCTL, "enable", self.NAME])
+        return self._run([self.CHKCONFIG, self.NAME, "on"])
+
+    def wait_active(self, started):
+        """
+        Wait for the service to become active. Return the number of seconds
+        since 'started' or None if it didn't become active in time.
+        """
+        deadline = started + self.timeout
+        while True:
+            if self.is_active():
+                return time.time() - started
+            if time.time() >= deadline:
+                return None
+            time.sleep(0.2)
+
+    def restart_and_enable(self):
+        """
+        Restart and enable the service. Return an error or None, and the
+        number of seconds the service took to become active.
+        """
+        started = time.time()
+        if self.systemd and not self.is_enabled() and not self.is_active():
+            # Starting a stopped service is the same as restarting it, so
+            # systemd can enable and start it in one go.
+            error = self._run([self.SYSTEMCTL, "enable", "--now", self.NAME])
+        else:
+            error = self.restart()
+            if not error and not self.is_enabled():
+                error = self.enable()
+
+        if error:
+            return error, None
+
+        elapsed = self.wait_active(started)
+        if elapsed is None:
+            return "%s did not become active after %d s" % (self.NAME, self.timeout), None
+        return None, elapsed
@@ -21,6 +21,12 @@ class SmManager(object):
     def logout(self):
         pass
 
+    def ping(self):
+        """
+        Make a lightweight authenticated request with the connection
+        """
+        raise NotImplementedError
+
     @contextmanager
     def sm_error_handler(self, errors):
         """
@@ -50,6 +56,12 @@ class RhsmManager(SmManager):
         super(RhsmManager, self).connect()
         self.connection = self.sm_manager.connection
 
+    def ping(self):
+        if self.config.rhsm_username:
+            self.connection.getOwnerList(self.config.rhsm_username)
+        else:
+            self.connection.getOwner(self.sm_manager.uuid())
+
 class Sat5Manager(SmManager):
     def connect(self):
         """
@@ -64,6 +76,9 @@ class Sat5Manager(SmManager):
         password = self.config.sat_password
         self.session = self.connection.auth.login(username, password)
 
+    def ping(self):
+        self.connection.user.getDetails(self.session, self.config.sat_username)
+
     def logout(self):
         """
         Logout existing session
@@ -0,0 +1,40 @@
+"""
+Results of the successful steps of the wizard.
+
+A step, such as testing the connection to the subscription manager, is
+only run again when one of the settings it depends on has changed, or
+when it has failed.
+"""
+import json
+import time
+import hashlib
+from collections import namedtuple
+
+StepResult = namedtuple('StepResult', ['value', 'elapsed', 'finished'])
+
+
+class StepCache(object):
+    """
+    The last successful result of each step, with the hash of the settings
+    it depends on. The settings themselves, which include passwords, are
+    not kept.
+    """
+    def __init__(self, fields):
+        # {step: [the settings it depends on]}
+        self.fields = fields
+        self._results = {}
+
+    def key(self, step, values):
+        return hashlib.sha256(json.dumps([values.get(field) for field in self.fields[step]])).hexdigest()
+
+    def get(self, step, values):
+        entry = self._results.get(step)
+        if entry and entry[0] == self.key(step, values):
+            return entry[1]
+        return None
+
+    def put(self, step, values, value=None, elapsed=0.0):
+        self._results[step] = (self.key(step, values), StepResult(value, elapsed, time.time()))
+
+    def forget(self, step):
+        self._results.pop(step, None)
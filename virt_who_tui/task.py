@@ -0,0 +1,180 @@
+"""
+Run slow operations, such as connecting to a server, in a child process.
+
+The user interface stays responsive while the operation is running, and
+the operation can really be stopped when it is cancelled or when its
+deadline is reached, by killing the child process and its sub processes.
+"""
+import os
+import time
+import errno
+import signal
+import traceback
+from multiprocessing import Process, Pipe
+
+
+class TaskResult(object):
+    OK = "ok"
+    ERROR = "error"
+    TIMEOUT = "timeout"
+    CANCELLED = "cancelled"
+
+    def __init__(self, status, value=None, elapsed=0.0, timeout=None):
+        self.status = status
+        self.value = value
+        self.elapsed = elapsed
+        self.timeout = timeout
+
+    @property
+    def ok(self):
+        return self.status == self.OK
+
+    def state(self):
+        """
+        Short description of a failed task, e.g. to be shown next to a step
+        """
+        if self.status == self.TIMEOUT:
+            return "TIMED OUT"
+        elif self.status == self.CANCELLED:
+            return "CANCELLED"
+        return "FAILED"
+
+    def message(self):
+        if self.status == self.TIMEOUT:
+            return "Timed out after %d s" % self.timeout
+        elif self.status == self.CANCELLED:
+            return "Cancelled"
+        return self.value
+
+
+def _child(conn, func, args):
+    # Run in a new process group, so that the sub processes started by
+    # the operation are killed with it.
+    os.setpgid(0, 0)
+    try:
+        result = (TaskResult.OK, func(*args))
+    except Exception as e:
+        result = (TaskResult.ERROR, "%r\n\n%s" % (e, traceback.format_exc()))
+    conn.send(result)
+    conn.close()
+
+
+class Task(object):
+    """
+    Run func(*args) in a child process and call on_done with a TaskResult
+    from the urwid main loop once it has finished, timed out or has been
+    cancelled. The return value of func must be picklable.
+    """
+    def __init__(self, loop, func, args=(), timeout=None, on_done=None):
+        self.loop = loop
+        self.func = func
+        self.args = args
+        self.timeout = timeout
+        self.on_done = on_done
+        self.process = None
+        self.conn = None
+        self.started = None
+        self.done = False
+        self._alarm = None
+        self._watch = None
+
+    def start(self):
+        parent, child = Pipe(duplex=False)
+        self.process = Process(target=_child, args=(child, self.func, self.args))
+        self.process.daemon = True
+        self.started = time.time()
+        self.process.start()
+        try:
+            os.setpgid(self.process.pid, self.process.pid)
+        except OSError:
+            # The child has already done it
+            pass
+        child.close()
+        self.conn = parent
+        self._watch = self.loop.watch_file(self.conn.fileno(), self._on_ready)
+        if self.timeout:
+            self._alarm = self.loop.set_alarm_in(self.timeout, self._on_timeout)
+        return self
+
+    def _on_ready(self):
+        try:
+            status, value = self.conn.recv()
+        except (EOFError, IOError):
+            self.process.join()
+            status, value = TaskResult.ERROR, "The process exited unexpectedly (exit code %s)" % self.process.exitcode
+        self._finish(TaskResult(status, value))
+
+    def _on_timeout(self, loop, user_data):
+        self._alarm = None
+        self._finish(TaskResult(TaskResult.TIMEOUT, timeout=self.timeout))
+
+    def cancel(self):
+        self._finish(TaskResult(TaskResult.CANCELLED))
+
+    def kill(self):
+        if self.process is None or not self.process.is_alive():
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+            # The process group may not exist yet
+            self.process.terminate()
+        self.process.join()
+
+    def _finish(self, result):
+        if self.done:
+            return
+        self.done = True
+        if self._watch is not None:
+            self.loop.remove_watch_file(self._watch)
+            self._watch = None
+        if self._alarm is not None:
+            self.loop.remove_alarm(self._alarm)
+            self._alarm = None
+        self._release(result)
+        result.elapsed = time.time() - self.started
+        if self.on_done:
+            self.on_done(result)
+
+    def _release(self, result):
+        if result.ok:
+            # Give the process a chance to exit by itself
+            self.process.join(1)
+        self.kill()
+        self.conn.close()
+
+
+def run(func, args=(), timeout=None):
+    """
+    Run func(*args) in a child process and wait for its TaskResult. This
+    is the blocking counterpart of Task for callers without a main loop.
+    """
+    parent, child = Pipe(duplex=False)
+    process = Process(target=_child, args=(child, func, args))
+    process.daemon = True
+    started = time.time()
+    process.start()
+    child.close()
+    try:
+        if parent.poll(timeout):
+            try:
+                status, value = parent.recv()
+            except (EOFError, IOError):
+                process.join()
+                status, value = TaskResult.ERROR, "The process exited unexpectedly (exit code %s)" % process.exitcode
+            result = TaskResult(status, value)
+            process.join(1)
+        else:
+            result = TaskResult(TaskResult.TIMEOUT, timeout=timeout)
+    finally:
+        parent.close()
+        if process.is_alive():
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                process.terminate()
+            process.join()
+    result.elapsed = time.time() - started
+    return result
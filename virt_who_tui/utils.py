@@ -0,0 +1,27 @@
+import os
+import tempfile
+
+
+def atomic_write(filename, write, mode=None):
+    """
+    Write a file atomically. 'write' is called with a file handle of a
+    temporary file in the same directory, which then replaces the file.
+    The permissions of an existing file are kept, new files are only
+    readable by the owner unless 'mode' is given.
+    """
+    dirname = os.path.dirname(filename) or "."
+    fd, tmp = tempfile.mkstemp(prefix=".%s." % os.path.basename(filename), dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            write(fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        if os.path.exists(filename):
+            mode = os.stat(filename).st_mode & 07777
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.rename(tmp, filename)
+    except BaseException:
+        # Also on KeyboardInterrupt, so that no temporary file is left behind
+        os.unlink(tmp)
+        raise
@@ -1,24 +1,45 @@
+import os
 import re
+import copy
 import sys
+import difflib
 import tempfile
-import subprocess
 import socket
-import platform
 import logging
+import time
 import StringIO
+from Queue import Empty
 import rhsm.config as rhsm_config
-from binascii import hexlify
+from binascii import hexlify, unhexlify
 from virtwho.virt import Virt
 from virtwho.virt.vdsm import Vdsm
 from virtwho.virt.virt import VirtError
 from virtwho.config import Config, InvalidOption
-from virtwho.password import Password
-from ConfigParser import SafeConfigParser
+from virtwho.password import Password, UnwritableKeyFile, InvalidKeyFile
+from ConfigParser import SafeConfigParser, Error as ConfigParserError
+from collections import namedtuple
+from urlparse import urlparse
 from multiprocessing import Event, Queue
 from virt_who_tui.sm_manager import RhsmManager, Sat5Manager
+from virt_who_tui.rules import RULES, SUPPORTED_VIRT, HYPERVISOR_IDS, safe_name
+from virt_who_tui.utils import atomic_write
+from virt_who_tui.service import VirtWhoService
+from virt_who_tui.catalog import Catalog, CatalogCache
+from virt_who_tui.history import HistoryStore
+from virt_who_tui.advisor import IntervalAdvisor, ReportStats, measure_report
+from virt_who_tui.hostfilter import report_hosts
+from virt_who_tui import certs
+from virt_who_tui.worker import CheckWorker
+from virt_who_tui.steps import StepCache
+from virt_who_tui.endpoints import EndpointProber, ProbeError, parse_candidates
+from virt_who_tui.memtrack import tracked
+from virt_who_tui.fields import FieldModel
+
+# A validated configuration waiting to be written
+PendingConfig = namedtuple('PendingConfig', ['name', 'filename', 'parser'])
 
 class VirtConfig(object):
-    SUPPORTED_VIRT = ('esx', 'rhevm', 'hyperv', 'xen', 'libvirt', 'vdsm')
+    SUPPORTED_VIRT = SUPPORTED_VIRT
 
     VIRT_MAP = {
         "ESX": "esx",
@@ -43,9 +64,13 @@ class VirtConfig(object):
         "Red Hat Satellite 5",
     ]
 
-    HYPERVISOR_IDS = ["uuid", "hostname", "hwuuid"]
+    HYPERVISOR_IDS = list(HYPERVISOR_IDS)
 
-    VIRT_FIELDS  = ["type", "server", "username", "password", "env", "owner", "encrypted_password", "hypervisor_id"]
+    VIRT_FIELDS  = ["type", "server", "username", "password", "env", "owner", "encrypted_password", "hypervisor_id",
+                    "filter_hosts", "exclude_hosts"]
+
+    # Backends reporting several hosts, which can be filtered
+    FILTERABLE_VIRT = ["esx", "rhevm", "hyperv", "xen"]
     SAT_FIELDS   = ["sat_server", "sat_username", "sat_password", "sat_encrypted_password"]
     RHSM_FIELDS  = [
         "rhsm_hostname",
@@ -61,20 +86,82 @@ class VirtConfig(object):
         "rhsm_encrypted_proxy_password",
     ]
 
+    ENCRYPTED_FIELDS = ["encrypted_password", "sat_encrypted_password", "rhsm_encrypted_password", "rhsm_encrypted_proxy_password"]
+    FLAG_FIELDS = ["encrypt_pass", "sat_encrypt_pass", "rhsm_encrypt_pass"]
+
+    # The settings written in the configuration file, and the ones tracked
+    # by the field model
+    CONFIG_FIELDS = ["config_name"] + VIRT_FIELDS + SAT_FIELDS + RHSM_FIELDS
+    MODEL_FIELDS = CONFIG_FIELDS + FLAG_FIELDS + ["smType", "smType_label"]
+
     PORTAL_URL = "subscription.rhsm.redhat.com"
     PORTAL_PREFIX = "/subscription"
     SAT6_PREFIX = "/rhsm"
     SAM_PREFIX = "/sam/api"
+    # Default deadlines of the slow operations in seconds
+    TIMEOUTS = {
+        "owner": 30,
+        "catalog": 60,
+        "sm": 30,
+        "virt": 60,
+        "service": 60,
+        "certs": 20,
+        "discover": 300,
+        "stats": 300,
+        "endpoints": 90,
+    }
+
+    # The settings each step of the last page depends on
+    STEP_FIELDS = {
+        "encrypt": ["password", "sat_password", "rhsm_password", "encrypt_pass", "sat_encrypt_pass", "rhsm_encrypt_pass"],
+        "sm": ["smType", "sat_server", "sat_username", "sat_password", "rhsm_hostname", "rhsm_prefix", "rhsm_port",
+               "rhsm_username", "rhsm_password", "rhsm_proxy_hostname", "rhsm_proxy_port", "rhsm_proxy_user",
+               "rhsm_proxy_password"],
+        "virt": ["type", "server", "username", "password", "hypervisor_id", "filter_hosts", "exclude_hosts"],
+    }
+
+    # Default TLS ports of the hypervisor backends served over HTTPS
+    VIRT_TLS_PORTS = {
+        "esx": 443,
+        "rhevm": 8443,
+        "xen": 443,
+    }
+
+    # Seconds the resolution of a host name is kept
+    RESOLVE_TTL = 60
+
+    # The certificate naming the local vdsm host, in its default trust store
+    VDSM_CERT = "%s/certs/vdsmcert.pem"
+    LOCAL_CERTIFICATES = [VDSM_CERT % "/etc/pki/vdsm"]
+
     CONFIG_DIR = "/etc/virt-who.d"
     LOG_FILE = "/var/log/virt-who-tui.log"
 
     def __init__(self):
+        self._model = FieldModel(self.MODEL_FIELDS)
+        # {name: (version of the model, value)} built from the settings
+        self._derived = {}
         self.config_name = None
         self.smType = None
         self.smType_label = None
         self.encrypt_pass = True
         self.sat_encrypt_pass = True
         self.rhsm_encrypt_pass = True
+        self.pending = []
+        self.timeouts = dict(self.TIMEOUTS)
+        self.service = VirtWhoService(self.timeouts["service"])
+        self.catalogs = CatalogCache()
+        self.history = HistoryStore(config_dir=self.CONFIG_DIR)
+        self.report_stats = ReportStats()
+        self.advisor = IntervalAdvisor(self.report_stats, config_dir=self.CONFIG_DIR)
+        self.certificates = certs.ServerCertificates()
+        self.worker = CheckWorker(self)
+        self.steps = StepCache(self.STEP_FIELDS)
+        # {host: (when, error)}
+        self._resolved = {}
+        self.interval_changed = False
+        # The configuration files written since virt-who was last restarted
+        self.written = []
         self._rhsm_config = rhsm_config.initConfig(rhsm_config.DEFAULT_CONFIG_PATH)
 
         self.all_fields = self.VIRT_FIELDS + self.SAT_FIELDS + self.RHSM_FIELDS
@@ -83,10 +170,85 @@ class VirtConfig(object):
             setattr(self, field, None)
 
         self.logger = logging.getLogger('virt-who-tui')
-        hdlr = logging.FileHandler(self.LOG_FILE)
-        self.logger.addHandler(hdlr)
+        if not self.logger.handlers:
+            hdlr = logging.FileHandler(self.LOG_FILE)
+            self.logger.addHandler(hdlr)
         self.logger.setLevel(logging.DEBUG)
 
+    def clone(self):
+        """
+        Return a copy of the settings sharing the loaded resources, such as
+        the RHSM configuration, the logger and the caches.
+        """
+        other = copy.copy(self)
+        other._model = self._model.copy()
+        other._derived = dict(self._derived)
+        other.pending = []
+        return other
+
+    def __setattr__(self, name, value):
+        # The settings are still read as attributes, the model tracks their changes
+        model = self.__dict__.get("_model")
+        if model is not None and name in model:
+            model.set(name, value)
+        object.__setattr__(self, name, value)
+
+    def _derive(self, name, fields, build):
+        """
+        Return what build() makes from the settings. It is only built again
+        when one of the fields it depends on has changed.
+        """
+        cached = self._derived.get(name)
+        if cached is not None and not self._model.changed_since(cached[0], fields):
+            return cached[1]
+        version = self._model.version
+        value = build()
+        self._derived[name] = (version, value)
+        return value
+
+    def load_values(self, values):
+        """
+        Set the settings from a dict using the same keys as values()
+        """
+        def to_str(value):
+            # RHSM doesn't work with unicode strings, see populate_inputs()
+            return str(value) if isinstance(value, unicode) else value
+
+        for field in self.all_fields:
+            setattr(self, field, to_str(values.get(field)) or None)
+        self.config_name = to_str(values.get("config_name"))
+        self.smType = values.get("smType") or ("sat" if values.get("sat_server") else "rhsm")
+        self.smType_label = values.get("smType_label")
+        for flag in self.FLAG_FIELDS:
+            setattr(self, flag, bool(values.get(flag, True)))
+
+    def queue_config(self):
+        """
+        Add the current configuration to the configurations to be written
+        """
+        filename = self.filename()
+        self.pending = [p for p in self.pending if p.filename != filename]
+        self.pending.append(PendingConfig(self.config_name, filename, self.get_config(True)))
+        try:
+            self.history.record(self.values())
+        except (IOError, OSError) as e:
+            self.logger.warning("Failed to save the history: %r" % e)
+
+    def start_new_config(self):
+        """
+        Clear the hypervisor settings to configure another hypervisor. The
+        subscription manager settings, the organization and the environment
+        are kept.
+        """
+        self.config_name = None
+        self.encrypt_pass = True
+        for field in self.VIRT_FIELDS:
+            if field not in ["owner", "env"]:
+                setattr(self, field, None)
+
+    def is_pending(self, filename):
+        return any(p.filename == filename for p in self.pending)
+
     def set_type_by_label(self, label):
         self.type = self.VIRT_MAP[label]
 
@@ -135,83 +297,270 @@ class VirtConfig(object):
                 return k
         raise InvalidOption("'%s' is not a supported hypervisor backend." % self.type)
 
-    def validate_integer(self, field):
-        val = getattr(self, field)
-        if val and not val.isdigit():
-            raise InvalidOption("%s must be an integer." % field.replace("rhsm_", "").replace("sat_", "").title())
+    def values(self):
+        """
+        Return the current settings as a dict to be checked by the rules
+        """
+        return self._model.snapshot().as_dict()
+
+    def _validate(self, *groups):
+        error = RULES.first_error(self.values(), groups)
+        if error:
+            raise InvalidOption(error.message)
+
+    def lint(self):
+        """
+        Return all the validation errors of the current settings
+        """
+        groups = RULES.groups()
+        # The RHSM connection details are only needed when reporting to a
+        # custom RHSM, otherwise the registration of the host is used.
+        if not any(getattr(self, field) for field in self.RHSM_FIELDS):
+            groups.remove("rhsm")
+        return RULES.check(self.values(), groups)
 
     def validate_config_name(self):
-        if not self.config_name:
-            raise InvalidOption("Please enter a name for your configuration")
-        elif self.config_name.lower() == "default":
-            raise InvalidOption("'default' is not a valid configuration name. Please enter other name.")
+        self._validate("name")
+
+    def validate_new_config_name(self):
+        self.validate_config_name()
+        if self.is_pending(self.filename()):
+            raise InvalidOption("A configuration named '%s' has already been added." % self.config_name)
 
     def validate_virt_type(self):
-        if not self.type:
-            raise InvalidOption("Please specify a hypervisor backend.")
-        elif self.type not in self.SUPPORTED_VIRT:
-            raise InvalidOption("'%s' is not a supported hypervisor backend." % self.type)
+        self._validate("virt_type")
 
     def validate_sm_type(self):
-        if not self.smType:
-            raise InvalidOption("Please specify where the host/guest associations should be reported.")
+        self._validate("sm_type")
 
     def validate_rhsm_config(self):
-        if self.smType != "rhsm":
-            return
-
-        for field in ["rhsm_hostname", "rhsm_username", "rhsm_password"]:
-            if not getattr(self, field):
-                raise InvalidOption("%s is required." % field.replace("rhsm_", "").title())
-
-        for field in ["rhsm_port", "rhsm_proxy_port"]:
-            self.validate_integer(field)
+        self._validate("rhsm")
 
     def validate_satellite_config(self):
-        if self.smType != "sat":
-            return
-
-        for field in ["sat_server", "sat_username", "sat_password"]:
-            if not getattr(self, field):
-                raise InvalidOption("%s is required." % field.replace("sat_", "").title())
+        self._validate("sat")
 
     def validate_virt_config(self):
-        self.validate_virt_type()
-        if not self.server and self.type not in ['libvirt', 'vdsm', 'fake']:
-            raise InvalidOption("Server is required.")
-
-        if ((self.smType == 'rhsm') and (
-                (self.type in ('esx', 'rhevm', 'hyperv', 'xen')) or
-                (self.type == 'libvirt' and self.server))):
-            if not self.env:
-                raise InvalidOption("Environment is required.")
-            elif not self.owner:
-                raise InvalidOption("Organization is required.")
-
-        if self.type == 'libvirt':
-            if self.server:
-                if ('ssh://' in self.server or '://' not in self.server) and self.password:
-                    raise InvalidOption("Password authentication doesn't work with ssh transport on libvirt backend, please copy your public ssh key to the remote machine.")
+        self._validate("virt_type", "virt")
 
     def get_sm_manager(self, config):
         return RhsmManager(self.logger, config) if self.smType == "rhsm" else Sat5Manager(self.logger, config)
 
+    def set_timeout(self, name, seconds):
+        if name not in self.timeouts:
+            raise KeyError("Unknown operation '%s'. Choose from: %s" % (name, ", ".join(sorted(self.timeouts))))
+        self.timeouts[name] = seconds
+        self.service.timeout = self.timeouts["service"]
+
+    def get_owner(self, config, with_catalog=False):
+        """
+        Get the organization of the registered host and, if 'with_catalog'
+        is True, the catalog over the same connection. Return the
+        organization key, or None, the catalog, or None, and the connection
+        errors.
+        """
+        errors = []
+        owner = None
+        catalog = None
+        manager = self.get_sm_manager(config)
+        with manager.sm_error_handler(errors):
+            manager.connect()
+            owner = manager.connection.getOwner(manager.sm_manager.uuid())
+            if with_catalog:
+                catalog = Catalog.fetch(manager.connection, self.rhsm_username, owner=owner)
+        return (owner["key"] if owner else None), catalog, errors
+
+    def catalog_key(self):
+        hostname = self.rhsm_hostname or self._rhsm_config.get('server', 'hostname')
+        return (str(hostname), str(self.rhsm_prefix or ""), str(self.rhsm_username or ""))
+
+    def get_catalog(self, config):
+        """
+        Fetch the organizations and environments from RHSM. Return the
+        catalog, or None, and the connection errors.
+        """
+        errors = []
+        catalog = None
+        manager = RhsmManager(self.logger, config)
+        with manager.sm_error_handler(errors):
+            manager.connect()
+            uuid = None if self.rhsm_username else manager.sm_manager.uuid()
+            catalog = Catalog.fetch(manager.connection, self.rhsm_username, uuid)
+        return catalog, errors
+
+    def _rhsm_api_check(self, host, port):
+        """
+        Make a lightweight authenticated request to a RHSM endpoint
+        """
+        other = self.clone()
+        other.rhsm_hostname = host
+        other.rhsm_port = str(port)
+        # The hypervisor may not be chosen yet, a local libvirt is always valid
+        other.type = other.type or "libvirt"
+        errors = []
+        manager = RhsmManager(self.logger, other.get_config())
+        with manager.sm_error_handler(errors):
+            manager.connect()
+            manager.ping()
+        if errors:
+            raise ProbeError(errors[0])
+
+    def rank_rhsm_endpoints(self, candidates):
+        """
+        Probe the RHSM endpoints separated by commas. Return their
+        measurements, the fastest first.
+        """
+        default_port = int(self.rhsm_port) if self.rhsm_port and str(self.rhsm_port).isdigit() else 443
+        prober = EndpointProber(self._rhsm_api_check, self.timeouts["sm"])
+        return prober.rank(parse_candidates(candidates, default_port))
+
+    def check_sm_connection(self, config):
+        errors = []
+        manager = self.get_sm_manager(config)
+        with manager.sm_error_handler(errors):
+            manager.connect()
+            manager.logout()
+        return errors
+
+    def server_hosts(self, field, value):
+        """
+        Return the host names of a server setting, given as host names or
+        URLs
+        """
+        if field == "rhsm_hostname":
+            return [host for host, port in parse_candidates(value)]
+        if not value:
+            return []
+        try:
+            host = urlparse(value if "//" in value else "//" + value).hostname
+        except ValueError:
+            return []
+        return [host] if host else []
+
+    def resolve_host(self, host):
+        """
+        Return why a host name can't be resolved, or None. It may take a
+        while, so it shouldn't be called from the user interface.
+        """
+        cached = self._resolved.get(host)
+        if cached and time.time() - cached[0] < self.RESOLVE_TTL:
+            return cached[1]
+        error = None
+        try:
+            socket.getaddrinfo(host, None)
+        except socket.gaierror as e:
+            error = "'%s' can't be resolved: %s" % (host, e.args[-1])
+        self._resolved[host] = (time.time(), error)
+        return error
+
+    def _tls_endpoint(self, server, default_port):
+        """
+        Return the (host, port) of a server given as a host name or an URL,
+        or None if it isn't served over HTTPS.
+        """
+        if not server:
+            return None
+        url = urlparse(server if "//" in server else "//" + server)
+        if url.scheme and url.scheme != "https":
+            return None
+        try:
+            port = url.port or default_port
+        except ValueError:
+            return None
+        return (url.hostname, port) if url.hostname and port else None
+
+    def certificate_endpoints(self):
+        """
+        Return the (host, port) of the servers the configuration connects to
+        over TLS.
+        """
+        endpoints = []
+        if self.smType == "rhsm":
+            hostname = self.rhsm_hostname or self._rhsm_config.get('server', 'hostname')
+            port = self.rhsm_port or self._rhsm_config.get('server', 'port') or 443
+            endpoints.append(self._tls_endpoint(str(hostname), int(port)))
+        elif self.smType == "sat":
+            endpoints.append(self._tls_endpoint(self.sat_server, 443))
+        if self.type == "hyperv":
+            # Hyper-V is only checked when WinRM is used over HTTPS
+            if self.server and self.server.startswith("https://"):
+                endpoints.append(self._tls_endpoint(self.server, 5986))
+        elif self.type in self.VIRT_TLS_PORTS:
+            endpoints.append(self._tls_endpoint(self.server, self.VIRT_TLS_PORTS[self.type]))
+        return [endpoint for endpoint in endpoints if endpoint]
+
+    def fetch_certificates(self, endpoints):
+        """
+        Fetch the certificates of the endpoints which aren't cached yet.
+        Return the DER certificates and the errors by endpoint.
+        """
+        return certs.fetch_certificates(self.certificates.missing(endpoints), self.timeouts["certs"])
+
+    def store_certificates(self, fetched):
+        for (host, port), der in fetched.iteritems():
+            self.certificates.put(host, port, der)
+
+    def certificate_warnings(self, endpoints=None):
+        warnings = []
+        for host, port in (endpoints or self.certificate_endpoints()):
+            try:
+                warnings.extend(self.certificates.warnings(host, port))
+            except certs.CertificateError as e:
+                warnings.append("The certificate of %s can't be read: %s" % (host, e))
+        return warnings
+
     def check_virt_connection(self, config):
+        return self.check_virt_report(config)[0]
+
+    @tracked("check_virt_report")
+    def check_virt_report(self, config):
+        """
+        Perform a one shot report to test the connection to the hypervisor.
+        Return the errors and the measurement of the report: how long it
+        took, how many hypervisors and guests it has and its size.
+        """
+        errors, reports, seconds = self._one_shot_report(config)
+        if errors:
+            return errors, None
+        return errors, self._measure(reports, seconds)
+
+    def probe_hosts(self, config):
+        """
+        Return the errors, the hosts reported by the hypervisor and the
+        measurement of the report, as check_virt_report does.
+        """
+        errors, reports, seconds = self._one_shot_report(config)
+        if errors:
+            return errors, [], None
+        hosts = []
+        for report in reports:
+            hosts.extend(report_hosts(report))
+        return errors, hosts, self._measure(reports, seconds)
+
+    def _measure(self, reports, seconds):
+        measurement = {"seconds": seconds, "hypervisors": 0, "guests": 0, "bytes": 0}
+        for report in reports:
+            hypervisors, guests, size = measure_report(report)
+            measurement["hypervisors"] += hypervisors
+            measurement["guests"] += guests
+            measurement["bytes"] += size
+        return measurement
+
+    def _one_shot_report(self, config):
+        """
+        Return the errors, the reports and the number of seconds it took.
+        """
+        reports = []
+        started = time.time()
         queue  = Queue()
         event  = Event()
         errors = []
         virt = Virt.fromConfig(self.logger, config)
         setattr(virt, 'extra_errors', tempfile.NamedTemporaryFile(prefix='vit-who-error'))
 
-        # vdsm subprocess will output to stdout, so redirect it to a tempfile
+        # Read the name of the vdsm host from its certificate in process
+        # instead of forking openssl for every check
         def _getLocalVdsName(tsPath):
-            p = subprocess.Popen([
-                '/usr/bin/openssl', 'x509', '-noout', '-subject', '-in',
-                '%s/certs/vdsmcert.pem' % tsPath], stderr=virt.extra_errors, stdout=virt.extra_errors, close_fds=True)
-            out, err = p.communicate()
-            if p.returncode != 0:
-                return '0'
-            return re.search('/CN=([^/$\n]+)', out).group(1)
+            return certs.subject_common_name(self.VDSM_CERT % tsPath) or '0'
 
         if isinstance(virt, Vdsm):
             virt._getLocalVdsName = _getLocalVdsName
@@ -226,6 +575,11 @@ class VirtConfig(object):
             sys.stderr = out
             # Perform a one shot report request to test the connection
             virt.start_sync(queue, event, None, True)
+            while True:
+                try:
+                    reports.append(queue.get(True, 0.1))
+                except Empty:
+                    break
         except (VirtError, socket.error) as e:
             errors.append(repr(e))
             virt.extra_errors.seek(0)
@@ -244,7 +598,7 @@ class VirtConfig(object):
             virt.extra_errors.close()
             virt.extra_errors = None
 
-        return errors
+        return errors, reports, time.time() - started
 
     def _encrypt_password(self, field, password, encrypt_password=True):
         # Make sure the encrypt password field is resetted because we don't want to
@@ -259,26 +613,116 @@ class VirtConfig(object):
         getattr(self, field)
 
     def encrypt_passwords(self):
+        fields = ["sat_encrypted_password", "rhsm_encrypted_password", "encrypted_password"]
+        values = self.values()
+        cached = self.steps.get("encrypt", values)
+        if cached:
+            for field, value in zip(fields, cached.value):
+                setattr(self, field, value)
+            return
+
+        started = time.time()
         self._encrypt_password("sat_encrypted_password", self.sat_password, self.sat_encrypt_pass)
         self._encrypt_password("rhsm_encrypted_password", self.rhsm_password, self.rhsm_encrypt_pass)
         self._encrypt_password("encrypted_password", self.password, self.encrypt_pass)
+        self.steps.put("encrypt", values, [getattr(self, field) for field in fields], time.time() - started)
 
     def filename(self):
+        if not safe_name(self.config_name):
+            raise InvalidOption("'%s' is not a valid configuration name." % self.config_name)
         filename = ".".join([self.config_name.lower().replace(" ", "_"), "conf"])
         return "/".join([self.CONFIG_DIR, filename])
 
+    @tracked("to_ini")
     def to_ini(self):
         config = self.get_config(True)
-        with open(self.filename(), 'wb') as fh:
-            config.write(fh)
+        atomic_write(self.filename(), config.write)
 
+    def write_config(self, pending):
+        atomic_write(pending.filename, pending.parser.write)
+
+    def _decrypt_password(self, value):
+        try:
+            return Password.decrypt(unhexlify(value))
+        except (TypeError, ValueError, UnwritableKeyFile, InvalidKeyFile):
+            return value
+
+    def _normalize(self, parser):
+        """
+        Return the settings of a parser as dicts. The encrypted passwords
+        are decrypted, so that the same password encrypted twice is equal.
+        """
+        sections = {}
+        for section in parser.sections():
+            values = dict(parser.items(section, raw=True))
+            for field in self.ENCRYPTED_FIELDS:
+                if values.get(field):
+                    values[field] = self._decrypt_password(values[field])
+            sections[section] = values
+        return sections
+
+    def _diff_lines(self, sections, others=None):
+        lines = []
+        for section in sorted(sections):
+            lines.append("[%s]" % section)
+            for key, value in sorted(sections[section].iteritems()):
+                # Never show the passwords
+                if "password" in key:
+                    changed = others is not None and others.get(section, {}).get(key) != value
+                    value = "********" + (" (changed)" if changed else "")
+                lines.append("%s = %s" % (key, value))
+        return lines
+
+    def config_changes(self, pending=None):
+        """
+        Compare the settings, or a pending configuration, with the existing
+        configuration file. Return None if they are the same, otherwise
+        return the differences as a list of unified diff lines.
+        """
+        if pending is None:
+            pending = PendingConfig(self.config_name, self.filename(), self.get_config(True))
+        filename = pending.filename
+        new = self._normalize(pending.parser)
+        old = {}
+        if os.path.exists(filename):
+            parser = SafeConfigParser()
+            try:
+                parser.read([filename])
+                old = self._normalize(parser)
+            except ConfigParserError:
+                pass
+
+        if old == new:
+            return None
+
+        return list(difflib.unified_diff(self._diff_lines(old), self._diff_lines(new, old),
+                                         filename, "%s (new)" % filename, lineterm=""))
+
+    @tracked("get_config")
     def get_config(self, file=False):
+        """
+        Return the configuration parsed by virt-who or, if 'file' is True,
+        the parser of the configuration file. They are only built again
+        when the settings have changed. Until then the same object is
+        returned to every caller, the pending configurations and the checks
+        included, so it must not be modified.
+        """
+        self.set_rhsm_prefix()
+        if file:
+            return self._derive("parser", self.CONFIG_FIELDS + self.FLAG_FIELDS, lambda: self._build_parser(True))
+        return self._derive("config", self.CONFIG_FIELDS, self._build_config)
+
+    def _build_config(self):
         config = None
+        parser = self._build_parser(False)
+        for section in parser.sections():
+            config = Config.fromParser(section, parser)
+        return config
+
+    def _build_parser(self, file):
         parser = SafeConfigParser()
         parser.add_section(self.config_name)
 
-        self.set_rhsm_prefix()
-
         for field in self.all_fields:
             # Don't want to print clear text password in the file
             if file:
@@ -299,39 +743,17 @@ class VirtConfig(object):
             if value:
                 parser.set(self.config_name, field, value)
 
-        for section in parser.sections():
-            config = Config.fromParser(section, parser)
-
-        if file:
-            return parser
-        else:
-            return config
-
-    def is_rhel6_or_below(self):
-        dist = platform.dist()
-        match = re.match("^([^.]+)", dist[1])
-        if dist[0] in ["redhat", "centos"] and match and int(match.group(0)) < 7:
-            return True
-        return False
-
-    def run_command(self, cmd):
-        fh = tempfile.NamedTemporaryFile(prefix='vit-who-error')
-        p = subprocess.Popen(cmd, stderr=fh, stdout=fh, close_fds=True)
-        out, err = p.communicate()
-        error = None
-        if p.returncode != 0:
-            fh.seek(0)
-            error = fh.read()
-        return error
+        return parser
 
     def start_virt_who(self):
-        cmd = ["/bin/systemctl", "restart", "virt-who"]
-        if self.is_rhel6_or_below():
-            cmd = ["/usr/sbin/service", "virt-who", "restart"]
-        return self.run_command(cmd)
+        return self.service.restart()
 
     def enable_virt_who(self):
-        cmd = ["/bin/systemctl", "enable", "virt-who"]
-        if self.is_rhel6_or_below():
-            cmd = ["/usr/sbin/chkconfig", "virt-who", "on"]
-        return self.run_command(cmd)
+        return self.service.enable()
+
+    def restart_and_enable_virt_who(self):
+        """
+        Restart and enable virt-who. Return an error or None, and the number
+        of seconds virt-who took to become active.
+        """
+        return self.service.restart_and_enable()
@@ -0,0 +1,339 @@
+"""
+A warm process running the hypervisor checks.
+
+The worker is forked before the user interface starts and imports the
+virt-who backends once. The checks are sent to it over a pipe, so they
+don't pay for initializing the backends again, and whatever the backends
+leave behind (memory, threads, sockets) stays out of the user interface.
+The worker is replaced after a number of checks, when it grows past a
+memory ceiling, or when a check is cancelled or times out.
+
+The workers aren't forked from the user interface, which grows, or from
+the daemon, whose threads may hold locks a forked child would wait for
+forever. A small zygote process is forked at launch, before any of them,
+and forks each worker. The connection to a new worker is passed back to
+the parent over the Unix socket of the zygote.
+"""
+import os
+import time
+import errno
+import signal
+import importlib
+import threading
+import traceback
+import _multiprocessing
+from multiprocessing import Process, Pipe
+from multiprocessing.reduction import send_handle, recv_handle
+
+from virt_who_tui import certs
+from virt_who_tui.task import Task, TaskResult
+from virt_who_tui.memtrack import TRACKER, rss
+
+MAX_CHECKS = 20
+MAX_RSS = 256 * 1024 * 1024
+
+BACKENDS = ["esx", "rhevm", "hyperv", "xen", "libvirtd", "vdsm"]
+
+
+def _serve(conn, virt_config, other_end=None, control=None):
+    # Run in a new process group, so that the sub processes started by
+    # the backends are killed with the worker.
+    os.setpgid(0, 0)
+    # The parent must see the end of the connections when it exits
+    for inherited in (other_end, control):
+        if inherited is not None:
+            inherited.close()
+    for backend in BACKENDS:
+        try:
+            importlib.import_module("virtwho.virt.%s" % backend)
+        except Exception:
+            # The backend isn't available, it fails the same way in the check
+            pass
+    # Forget what the user interface has measured before the fork
+    TRACKER.drain()
+
+    while True:
+        try:
+            method, values = conn.recv()
+        except (EOFError, IOError):
+            return
+        try:
+            virt_config.load_values(values)
+            result = (TaskResult.OK, getattr(virt_config, method)(virt_config.get_config()))
+        except Exception as e:
+            result = (TaskResult.ERROR, "%r\n\n%s" % (e, traceback.format_exc()))
+        conn.send(result + (rss(), TRACKER.drain()))
+
+
+def _reap():
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except OSError:
+        # No worker left
+        pass
+
+
+def _zygote(control, virt_config, other_end):
+    other_end.close()
+    # The workers are replaced often, they inherit the parsed certificates
+    for path in virt_config.LOCAL_CERTIFICATES:
+        certs.subject_common_name(path)
+    while True:
+        # Reap the workers which have exited while waiting
+        _reap()
+        try:
+            if not control.poll(1):
+                continue
+            control.recv()
+        except (EOFError, IOError):
+            # The parent has exited, the workers see the end of their
+            # connections and exit too
+            return
+        parent, child = Pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _serve(child, virt_config, parent, control)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+        try:
+            os.setpgid(pid, pid)
+        except OSError:
+            # The worker has already done it
+            pass
+        child.close()
+        send_handle(control, parent.fileno(), None)
+        control.send(pid)
+        parent.close()
+
+
+class Zygote(object):
+    """
+    The process forking the workers, shared by the workers of a VirtConfig
+    """
+    def __init__(self, virt_config):
+        self.virt_config = virt_config
+        self.process = None
+        self.control = None
+        # Held while asking for a worker
+        self.lock = threading.Lock()
+
+    def launch(self):
+        """
+        Fork the zygote, while the process is small and has no thread
+        """
+        if self.process is not None and self.process.is_alive():
+            return
+        parent, child = Pipe()
+        self.process = Process(target=_zygote, args=(child, self.virt_config, parent))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.control = parent
+
+    def spawn(self):
+        """
+        Fork a worker. Return the connection to it and its pid.
+        """
+        with self.lock:
+            self.launch()
+            self.control.send("spawn")
+            fd = recv_handle(self.control)
+            pid = self.control.recv()
+        return _multiprocessing.Connection(fd), pid
+
+    def shutdown(self):
+        if self.process is not None:
+            self.control.close()
+            self.process.join()
+            self.process = None
+            self.control = None
+
+
+class CheckWorker(object):
+    """
+    The worker process of a VirtConfig. Its methods taking the configuration
+    parsed by virt-who, such as check_virt_report(config), can be run in the
+    worker by name.
+    """
+    def __init__(self, virt_config, max_checks=MAX_CHECKS, max_rss=MAX_RSS, zygote=None):
+        self.virt_config = virt_config
+        self.max_checks = max_checks
+        self.max_rss = max_rss
+        self.zygote = zygote or Zygote(virt_config)
+        self.pid = None
+        self.conn = None
+        self.checks = 0
+        # Held while a check is running
+        self.lock = threading.Lock()
+
+    def alive(self):
+        if self.pid is None:
+            return False
+        try:
+            os.kill(self.pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def launch(self):
+        self.zygote.launch()
+
+    def start(self):
+        if self.alive():
+            return
+        self.conn, self.pid = self.zygote.spawn()
+        self.checks = 0
+
+    def stop(self):
+        """
+        Kill the worker, e.g. because a check is taking too long. The
+        zygote reaps it.
+        """
+        if self.pid is None:
+            return
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+        self.conn.close()
+        self.pid = None
+        self.conn = None
+
+    def shutdown(self):
+        """
+        Stop the worker and the zygote
+        """
+        self.stop()
+        self.zygote.shutdown()
+
+    def restart(self):
+        # Warm up the next worker while the user looks at the result
+        self.stop()
+        self.start()
+
+    def send(self, method, values):
+        self.start()
+        self.conn.send((method, values))
+        return self.conn
+
+    def receive(self):
+        """
+        Return the status and the value of the check which was sent
+        """
+        try:
+            status, value, used, records = self.conn.recv()
+        except (EOFError, IOError):
+            self.stop()
+            return TaskResult.ERROR, "The worker exited unexpectedly"
+
+        TRACKER.merge(records, " (worker)")
+        self.checks += 1
+        if self.checks >= self.max_checks or used > self.max_rss:
+            self.restart()
+        return status, value
+
+    def run(self, method, values, timeout=None, wait=True):
+        """
+        Run a check and wait for its TaskResult. This is the blocking
+        counterpart of WorkerTask. Return None if the worker is busy and
+        'wait' is False.
+        """
+        if not self.lock.acquire(wait):
+            return None
+        started = time.time()
+        try:
+            conn = self.send(method, values)
+            if conn.poll(timeout):
+                result = TaskResult(*self.receive())
+            else:
+                self.restart()
+                result = TaskResult(TaskResult.TIMEOUT, timeout=timeout)
+        finally:
+            self.lock.release()
+        result.elapsed = time.time() - started
+        return result
+
+
+class WorkerPool(object):
+    """
+    Several workers forked by the zygote of a CheckWorker, to run checks
+    at the same time
+    """
+    def __init__(self, worker, size):
+        self.workers = [worker] + [CheckWorker(worker.virt_config, worker.max_checks, worker.max_rss, worker.zygote)
+                                   for _ in xrange(size - 1)]
+
+    def __len__(self):
+        return len(self.workers)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def run(self, method, values, timeout=None):
+        """
+        Run a check in an idle worker and return its TaskResult. Return
+        None if all the workers are busy.
+        """
+        for worker in self.workers:
+            result = worker.run(method, values, timeout, wait=False)
+            if result is not None:
+                return result
+        return None
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers[0].zygote.shutdown()
+
+
+class WorkerTask(Task):
+    """
+    Run a check in the worker and call on_done with a TaskResult from the
+    urwid main loop, like a Task. A check which doesn't complete kills the
+    worker, a new one is started for the next check.
+    """
+    def __init__(self, loop, worker, method, values, timeout=None, on_done=None):
+        super(WorkerTask, self).__init__(loop, None, (), timeout, on_done)
+        self.worker = worker
+        self.method = method
+        self.values = values
+        self.replied = False
+        self.locked = False
+
+    def start(self):
+        self.started = time.time()
+        if not self.worker.lock.acquire(False):
+            # Fail this check only, from the main loop like the others
+            self._alarm = self.loop.set_alarm_in(0, self._on_busy)
+            return self
+        self.locked = True
+        self.conn = self.worker.send(self.method, self.values)
+        self._watch = self.loop.watch_file(self.conn.fileno(), self._on_ready)
+        if self.timeout:
+            self._alarm = self.loop.set_alarm_in(self.timeout, self._on_timeout)
+        return self
+
+    def _on_ready(self):
+        self.replied = True
+        self._finish(TaskResult(*self.worker.receive()))
+
+    def _on_busy(self, loop, user_data):
+        self._alarm = None
+        self._finish(TaskResult(TaskResult.ERROR, "The worker is already running another check"))
+
+    def kill(self):
+        if not self.replied:
+            self.worker.restart()
+
+    def _release(self, result):
+        if not self.locked:
+            return
+        self.kill()
+        self.worker.lock.release()